@@ -93,6 +93,7 @@ def CommonChecks(input_api, output_api):
           input_api,
           output_api,
           unit_tests=[
+              J('.', 'fast_local_dev_server_test.py'),
               J('.', 'list_class_verification_failures_test.py'),
               J('.', 'convert_dex_profile_tests.py'),
               J('gyp', 'create_unwind_table_tests.py'),
@@ -106,9 +107,13 @@ def CommonChecks(input_api, output_api):
               J('gyp', 'util', 'build_utils_test.py'),
               J('gyp', 'util', 'manifest_utils_test.py'),
               J('gyp', 'util', 'md5_check_test.py'),
+              J('gyp', 'util', 'parallel_test.py'),
               J('gyp', 'util', 'resource_utils_test.py'),
+              J('pylib', 'base', 'base_test_result_test.py'),
               J('pylib', 'base', 'output_manager_test_case.py'),
+              J('pylib', 'base', 'test_collection_test.py'),
               J('pylib', 'constants', 'host_paths_unittest.py'),
+              J('pylib', 'dex', 'dex_parser_test.py'),
               J('pylib', 'gtest', 'gtest_test_instance_test.py'),
               J('pylib', 'instrumentation', 'instrumentation_parser_test.py'),
               J('pylib', 'instrumentation',
@@ -126,13 +131,17 @@ def CommonChecks(input_api, output_api):
               J('pylib', 'results', 'flakiness_dashboard',
                 'json_results_generator_unittest.py'),
               J('pylib', 'results', 'json_results_test.py'),
+              J('pylib', 'symbols', 'expensive_line_transformer_test.py'),
               J('pylib', 'utils', 'chrome_proxy_utils_test.py'),
               J('pylib', 'utils', 'code_coverage_utils_test.py'),
               J('pylib', 'utils', 'decorators_test.py'),
               J('pylib', 'utils', 'device_dependencies_test.py'),
               J('pylib', 'utils', 'dexdump_test.py'),
               J('pylib', 'utils', 'gold_utils_test.py'),
+              J('pylib', 'utils', 'run_metrics_test.py'),
               J('pylib', 'utils', 'test_filter_test.py'),
+              J('pylib', 'utils', 'test_list_cache_test.py'),
+              J('pylib', 'utils', 'test_timing_db_test.py'),
           ],
           env=pylib_test_env))
 
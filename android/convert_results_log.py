@@ -0,0 +1,68 @@
+#!/usr/bin/env vpython3
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Converts a test_runner.py --json-results-log into other formats.
+
+Works on logs of runs that were killed, e.g. to report their partial results
+or to resume them by skipping the tests that already passed.
+"""
+
+import argparse
+import logging
+import sys
+
+from pylib.results import json_results
+
+
+def _WriteResumeFilter(all_raw_results, path):
+  passed = set()
+  for tries in all_raw_results:
+    for test_run_results in tries:
+      passed.update(r.GetName() for r in test_run_results.GetPass())
+  with open(path, 'w') as f:
+    f.write('# Tests that passed in the run being resumed.\n')
+    for name in sorted(passed):
+      # '#' starts a comment in filter files. Instrumentation test filters
+      # also accept '.' between class and method.
+      f.write('-%s\n' % name.replace('#', '.'))
+  logging.info('Wrote filter excluding %d passed tests to %s', len(passed),
+               path)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('results_log', help='Log to convert.')
+  parser.add_argument('--json-results-file',
+                      help='Write results in the format of '
+                      '--json-results-file to this path.')
+  parser.add_argument('--isolated-script-test-output',
+                      help='Write results in the JSON Test Results Format to '
+                      'this path.')
+  parser.add_argument('--resume-filter-file',
+                      help='Write a filter file excluding tests that passed, '
+                      'for use with --test-launcher-filter-file.')
+  parser.add_argument('-v', '--verbose', action='store_true')
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+  complete = True
+  if args.json_results_file:
+    complete = json_results.GenerateJsonResultsFileFromLog(
+        args.results_log, args.json_results_file, indent=2)
+  if args.isolated_script_test_output:
+    complete = json_results.GenerateJsonTestResultFormatFileFromLog(
+        args.results_log, args.isolated_script_test_output, indent=2)
+  if args.resume_filter_file:
+    all_raw_results, _, complete = json_results.ReadResultsLog(
+        args.results_log)
+    _WriteResumeFilter(all_raw_results, args.resume_filter_file)
+
+  if not complete:
+    logging.warning('%s is from a run that did not finish.', args.results_log)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -7,19 +7,35 @@
 from __future__ import annotations
 
 import argparse
+import collections
+import contextlib
+import functools
+import heapq
+import itertools
 import json
 import os
-import queue
 import shutil
+import signal
 import socket
 import subprocess
 import sys
+import tempfile
 import threading
-from typing import Callable, Dict, List, Optional, Tuple
+import time
+from typing import Callable, Deque, Dict, List, Optional, Tuple
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'gyp'))
 from util import server_utils
 
+_DEFAULT_HISTORY_FILE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'fast_local_dev_server', 'task_durations.json')
+# Number of recently completed tasks to report latencies for.
+_NUM_RECENT_TASKS = 100
+# Tasks queued for longer than this are started before quicker ones, so that
+# long tasks are not starved by a steady stream of short ones.
+_MAX_QUEUE_SECONDS = 60
+
 
 def log(msg: str, *, end: str = ''):
   # Shrink the message (leaving a 2-char prefix and use the rest of the room
@@ -48,6 +64,10 @@ class TaskStats:
   def no_running_processes(cls):
     return cls._num_processes == 0
 
+  @classmethod
+  def num_running_processes(cls):
+    return cls._num_processes
+
   @classmethod
   def add_task(cls):
     # Only the main thread calls this, so there is no need for locking.
@@ -68,6 +88,15 @@ class TaskStats:
     with cls._lock:
       cls._completed_tasks += 1
 
+  @classmethod
+  def get_counts(cls) -> dict:
+    with cls._lock:
+      return {
+          'processes': cls._num_processes,
+          'completed': cls._completed_tasks,
+          'total': cls._total_tasks,
+      }
+
   @classmethod
   def prefix(cls):
     # Ninja's prefix is: [205 processes, 6/734 @ 6.5/s : 0.922s ]
@@ -80,28 +109,198 @@ class TaskStats:
               f'{cls._completed_tasks}/{cls._total_tasks}')
 
 
-class TaskManager:
-  """Class to encapsulate a threadsafe queue and handle deactivating it."""
+class TaskHistory:
+  """Class to estimate task durations from previous runs, saved to disk."""
+
+  # Weight given to the latest run when updating a task's estimate.
+  _NEW_SAMPLE_WEIGHT = 0.5
+  # Save after this many new samples so that history survives a crash.
+  _SAVE_INTERVAL = 20
 
-  def __init__(self):
-    self._queue: queue.SimpleQueue[Task] = queue.SimpleQueue()
+  def __init__(self, path: Optional[str]):
+    self._path = path
+    self._lock = threading.Lock()
+    self._durations: Dict[str, float] = {}
+    self._num_unsaved = 0
+    if path and os.path.exists(path):
+      try:
+        with open(path) as f:
+          durations = json.load(f)
+        if not isinstance(durations, dict) or not all(
+            isinstance(v, (int, float)) for v in durations.values()):
+          raise ValueError('Expected a dict of durations.')
+        self._durations = durations
+      except (OSError, ValueError) as e:
+        log(f'Ignoring unreadable task history {path}: {e}', end='\n')
+    self._total = sum(self._durations.values())
+
+  def estimate(self, name: str) -> float:
+    """Returns the expected duration in seconds of the named task."""
+    with self._lock:
+      if name in self._durations:
+        return self._durations[name]
+      # Assume that unknown tasks take an average amount of time.
+      if self._durations:
+        return self._total / len(self._durations)
+      return 0.0
+
+  def record(self, name: str, duration: float):
+    with self._lock:
+      old = self._durations.get(name)
+      if old is not None:
+        duration = (self._NEW_SAMPLE_WEIGHT * duration +
+                    (1 - self._NEW_SAMPLE_WEIGHT) * old)
+        self._total -= old
+      self._durations[name] = duration
+      self._total += duration
+      self._num_unsaved += 1
+      should_save = self._num_unsaved >= self._SAVE_INTERVAL
+    if should_save:
+      self.save()
+
+  def save(self):
+    """Writes the history to disk. Failures are logged rather than raised."""
+    if not self._path:
+      return
+    with self._lock:
+      if not self._num_unsaved:
+        return
+      self._num_unsaved = 0
+      data = json.dumps(self._durations, indent=2, sort_keys=True)
+    dir_path = os.path.dirname(self._path)
+    tmp_path = None
+    try:
+      os.makedirs(dir_path, exist_ok=True)
+      # A unique temporary file allows several servers to share the history.
+      with tempfile.NamedTemporaryFile('w',
+                                       dir=dir_path,
+                                       suffix='.tmp',
+                                       delete=False) as f:
+        tmp_path = f.name
+        f.write(data)
+      os.replace(tmp_path, self._path)
+    except OSError as e:
+      log(f'Failed to save task history {self._path}: {e}', end='\n')
+      if tmp_path:
+        with contextlib.suppress(OSError):
+          os.unlink(tmp_path)
+
+
+class TaskManager:
+  """Class to encapsulate a threadsafe priority queue and handle deactivating it.
+
+  Tasks that are expected to finish soonest are started first, which drains a
+  large backlog (e.g. after a rebase) with the least total waiting. Tasks that
+  have been queued for more than |max_queue_seconds| are started first instead,
+  oldest first, so that long tasks still make progress.
+  """
+
+  def __init__(self,
+               history: TaskHistory,
+               max_jobs: Optional[int] = None,
+               max_queue_seconds: float = _MAX_QUEUE_SECONDS):
+    self._history = history
+    self._max_jobs = max_jobs
+    self._max_queue_seconds = max_queue_seconds
+    self._lock = threading.Lock()
+    # Notified whenever a task finishes or is dropped.
+    self._idle_condition = threading.Condition(self._lock)
+    # Entries are (estimated duration, sequence number, task). The sequence
+    # number keeps tasks with equal estimates in FIFO order.
+    self._heap: List[Tuple[float, int, Task]] = []
+    self._counter = itertools.count()
+    # The same tasks in the order they were queued, to find overdue ones.
+    self._fifo: Deque[Task] = collections.deque()
+    # Only the most recent task for each key is started. Superseded tasks, and
+    # tasks already started from the other queue, are skipped when they reach
+    # the front of the heap or of the fifo.
+    self._queued: Dict[Tuple[str, str], Task] = {}
+    self._running: Dict[Tuple[str, str], Task] = {}
+    self._recent: Deque[Task] = collections.deque(maxlen=_NUM_RECENT_TASKS)
     self._deactivated = False
 
   def add_task(self, task: Task):
     assert not self._deactivated
     TaskStats.add_task()
-    self._queue.put(task)
+    estimate = self._history.estimate(task.name)
+    with self._lock:
+      self._queued[task.key] = task
+      heapq.heappush(self._heap, (estimate, next(self._counter), task))
+      self._fifo.append(task)
     log(f'QUEUED {task.name}')
     self._maybe_start_tasks()
 
   def deactivate(self):
     self._deactivated = True
-    while not self._queue.empty():
-      try:
-        task = self._queue.get_nowait()
-      except queue.Empty:
-        return
+    with self._lock:
+      tasks = list(self._queued.values())
+      self._queued.clear()
+      self._heap.clear()
+      self._fifo.clear()
+    for task in tasks:
       task.terminate()
+    self._history.save()
+    with self._lock:
+      self._idle_condition.notify_all()
+
+  def _is_idle(self):
+    return not self._queued and not self._running
+
+  def wait_until_idle(self, timeout: Optional[float] = None) -> bool:
+    """Blocks until no tasks are queued or running. Returns False on timeout."""
+    with self._lock:
+      return self._idle_condition.wait_for(self._is_idle, timeout)
+
+  def get_status(self) -> dict:
+    """Returns task counts and per-task stats as a JSON-able dict."""
+    now = time.time()
+    with self._lock:
+      return {
+          **TaskStats.get_counts(),
+          'queued': len(self._queued),
+          'max_jobs': self._max_jobs,
+          'running': [t.get_status(now) for t in self._running.values()],
+          'recent': [t.get_status(now) for t in self._recent],
+      }
+
+  def _is_queued(self, task: Task) -> bool:
+    return self._queued.get(task.key) is task
+
+  def _pop_task(self) -> Optional[Task]:
+    with self._lock:
+      while self._fifo and not self._is_queued(self._fifo[0]):
+        self._fifo.popleft()
+      task = None
+      if (self._fifo and time.time() - self._fifo[0].queued_time >=
+          self._max_queue_seconds):
+        task = self._fifo.popleft()
+      while task is None and self._heap:
+        task = heapq.heappop(self._heap)[2]
+        if not self._is_queued(task):
+          task = None
+      if task is not None:
+        del self._queued[task.key]
+        self._running[task.key] = task
+      return task
+
+  def _on_task_complete(self, task: Task):
+    try:
+      # Record before waking up waiters so that an idle server has an up to
+      # date history.
+      if task.duration is not None:
+        self._history.record(task.name, task.duration)
+    finally:
+      # Queued tasks must still be started even if the history is broken.
+      with self._lock:
+        if self._running.get(task.key) is task:
+          del self._running[task.key]
+        self._recent.append(task)
+        self._idle_condition.notify_all()
+      self._maybe_start_tasks()
+
+  def _at_max_jobs(self):
+    return (self._max_jobs is not None
+            and TaskStats.num_running_processes() >= self._max_jobs)
 
   @staticmethod
   def _num_running_processes():
@@ -126,13 +325,20 @@ class TaskManager:
     # chance where multiple threads call _maybe_start_tasks and each gets to
     # spawn up to 2 new tasks, but since the only downside is some build tasks
     # get worked on earlier rather than later, it is not worth mitigating.
-    while num_started < 2 and (TaskStats.no_running_processes()
-                               or num_started + cur_load < os.cpu_count()):
-      try:
-        next_task = self._queue.get_nowait()
-      except queue.Empty:
+    while (num_started < 2 and not self._at_max_jobs()
+           and (TaskStats.no_running_processes()
+                or num_started + cur_load < os.cpu_count())):
+      next_task = self._pop_task()
+      if next_task is None:
         return
-      num_started += next_task.start(self._maybe_start_tasks)
+      started = next_task.start(
+          functools.partial(self._on_task_complete, next_task))
+      if not started:
+        # Terminated after being popped, so it will never complete.
+        with self._lock:
+          self._running.pop(next_task.key, None)
+          self._idle_condition.notify_all()
+      num_started += started
 
 
 # TODO(wnwen): Break this into Request (encapsulating what ninja sends) and Task
@@ -152,10 +358,36 @@ class Task:
     self._proc: Optional[subprocess.Popen] = None
     self._thread: Optional[threading.Thread] = None
     self._return_code: Optional[int] = None
+    self.queued_time = time.time()
+    self._start_time: Optional[float] = None
+    self._end_time: Optional[float] = None
+    self._cpu_time: Optional[float] = None
+    self._max_rss_kb: Optional[int] = None
 
   @property
   def key(self):
-    return (self.cwd, self.name)
+    # Requests for the same stamp file supersede each other.
+    return (self.cwd, self.stamp_file)
+
+  @property
+  def duration(self) -> Optional[float]:
+    """Run time in seconds, or None if the task did not run to completion."""
+    if self._terminated or self._end_time is None:
+      return None
+    return self._end_time - self._start_time
+
+  def get_status(self, now: float) -> dict:
+    start_time = self._start_time or now
+    end_time = self._end_time or now
+    return {
+        'name': self.name,
+        'queue_latency': start_time - self.queued_time,
+        'run_time': end_time - start_time if self._start_time else None,
+        'cpu_time': self._cpu_time,
+        'max_rss_kb': self._max_rss_kb,
+        'return_code': self._return_code,
+        'terminated': self._terminated,
+    }
 
   def start(self, on_complete_callback: Callable[[], None]) -> int:
     """Starts the task if it has not already been terminated.
@@ -175,6 +407,7 @@ class Task:
       # tasks since we want to avoid slowing down the actual build.
       # TODO(wnwen): Use ionice to reduce resource consumption.
       TaskStats.add_process()
+      self._start_time = time.time()
       log(f'STARTING {self.name}')
       # This use of preexec_fn is sufficiently simple, just one os.nice call.
       # pylint: disable=subprocess-popen-preexec-fn
@@ -206,8 +439,12 @@ class Task:
     # Since we have just set self._terminate to true inside of _lock, we know
     # that neither _proc nor _thread will be changed from this point onwards.
     if self._proc:
-      self._proc.terminate()
-      self._proc.wait()
+      # Only the task's thread reaps the process, and it does so while holding
+      # _lock, so the pid cannot have been reused by another process yet. Avoid
+      # Popen.terminate() since it polls, which could reap the process too.
+      with self._lock:
+        if self._proc.returncode is None:
+          os.kill(self._proc.pid, signal.SIGTERM)
     # Ensure that self._complete is called either by the thread or by us.
     if self._thread:
       self._thread.join()
@@ -217,9 +454,21 @@ class Task:
   def _complete_when_process_finishes(self,
                                       on_complete_callback: Callable[[], None]):
     assert self._proc
-    # We know Popen.communicate will return a str and not a byte since it is
-    # constructed with text=True.
-    stdout: str = self._proc.communicate()[0]
+    # We know this will return a str and not a byte since it is constructed
+    # with text=True.
+    stdout: str = self._proc.stdout.read()
+    self._proc.stdout.close()
+    # Wait for the process to exit without reaping it so that terminate() can
+    # still signal it until it is reaped below.
+    os.waitid(os.P_PID, self._proc.pid, os.WEXITED | os.WNOWAIT)
+    with self._lock:
+      # Reap with wait4() rather than Popen.wait() so that the resource usage of
+      # the process is available.
+      _, status, rusage = os.wait4(self._proc.pid, 0)
+      self._proc.returncode = os.waitstatus_to_exitcode(status)
+    self._cpu_time = rusage.ru_utime + rusage.ru_stime
+    self._max_rss_kb = rusage.ru_maxrss
+    self._end_time = time.time()
     self._return_code = self._proc.returncode
     TaskStats.remove_process()
     self._complete(stdout)
@@ -278,19 +527,66 @@ def _listen_for_request_data(sock: socket.socket):
         if not data:
           break
         received.append(data)
-    if received:
-      yield json.loads(b''.join(received))
+      # The connection stays open while the request is handled so that queries
+      # can be replied to.
+      if received:
+        yield conn, json.loads(b''.join(received))
 
 
-def _process_requests(sock: socket.socket):
+def _send_reply(conn: socket.socket, reply: dict):
+  try:
+    conn.sendall(json.dumps(reply).encode('utf8'))
+  except OSError:
+    pass  # The client has gone away.
+
+
+def _reply_when_idle(conn: socket.socket, task_manager: TaskManager,
+                     timeout: Optional[float]):
+  with conn:
+    idle = task_manager.wait_until_idle(timeout)
+    _send_reply(conn, {'idle': idle, **task_manager.get_status()})
+
+
+def _print_status(status: dict):
+  print(f'{status["processes"]} running processes, {status["queued"]} queued, '
+        f'{status["completed"]}/{status["total"]} completed')
+  for title, tasks in (('Running', status['running']),
+                       ('Recent', status['recent'])):
+    if not tasks:
+      continue
+    print(f'{title}:')
+    for task in tasks:
+      cpu_time = task['cpu_time']
+      max_rss_kb = task['max_rss_kb']
+      print(f'  {task["name"]}: queued {task["queue_latency"]:.1f}s, '
+            f'ran {task["run_time"] or 0:.1f}s' +
+            (f', cpu {cpu_time:.1f}s' if cpu_time is not None else '') +
+            (f', max rss {max_rss_kb // 1024}MiB'
+             if max_rss_kb is not None else ''))
+
+
+def _process_requests(sock: socket.socket, history_file: Optional[str],
+                      max_jobs: Optional[int]):
   # Since dicts in python can contain anything, explicitly type tasks to help
   # make static type checking more useful.
   tasks: Dict[Tuple[str, str], Task] = {}
-  task_manager = TaskManager()
+  task_manager = TaskManager(TaskHistory(history_file), max_jobs)
   try:
     log('READY... Remember to set android_static_analysis="build_server" in '
         'args.gn files')
-    for data in _listen_for_request_data(sock):
+    for conn, data in _listen_for_request_data(sock):
+      message_type = data.get('message_type', server_utils.ADD_TASK)
+      if message_type == server_utils.QUERY_STATUS:
+        _send_reply(conn, task_manager.get_status())
+        continue
+      if message_type == server_utils.WAIT_FOR_IDLE:
+        # Reply from another thread so that new requests are still accepted.
+        # The connection is duplicated since the original is closed once this
+        # request has been handled.
+        threading.Thread(target=_reply_when_idle,
+                         args=(conn.dup(), task_manager, data.get('timeout')),
+                         daemon=True).start()
+        continue
       task = Task(name=data['name'],
                   cwd=data['cwd'],
                   cmd=data['cmd'],
@@ -316,6 +612,27 @@ def main():
       '--fail-if-not-running',
       action='store_true',
       help='Used by GN to fail fast if the build server is not running.')
+  parser.add_argument('--print-status',
+                      action='store_true',
+                      help='Print stats of the running build server and exit.')
+  parser.add_argument('--wait-for-idle',
+                      action='store_true',
+                      help='Wait until the running build server has no queued '
+                      'or running tasks, then print its stats and exit.')
+  parser.add_argument('--timeout',
+                      type=float,
+                      help='Seconds to wait for --wait-for-idle.')
+  parser.add_argument('--json',
+                      action='store_true',
+                      help='Print stats as JSON rather than a summary.')
+  parser.add_argument('--max-jobs',
+                      type=int,
+                      help='Maximum number of tasks to run at once. Default is '
+                      'limited only by system load.')
+  parser.add_argument('--history-file',
+                      default=_DEFAULT_HISTORY_FILE,
+                      help='Where to store task durations, which are used to '
+                      'run quick tasks first. Pass "" to disable.')
   args = parser.parse_args()
   if args.fail_if_not_running:
     with socket.socket(socket.AF_UNIX) as sock:
@@ -329,10 +646,24 @@ def main():
         return 1
       else:
         return 0
+  if args.print_status or args.wait_for_idle:
+    try:
+      if args.wait_for_idle:
+        status = server_utils.WaitForIdle(args.timeout)
+      else:
+        status = server_utils.QueryStatus()
+    except socket.error:
+      print('Build server is not running.')
+      return 1
+    if args.json:
+      print(json.dumps(status, indent=2))
+    else:
+      _print_status(status)
+    return 0 if status.get('idle', True) else 1
   with socket.socket(socket.AF_UNIX) as sock:
     sock.bind(server_utils.SOCKET_ADDRESS)
     sock.listen()
-    _process_requests(sock)
+    _process_requests(sock, args.history_file, args.max_jobs)
   return 0
 
 
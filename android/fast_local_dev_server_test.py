@@ -0,0 +1,239 @@
+#!/usr/bin/env vpython3
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# pylint: disable=protected-access
+
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import fast_local_dev_server
+from util import server_utils
+
+# Fails the test instead of hanging when the server never becomes idle.
+_IDLE_TIMEOUT = 30
+
+
+class TaskHistoryTest(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    self._path = os.path.join(self._tmp_dir.name, 'history',
+                              'task_durations.json')
+
+  def tearDown(self):
+    self._tmp_dir.cleanup()
+
+  def _WriteHistory(self, contents):
+    os.makedirs(os.path.dirname(self._path), exist_ok=True)
+    with open(self._path, 'w') as f:
+      f.write(contents)
+
+  def testEstimate(self):
+    history = fast_local_dev_server.TaskHistory(None)
+    self.assertEqual(0, history.estimate('a'))
+    history.record('a', 2)
+    history.record('b', 4)
+    self.assertEqual(2, history.estimate('a'))
+    # Unknown tasks are assumed to take the average time.
+    self.assertEqual(3, history.estimate('c'))
+    history.record('a', 4)
+    self.assertEqual(3, history.estimate('a'))
+
+  def testSaveAndLoad(self):
+    history = fast_local_dev_server.TaskHistory(self._path)
+    history.record('a', 2)
+    history.save()
+    self.assertEqual(['task_durations.json'],
+                     os.listdir(os.path.dirname(self._path)))
+    self.assertEqual(2, fast_local_dev_server.TaskHistory(
+        self._path).estimate('a'))
+
+  def testSavesEveryInterval(self):
+    history = fast_local_dev_server.TaskHistory(self._path)
+    for i in range(history._SAVE_INTERVAL - 1):
+      history.record(str(i), 1)
+    self.assertFalse(os.path.exists(self._path))
+    history.record('last', 1)
+    with open(self._path) as f:
+      self.assertEqual(history._SAVE_INTERVAL, len(json.load(f)))
+
+  def testCorruptFile(self):
+    for contents in ('{"a": 1', '[1, 2]', '{"a": "slow"}'):
+      self._WriteHistory(contents)
+      history = fast_local_dev_server.TaskHistory(self._path)
+      self.assertEqual(0, history.estimate('a'))
+      # The corrupt file is replaced on the next save.
+      history.record('a', 2)
+      history.save()
+      self.assertEqual(2, fast_local_dev_server.TaskHistory(
+          self._path).estimate('a'))
+
+  def testSaveFails(self):
+    # A file where the directory should be makes saving fail.
+    with open(os.path.dirname(self._path), 'w'):
+      pass
+    history = fast_local_dev_server.TaskHistory(self._path)
+    history.record('a', 2)
+    history.save()
+    self.assertEqual(2, history.estimate('a'))
+
+
+def _MakeTask(name, cwd, stamp_file=None, cmd=None):
+  return fast_local_dev_server.Task(name=name,
+                                    cwd=cwd,
+                                    cmd=cmd or [sys.executable, '-c', ''],
+                                    stamp_file=stamp_file or name + '.stamp')
+
+
+class TaskManagerTest(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    self._history = fast_local_dev_server.TaskHistory(None)
+
+  def tearDown(self):
+    self._tmp_dir.cleanup()
+
+  def _MakeTask(self, name, stamp_file=None):
+    return _MakeTask(name, self._tmp_dir.name, stamp_file)
+
+  def _PopAll(self, task_manager):
+    names = []
+    while True:
+      task = task_manager._pop_task()
+      if task is None:
+        return names
+      names.append(task.name)
+
+  def testQuickestTasksFirst(self):
+    self._history.record('slow', 10)
+    self._history.record('medium', 5)
+    self._history.record('quick', 1)
+    # No tasks are started so that the queue order can be checked.
+    task_manager = fast_local_dev_server.TaskManager(self._history, max_jobs=0)
+    for name in ('slow', 'unknown', 'quick', 'medium', 'quick2'):
+      task_manager.add_task(self._MakeTask(name))
+    # Unknown tasks take the average time, and ties keep their queued order.
+    self.assertEqual(['quick', 'medium', 'unknown', 'quick2', 'slow'],
+                     self._PopAll(task_manager))
+
+  def testOverdueTasksFirst(self):
+    self._history.record('slow', 10)
+    self._history.record('quick', 1)
+    task_manager = fast_local_dev_server.TaskManager(self._history,
+                                                     max_jobs=0,
+                                                     max_queue_seconds=0)
+    task_manager.add_task(self._MakeTask('slow'))
+    task_manager.add_task(self._MakeTask('quick'))
+    self.assertEqual(['slow', 'quick'], self._PopAll(task_manager))
+
+  def testSupersededTasks(self):
+    task_manager = fast_local_dev_server.TaskManager(self._history, max_jobs=0)
+    task_manager.add_task(self._MakeTask('old', 'same.stamp'))
+    task_manager.add_task(self._MakeTask('other'))
+    task_manager.add_task(self._MakeTask('new', 'same.stamp'))
+    self.assertEqual(['other', 'new'], self._PopAll(task_manager))
+
+  def testWaitUntilIdleTimeout(self):
+    task_manager = fast_local_dev_server.TaskManager(self._history, max_jobs=0)
+    self.assertTrue(task_manager.wait_until_idle(0))
+    task_manager.add_task(self._MakeTask('a'))
+    self.assertFalse(task_manager.wait_until_idle(0.01))
+    self.assertEqual(1, task_manager.get_status()['queued'])
+    task_manager.deactivate()
+    self.assertTrue(task_manager.wait_until_idle(0))
+
+  def testRunTasks(self):
+    task_manager = fast_local_dev_server.TaskManager(self._history)
+    for name in ('a', 'b', 'c'):
+      task_manager.add_task(self._MakeTask(name))
+    self.assertTrue(task_manager.wait_until_idle(_IDLE_TIMEOUT))
+    status = task_manager.get_status()
+    self.assertEqual([], status['running'])
+    self.assertEqual(['a', 'b', 'c'],
+                     sorted(t['name'] for t in status['recent']))
+    self.assertTrue(all(t['return_code'] == 0 for t in status['recent']))
+    # Durations are recorded for the next run.
+    self.assertEqual(3, len(self._history._durations))
+
+  def testTerminateRunningTask(self):
+    task = _MakeTask('a',
+                     self._tmp_dir.name,
+                     cmd=[sys.executable, '-c', 'import time; time.sleep(60)'])
+    completed = threading.Event()
+    self.assertEqual(1, task.start(completed.set))
+    task.terminate()
+    # The task's thread reaps the process before terminate() returns.
+    self.assertTrue(completed.is_set())
+    status = task.get_status(0)
+    self.assertTrue(status['terminated'])
+    self.assertEqual(-signal.SIGTERM, status['return_code'])
+    self.assertIsNotNone(status['cpu_time'])
+    self.assertIsNone(task.duration)
+
+
+class ServerTest(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    # Avoid talking to a build server that is actually running.
+    address = f'\0fast_local_dev_server_test_{os.getpid()}_{id(self)}'
+    patcher = mock.patch.object(server_utils, 'SOCKET_ADDRESS', address)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    sock = socket.socket(socket.AF_UNIX)
+    self.addCleanup(sock.close)
+    sock.bind(address)
+    sock.listen()
+    # The server runs until the process exits.
+    threading.Thread(target=fast_local_dev_server._process_requests,
+                     args=(sock, None, 0),
+                     daemon=True).start()
+
+  def tearDown(self):
+    self._tmp_dir.cleanup()
+
+  def _AddTask(self, name):
+    # Tasks get no reply, so they cannot use SendRequest().
+    with socket.socket(socket.AF_UNIX) as sock:
+      sock.connect(server_utils.SOCKET_ADDRESS)
+      sock.sendall(
+          json.dumps({
+              'message_type': server_utils.ADD_TASK,
+              'name': name,
+              'cmd': [sys.executable, '-c', ''],
+              'cwd': self._tmp_dir.name,
+              'stamp_file': name + '.stamp',
+          }).encode('utf8'))
+
+  def testQueryStatus(self):
+    status = server_utils.QueryStatus()
+    self.assertEqual(0, status['queued'])
+    self.assertEqual(0, status['max_jobs'])
+    self.assertEqual([], status['running'])
+    self._AddTask('a')
+    self._AddTask('b')
+    # Requests are handled in the order they are received.
+    self.assertEqual(2, server_utils.QueryStatus()['queued'])
+
+  def testWaitForIdle(self):
+    status = server_utils.WaitForIdle(0)
+    self.assertTrue(status['idle'])
+    self._AddTask('a')
+    # With max_jobs=0 the task never starts.
+    status = server_utils.WaitForIdle(0.01)
+    self.assertFalse(status['idle'])
+    self.assertEqual(1, status['queued'])
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -510,17 +510,17 @@ def _ConvertToWebPSingle(png_path, cwebp_binary, cwebp_version, webp_cache_dir):
   return rename_tuple, cache_hit
 
 
-def _ConvertToWebP(cwebp_binary, png_paths, path_info, webp_cache_dir):
+def _ConvertToWebP(pool, cwebp_binary, png_paths, path_info, webp_cache_dir):
   cwebp_version = subprocess.check_output([cwebp_binary, '-version']).rstrip()
   shard_args = [(f, ) for f in png_paths
                 if not _PNG_WEBP_EXCLUSION_PATTERN.match(f)]
 
   build_utils.MakeDirectory(webp_cache_dir)
-  results = parallel.BulkForkAndCall(_ConvertToWebPSingle,
-                                     shard_args,
-                                     cwebp_binary=cwebp_binary,
-                                     cwebp_version=cwebp_version,
-                                     webp_cache_dir=webp_cache_dir)
+  results = pool.Map(_ConvertToWebPSingle,
+                     shard_args,
+                     cwebp_binary=cwebp_binary,
+                     cwebp_version=cwebp_version,
+                     webp_cache_dir=webp_cache_dir)
   total_cache_hits = 0
   for rename_tuple, cache_hit in results:
     path_info.RegisterRename(*rename_tuple)
@@ -546,7 +546,7 @@ def _RemoveImageExtensions(directory, path_info):
             os.path.relpath(path_no_extension, directory))
 
 
-def _CompileSingleDep(index, dep_subdir, keep_predicate, aapt2_path,
+def _CompileSingleDep(index, dep_subdir, keep_patterns, aapt2_path,
                       partials_dir):
   unique_name = '{}_{}'.format(index, os.path.basename(dep_subdir))
   partial_path = os.path.join(partials_dir, '{}.zip'.format(unique_name))
@@ -572,17 +572,21 @@ def _CompileSingleDep(index, dep_subdir, keep_predicate, aapt2_path,
 
   # Filtering these files is expensive, so only apply filters to the partials
   # that have been explicitly targeted.
+  keep_predicate = _CreateValuesKeepPredicate(keep_patterns)
   if keep_predicate:
     logging.debug('Applying .arsc filtering to %s', dep_subdir)
     protoresources.StripUnwantedResources(partial_path, keep_predicate)
   return partial_path
 
 
-def _CreateValuesKeepPredicate(exclusion_rules, dep_subdir):
-  patterns = [
+def _GetValuesKeepPatterns(exclusion_rules, dep_subdir):
+  return [
       x[1] for x in exclusion_rules
       if build_utils.MatchesGlob(dep_subdir, [x[0]])
   ]
+
+
+def _CreateValuesKeepPredicate(patterns):
   if not patterns:
     return None
 
@@ -590,22 +594,25 @@ def _CreateValuesKeepPredicate(exclusion_rules, dep_subdir):
   return lambda x: not any(r.search(x) for r in regexes)
 
 
-def _CompileDeps(aapt2_path, dep_subdirs, dep_subdir_overlay_set, temp_dir,
-                 exclusion_rules):
+def _CompileDeps(pool, aapt2_path, dep_subdirs, dep_subdir_overlay_set,
+                 temp_dir, exclusion_rules):
   partials_dir = os.path.join(temp_dir, 'partials')
   build_utils.MakeDirectory(partials_dir)
 
+  # Patterns rather than predicates are passed since arguments are pickled.
   job_params = [(i, dep_subdir,
-                 _CreateValuesKeepPredicate(exclusion_rules, dep_subdir))
+                 _GetValuesKeepPatterns(exclusion_rules, dep_subdir))
                 for i, dep_subdir in enumerate(dep_subdirs)]
 
-  # Filtering is slow, so ensure jobs with keep_predicate are started first.
+  # Filtering is slow, so ensure jobs with keep patterns are started first.
   job_params.sort(key=lambda x: not x[2])
+  # Each job is slow, so send them one at a time for the best balance.
   partials = list(
-      parallel.BulkForkAndCall(_CompileSingleDep,
-                               job_params,
-                               aapt2_path=aapt2_path,
-                               partials_dir=partials_dir))
+      pool.Map(_CompileSingleDep,
+               job_params,
+               chunk_size=1,
+               aapt2_path=aapt2_path,
+               partials_dir=partials_dir))
 
   partials_cmd = list()
   for i, partial in enumerate(partials):
@@ -730,20 +737,23 @@ def _PackageApk(options, build):
     logging.debug('Applying locale-based string exclusions')
     _RemoveUnwantedLocalizedStrings(dep_subdirs, options)
 
-  if png_paths and options.png_to_webp:
-    logging.debug('Converting png->webp')
-    _ConvertToWebP(options.webp_binary, png_paths, path_info,
-                   options.webp_cache_dir)
-  logging.debug('Applying drawable transformations')
-  for directory in dep_subdirs:
-    _MoveImagesToNonMdpiFolders(directory, path_info)
-    _RemoveImageExtensions(directory, path_info)
-
-  logging.debug('Running aapt2 compile')
-  exclusion_rules = [x.split(':', 1) for x in options.values_filter_rules]
-  partials = _CompileDeps(options.aapt2_path, dep_subdirs,
-                          dep_subdir_overlay_set, build.temp_dir,
-                          exclusion_rules)
+  # Share one pool between webp conversion and aapt2 compile to avoid paying
+  # for forking and tearing down workers twice.
+  with parallel.WorkerPool() as pool:
+    if png_paths and options.png_to_webp:
+      logging.debug('Converting png->webp')
+      _ConvertToWebP(pool, options.webp_binary, png_paths, path_info,
+                     options.webp_cache_dir)
+    logging.debug('Applying drawable transformations')
+    for directory in dep_subdirs:
+      _MoveImagesToNonMdpiFolders(directory, path_info)
+      _RemoveImageExtensions(directory, path_info)
+
+    logging.debug('Running aapt2 compile')
+    exclusion_rules = [x.split(':', 1) for x in options.values_filter_rules]
+    partials = _CompileDeps(pool, options.aapt2_path, dep_subdirs,
+                            dep_subdir_overlay_set, build.temp_dir,
+                            exclusion_rules)
 
   link_command = [
       options.aapt2_path,
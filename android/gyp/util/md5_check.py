@@ -3,12 +3,16 @@
 # found in the LICENSE file.
 
 
+import concurrent.futures
 import difflib
 import hashlib
 import itertools
 import json
+import mmap
 import os
 import sys
+import threading
+import time
 import zipfile
 
 from util import build_utils
@@ -21,6 +25,31 @@ PRINT_EXPLANATIONS = int(os.environ.get('PRINT_BUILD_EXPLANATIONS', 0))
 # An escape hatch that causes all targets to be rebuilt.
 _FORCE_REBUILD = int(os.environ.get('FORCE_REBUILD', 0))
 
+# Directory for the shared content-hash cache. When unset, the cache lives in
+# the output directory containing the record file (found by looking for
+# build.ninja). Set to an empty string to disable the cache.
+_HASH_CACHE_DIR = os.environ.get('MD5_CHECK_HASH_CACHE_DIR')
+_HASH_CACHE_DIRNAME = '.md5_check_hash_cache'
+
+# Smaller files are cheaper to hash than to look up in the cache.
+_HASH_CACHE_MIN_SIZE = 64 * 1024
+
+# Files modified more recently than this are not added to the cache, since a
+# second write within the filesystem's timestamp granularity would not change
+# their cache key.
+_HASH_CACHE_RACY_SECONDS = 2
+
+# Bumped whenever _ComputeHashForPath() changes so that stale entries are not
+# mixed with new ones.
+_HASH_CACHE_VERSION = 2
+
+# Files are hashed in chunks of this size so that memory use stays flat.
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# Inputs are hashed on a thread pool when there are at least this many of them.
+# hashlib releases the GIL while hashing, so this scales with cores.
+_MIN_INPUTS_FOR_THREAD_POOL = 8
+
 
 def CallAndWriteDepfileIfStale(on_stale_md5,
                                options,
@@ -112,15 +141,26 @@ def CallAndRecordIfStale(function,
   new_metadata = _Metadata(track_entries=pass_changes or PRINT_EXPLANATIONS)
   new_metadata.AddStrings(input_strings)
 
+  hash_cache = None
+  hash_cache_dir = _FindHashCacheDir(record_path)
+  if hash_cache_dir:
+    hash_cache = _HashCache(hash_cache_dir)
+
   zip_allowlist = set(track_subpaths_allowlist or [])
+  # It's faster to md5 an entire zip file than it is to just locate & hash
+  # its central directory (which is what this used to do).
+  tags = _ComputeTagsForPaths(
+      [p for p in input_paths if p not in zip_allowlist], hash_cache)
   for path in input_paths:
-    # It's faster to md5 an entire zip file than it is to just locate & hash
-    # its central directory (which is what this used to do).
     if path in zip_allowlist:
       entries = _ExtractZipEntries(path)
       new_metadata.AddZipFile(path, entries)
     else:
-      new_metadata.AddFile(path, _ComputeTagForPath(path))
+      new_metadata.AddFile(path, tags[path])
+
+  if PRINT_EXPLANATIONS and hash_cache:
+    print('Hash cache for %s: %d hits, %d misses' %
+          (record_path, hash_cache.hits, hash_cache.misses))
 
   old_metadata = None
   force = force or _FORCE_REBUILD
@@ -437,16 +477,121 @@ class _Metadata:
     return (entry['path'] for entry in subentries)
 
 
-def _ComputeTagForPath(path):
+class _HashCache:
+  """On-disk cache of file content hashes shared between build actions.
+
+  Entries are stored one file per path, written via an atomic rename, so that
+  concurrent actions need no locking and a path's newer entry replaces its
+  older one. Each entry records the (inode, size, mtime_ns) that its hash is
+  valid for. Failing to read or write an entry only ever results in a re-hash.
+
+  Args:
+    cache_dir: Directory to store entries in.
+  """
+
+  def __init__(self, cache_dir):
+    self._cache_dir = cache_dir
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def _EntryPath(self, path):
+    key = '%d\0%s' % (_HASH_CACHE_VERSION, os.path.abspath(path))
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(self._cache_dir, name[:2], name[2:])
+
+  @staticmethod
+  def _StatKey(stat):
+    return '%d %d %d' % (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+  def Get(self, path, stat):
+    """Returns the cached hash for |path|, or None."""
+    try:
+      with open(self._EntryPath(path)) as f:
+        stat_key, _, ret = f.read().rpartition(' ')
+    except OSError:
+      stat_key, ret = None, None
+    with self._lock:
+      if ret and stat_key == self._StatKey(stat):
+        self.hits += 1
+        return ret
+      self.misses += 1
+    return None
+
+  def Put(self, path, stat, digest):
+    """Records |digest| as the hash of |path|."""
+    if time.time() - stat.st_mtime < _HASH_CACHE_RACY_SECONDS:
+      return
+    entry_path = self._EntryPath(path)
+    tmp_path = '%s.%d.tmp' % (entry_path, os.getpid())
+    try:
+      os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+      with open(tmp_path, 'w') as f:
+        f.write('%s %s' % (self._StatKey(stat), digest))
+      os.replace(tmp_path, entry_path)
+    except OSError:
+      try:
+        os.unlink(tmp_path)
+      except OSError:
+        pass
+
+
+def _FindHashCacheDir(record_path):
+  """Returns the hash cache directory to use for |record_path|, or None."""
+  if _HASH_CACHE_DIR is not None:
+    return _HASH_CACHE_DIR or None
+  cur_dir = os.path.dirname(os.path.abspath(record_path))
+  while True:
+    if os.path.exists(os.path.join(cur_dir, 'build.ninja')):
+      return os.path.join(cur_dir, _HASH_CACHE_DIRNAME)
+    parent_dir = os.path.dirname(cur_dir)
+    if parent_dir == cur_dir:
+      return None
+    cur_dir = parent_dir
+
+
+def _ComputeTagsForPaths(paths, hash_cache=None):
+  """Returns a dict of path -> tag, hashing files concurrently."""
+  paths = set(paths)
+  if len(paths) < _MIN_INPUTS_FOR_THREAD_POOL:
+    return {p: _ComputeTagForPath(p, hash_cache) for p in paths}
+  with concurrent.futures.ThreadPoolExecutor() as executor:
+    tags = executor.map(lambda p: _ComputeTagForPath(p, hash_cache), paths)
+    return dict(zip(paths, tags))
+
+
+def _ComputeTagForPath(path, hash_cache=None):
   stat = os.stat(path)
-  if stat.st_size > 1 * 1024 * 1024:
-    # Fallback to mtime for large files so that md5_check does not take too long
-    # to run.
-    return stat.st_mtime
-  md5 = hashlib.md5()
+  if hash_cache is None or stat.st_size < _HASH_CACHE_MIN_SIZE:
+    return _ComputeHashForPath(path, stat.st_size)
+  ret = hash_cache.Get(path, stat)
+  if ret is None:
+    ret = _ComputeHashForPath(path, stat.st_size)
+    hash_cache.Put(path, stat, ret)
+  return ret
+
+
+def _ComputeHashForPath(path, size):
+  """Returns the content hash of |path|, streamed in fixed-size chunks."""
+  # blake2b is faster than md5 on 64-bit hosts. A 16-byte digest keeps tags the
+  # same length as before.
+  digest = hashlib.blake2b(digest_size=16)
   with open(path, 'rb') as f:
-    md5.update(f.read())
-  return md5.hexdigest()
+    if size == 0:
+      return digest.hexdigest()
+    try:
+      mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+      # Not mappable (e.g. a pipe or a file that was truncated concurrently).
+      mapped = None
+    if mapped is None:
+      for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    else:
+      with mapped, memoryview(mapped) as view:
+        for offset in range(0, len(view), _HASH_CHUNK_SIZE):
+          digest.update(view[offset:offset + _HASH_CHUNK_SIZE])
+  return digest.hexdigest()
 
 
 def _ComputeInlineMd5(iterable):
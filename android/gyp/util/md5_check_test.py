@@ -4,9 +4,11 @@
 # found in the LICENSE file.
 
 import fnmatch
+import hashlib
 import os
 import sys
 import tempfile
+import time
 import unittest
 import zipfile
 
@@ -14,6 +16,9 @@ sys.path.insert(
     0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
 from util import md5_check
 
+# Set to run benchmarks, which are skipped by default since they are slow.
+_RUN_BENCHMARKS = int(os.environ.get('RUN_BENCHMARKS', 0))
+
 
 def _WriteZipFile(path, entries):
   with zipfile.ZipFile(path, 'w') as zip_file:
@@ -173,6 +178,99 @@ class TestMd5Check(unittest.TestCase):
                                         input_file2.name, 'path/1.txt'),
                        added_or_modified_only=False)
 
+  def testHashCache(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      cache = md5_check._HashCache(os.path.join(tmp_dir, 'cache'))
+      path = os.path.join(tmp_dir, 'input.jar')
+      with open(path, 'wb') as f:
+        f.write(b'a' * 2 * 1024 * 1024)
+      # Files modified within the racy window are never cached.
+      tag = md5_check._ComputeTagForPath(path, cache)
+      tag = md5_check._ComputeTagForPath(path, cache)
+      self.assertEqual((0, 2), (cache.hits, cache.misses))
+
+      os.utime(path, (1000, 1000))
+      self.assertEqual(tag, md5_check._ComputeTagForPath(path, cache))
+      self.assertEqual(tag, md5_check._ComputeTagForPath(path, cache))
+      self.assertEqual((1, 3), (cache.hits, cache.misses))
+
+      # A new cache instance shares entries written by the previous one.
+      cache = md5_check._HashCache(os.path.join(tmp_dir, 'cache'))
+      self.assertEqual(tag, md5_check._ComputeTagForPath(path, cache))
+      self.assertEqual((1, 0), (cache.hits, cache.misses))
+
+      with open(path, 'wb') as f:
+        f.write(b'b' * 2 * 1024 * 1024)
+      os.utime(path, (2000, 2000))
+      new_tag = md5_check._ComputeTagForPath(path, cache)
+      self.assertNotEqual(tag, new_tag)
+      self.assertEqual(new_tag, md5_check._ComputeTagForPath(path, cache))
+      self.assertEqual((2, 1), (cache.hits, cache.misses))
+
+      # The new entry replaced the old one.
+      entries = [
+          os.path.join(d, f) for d, _, files in os.walk(
+              os.path.join(tmp_dir, 'cache')) for f in files
+      ]
+      self.assertEqual(1, len(entries))
+
+  def testFindHashCacheDir(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      record_path = os.path.join(tmp_dir, 'gen', 'foo', 'bar.md5.stamp')
+      self.assertIsNone(md5_check._FindHashCacheDir(record_path))
+      with open(os.path.join(tmp_dir, 'build.ninja'), 'w'):
+        pass
+      self.assertEqual(os.path.join(tmp_dir, md5_check._HASH_CACHE_DIRNAME),
+                       md5_check._FindHashCacheDir(record_path))
+
+  def testComputeTagsForPaths(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      paths = []
+      for i, size in enumerate([0, 1, 4096, 3 * 1024 * 1024 + 7] * 4):
+        path = os.path.join(tmp_dir, '%d.bin' % i)
+        with open(path, 'wb') as f:
+          f.write(os.urandom(size))
+        paths.append(path)
+      tags = md5_check._ComputeTagsForPaths(paths)
+      self.assertEqual(len(paths), len(tags))
+      for path in paths:
+        with open(path, 'rb') as f:
+          expected = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        self.assertEqual(expected, tags[path])
+        self.assertEqual(expected, md5_check._ComputeTagForPath(path))
+
+  @unittest.skipUnless(_RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=1 to run.')
+  def testBenchmarkComputeTags(self):
+    def LegacyComputeTag(path):
+      stat = os.stat(path)
+      if stat.st_size > 1 * 1024 * 1024:
+        return stat.st_mtime
+      md5 = hashlib.md5()
+      with open(path, 'rb') as f:
+        md5.update(f.read())
+      return md5.hexdigest()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      paths = []
+      for i in range(5000):
+        size = 4 * 1024 * 1024 if i % 100 == 0 else 16 * 1024
+        path = os.path.join(tmp_dir, '%d.bin' % i)
+        with open(path, 'wb') as f:
+          f.write(os.urandom(size))
+        paths.append(path)
+
+      start = time.time()
+      for path in paths:
+        LegacyComputeTag(path)
+      legacy_time = time.time() - start
+
+      start = time.time()
+      md5_check._ComputeTagsForPaths(paths)
+      new_time = time.time() - start
+      print('\nHashing %d inputs: legacy (mtime over 1MiB)=%.3fs, '
+            'streaming+threaded (all content)=%.3fs' %
+            (len(paths), legacy_time, new_time))
+
 
 if __name__ == '__main__':
   unittest.main()
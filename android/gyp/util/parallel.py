@@ -10,8 +10,10 @@ import atexit
 import logging
 import multiprocessing
 import os
+import pickle
 import sys
 import threading
+import time
 import traceback
 
 DISABLE_ASYNC = os.environ.get('DISABLE_ASYNC') == '1'
@@ -44,19 +46,48 @@ class _ImmediateResult:
     return True
 
 
+class _RemoteTraceback(Exception):
+  """Attached as the __cause__ of exceptions re-raised from child processes."""
+
+  def __str__(self):
+    return 'Originally caused by: ' + self.args[0]
+
+
 class _ExceptionWrapper:
   """Used to marshal exception messages back to main process."""
 
-  def __init__(self, msg, exception_type=None):
+  def __init__(self, msg, exception_type=None, exception=None):
     self.msg = msg
     self.exception_type = exception_type
+    # Set only when the exception itself can be pickled, in which case the
+    # original type is re-raised rather than a builtin one.
+    self.exception = exception
 
   def MaybeThrow(self):
+    if self.exception is not None:
+      raise self.exception from _RemoteTraceback(self.msg)
     if self.exception_type:
       raise getattr(__builtins__,
                     self.exception_type)('Originally caused by: ' + self.msg)
 
 
+def _WrapException(e):
+  """Returns an _ExceptionWrapper for the exception currently being handled."""
+  msg = traceback.format_exc()
+  if not isinstance(e, Exception):
+    return _ExceptionWrapper(msg)
+  # Only keep the exception type for builtin exception types or else risk
+  # further marshalling exceptions.
+  exception_type = None
+  if hasattr(__builtins__, type(e).__name__):
+    exception_type = type(e).__name__
+  try:
+    pickle.loads(pickle.dumps(e))
+  except Exception:  # pylint: disable=broad-except
+    e = None
+  return _ExceptionWrapper(msg, exception_type, e)
+
+
 class _FuncWrapper:
   """Runs on the fork()'ed side to catch exceptions and spread *args."""
 
@@ -71,17 +102,29 @@ class _FuncWrapper:
       if _fork_kwargs is None:  # Clarifies _fork_kwargs is map for pylint.
         _fork_kwargs = {}
       return self._func(*_fork_params[index], **_fork_kwargs)
-    except Exception as e:
-      # Only keep the exception type for builtin exception types or else risk
-      # further marshalling exceptions.
-      exception_type = None
-      if hasattr(__builtins__, type(e).__name__):
-        exception_type = type(e).__name__
-      # multiprocessing is supposed to catch and return exceptions automatically
-      # but it doesn't seem to work properly :(.
-      return _ExceptionWrapper(traceback.format_exc(), exception_type)
-    except:  # pylint: disable=bare-except
-      return _ExceptionWrapper(traceback.format_exc())
+    # multiprocessing is supposed to catch and return exceptions automatically
+    # but it doesn't seem to work properly :(.
+    except BaseException as e:  # pylint: disable=broad-except
+      return _WrapException(e)
+
+
+class _PickledFuncWrapper:
+  """Runs in WorkerPool processes to time calls and catch exceptions.
+
+  Unlike _FuncWrapper, |func| and all arguments are pickled.
+  """
+
+  def __init__(self, func, kwargs):
+    self._func = func
+    self._kwargs = kwargs
+
+  def __call__(self, args):
+    start = time.time()
+    try:
+      ret = self._func(*args, **self._kwargs)
+    except BaseException as e:  # pylint: disable=broad-except
+      ret = _WrapException(e)
+    return time.time() - start, ret
 
 
 class _WrappedResult:
@@ -153,8 +196,15 @@ def _CheckForException(value):
     sys.exit(1)
 
 
-def _MakeProcessPool(job_params, **job_kwargs):
+def _RegisterPool(pool):
   global _all_pools
+  if _all_pools is None:
+    _all_pools = []
+    atexit.register(_TerminatePools)
+  _all_pools.append(pool)
+
+
+def _MakeProcessPool(job_params, **job_kwargs):
   global _fork_params
   global _fork_kwargs
   assert _fork_params is None
@@ -165,10 +215,7 @@ def _MakeProcessPool(job_params, **job_kwargs):
   ret = multiprocessing.Pool(pool_size)
   _fork_params = None
   _fork_kwargs = None
-  if _all_pools is None:
-    _all_pools = []
-    atexit.register(_TerminatePools)
-  _all_pools.append(ret)
+  _RegisterPool(ret)
   return ret
 
 
@@ -215,3 +262,79 @@ def BulkForkAndCall(func, arg_tuples, **kwargs):
     pool.close()
     pool.join()
     _all_pools.remove(pool)
+
+
+class WorkerPool:
+  """A process pool that is reused across calls to Map().
+
+  Unlike BulkForkAndCall(), which forks a new pool for each call, workers are
+  started once. As a result, |func| must be a module-level function and all
+  arguments must be picklable.
+
+  Example:
+    with parallel.WorkerPool() as pool:
+      for result in pool.Map(func, arg_tuples, common_kwarg=value):
+        ...
+  """
+
+  def __init__(self, num_workers=None):
+    self._num_workers = num_workers or multiprocessing.cpu_count()
+    self._pool = None
+    # Wall time in seconds of each call made by the most recent Map().
+    self.task_times = []
+
+  def __enter__(self):
+    if not DISABLE_ASYNC:
+      self._pool = multiprocessing.Pool(self._num_workers)
+      _RegisterPool(self._pool)
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    if self._pool:
+      if exc_type:
+        self._pool.terminate()
+      else:
+        self._pool.close()
+      self._pool.join()
+      _all_pools.remove(self._pool)
+      self._pool = None
+
+  def Map(self, func, arg_tuples, chunk_size=None, **kwargs):
+    """Calls |func| for each set of args within |arg_tuples|.
+
+    Args:
+      func: Module-level function to call.
+      arg_tuples: Iterable of tuples of positional arguments.
+      chunk_size: Number of calls to send to a worker at once. Defaults to
+          spreading calls over 4 chunks per worker.
+      kwargs: Common keyword arguments to be passed to |func|.
+
+    Yields the return values in order, as soon as each is available. Exceptions
+    are re-raised with their original type when it can be pickled.
+    """
+    arg_tuples = list(arg_tuples)
+    self.task_times = []
+    if not arg_tuples:
+      return
+
+    wrapped_func = _PickledFuncWrapper(func, kwargs)
+    if self._pool is None:
+      assert DISABLE_ASYNC, 'WorkerPool must be used as a context manager.'
+      results = map(wrapped_func, arg_tuples)
+    else:
+      if chunk_size is None:
+        chunk_size = max(1, len(arg_tuples) // (self._num_workers * 4))
+      results = self._pool.imap(wrapped_func, arg_tuples, chunk_size)
+    for elapsed, result in results:
+      self.task_times.append(elapsed)
+      if isinstance(result, _ExceptionWrapper):
+        result.MaybeThrow()
+        raise Exception('Originally caused by: ' + result.msg)
+      yield result
+    self._LogTaskTimes(func)
+
+  def _LogTaskTimes(self, func):
+    times = sorted(self.task_times)
+    logging.debug('%s: %d calls, min=%.3fs median=%.3fs max=%.3fs total=%.3fs',
+                  func.__name__, len(times), times[0], times[len(times) // 2],
+                  times[-1], sum(times))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# pylint: disable=protected-access
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import parallel
+
+
+class _CustomError(Exception):
+  pass
+
+
+class _UnpicklableError(Exception):
+
+  def __init__(self):
+    super().__init__()
+    self.func = lambda: None
+
+
+def _SlowIdentity(value, delay=0):
+  # Later calls finish first, so results arrive out of order.
+  time.sleep(delay / (value + 1))
+  return value
+
+
+def _GetPid(_):
+  return os.getpid()
+
+
+def _Raise(error_type):
+  raise error_type()
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+  def testMapOrdering(self):
+    with parallel.WorkerPool(4) as pool:
+      results = list(
+          pool.Map(_SlowIdentity, [(i, ) for i in range(8)],
+                   chunk_size=1,
+                   delay=0.1))
+      self.assertEqual(list(range(8)), results)
+      self.assertEqual(8, len(pool.task_times))
+      # The pool is reused across calls.
+      self.assertEqual([], list(pool.Map(_SlowIdentity, [])))
+      self.assertEqual([1], list(pool.Map(_SlowIdentity, [(1, )])))
+
+  def testChunking(self):
+    with parallel.WorkerPool(4) as pool:
+      # A single chunk is run by a single worker.
+      pids = set(pool.Map(_GetPid, [(i, ) for i in range(8)], chunk_size=8))
+      self.assertEqual(1, len(pids))
+      self.assertNotIn(os.getpid(), pids)
+
+  def testDefaultChunkSize(self):
+    with parallel.WorkerPool(2) as pool:
+      with mock.patch.object(pool._pool, 'imap',
+                             return_value=[(0, None)] * 16) as imap:
+        list(pool.Map(_GetPid, [(i, ) for i in range(16)]))
+    # 4 chunks per worker.
+    self.assertEqual(2, imap.call_args[0][2])
+
+  def testDisableAsync(self):
+    with mock.patch.object(parallel, 'DISABLE_ASYNC', True):
+      with parallel.WorkerPool(4) as pool:
+        self.assertIsNone(pool._pool)
+        pids = list(pool.Map(_GetPid, [(i, ) for i in range(4)]))
+    self.assertEqual([os.getpid()] * 4, pids)
+
+  def testRequiresContextManager(self):
+    with self.assertRaises(AssertionError):
+      list(parallel.WorkerPool(2).Map(_GetPid, [(1, )]))
+
+  def testExceptionTypes(self):
+    with parallel.WorkerPool(2) as pool:
+      # Picklable exceptions keep their type, with the child's traceback as
+      # their cause.
+      with self.assertRaises(_CustomError) as cm:
+        list(pool.Map(_Raise, [(_CustomError, )]))
+      self.assertIsInstance(cm.exception.__cause__, parallel._RemoteTraceback)
+      self.assertIn('_Raise', str(cm.exception.__cause__))
+      with self.assertRaises(KeyError):
+        list(pool.Map(_Raise, [(KeyError, )]))
+      # Others fall back to a generic exception.
+      with self.assertRaises(Exception) as cm:
+        list(pool.Map(_Raise, [(_UnpicklableError, )]))
+      self.assertIs(Exception, type(cm.exception))
+      self.assertIn('Originally caused by', str(cm.exception))
+
+
+class WrapExceptionTest(unittest.TestCase):
+
+  def _Wrap(self, error):
+    try:
+      raise error
+    except BaseException as e:  # pylint: disable=broad-except
+      return parallel._WrapException(e)
+
+  def testReraisesOriginalType(self):
+    with self.assertRaises(_CustomError):
+      self._Wrap(_CustomError()).MaybeThrow()
+    with self.assertRaises(ValueError):
+      self._Wrap(ValueError('x')).MaybeThrow()
+
+  def testUnpicklable(self):
+    wrapper = self._Wrap(_UnpicklableError())
+    self.assertIsNone(wrapper.exception)
+    self.assertIsNone(wrapper.exception_type)
+    self.assertIn('_UnpicklableError', wrapper.msg)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -13,6 +13,44 @@ import socket
 SOCKET_ADDRESS = '\0chromium_build_server_socket'
 BUILD_SERVER_ENV_VARIABLE = 'INVOKED_BY_BUILD_SERVER'
 
+# Values for the 'message_type' key of requests. Requests without it are tasks.
+ADD_TASK = 'add_task'
+QUERY_STATUS = 'query_status'
+WAIT_FOR_IDLE = 'wait_for_idle'
+
+
+def SendRequest(request):
+  """Sends |request| to the build server and returns its JSON reply.
+
+  Raises socket.error if the build server is not running.
+  """
+  with contextlib.closing(socket.socket(socket.AF_UNIX)) as sock:
+    sock.connect(SOCKET_ADDRESS)
+    sock.sendall(json.dumps(request).encode('utf8'))
+    # Signals the end of the request so that the server replies.
+    sock.shutdown(socket.SHUT_WR)
+    received = []
+    while True:
+      data = sock.recv(4096)
+      if not data:
+        break
+      received.append(data)
+  return json.loads(b''.join(received))
+
+
+def QueryStatus():
+  """Returns task counts and per-task stats from the build server."""
+  return SendRequest({'message_type': QUERY_STATUS})
+
+
+def WaitForIdle(timeout=None):
+  """Blocks until the build server has no queued or running tasks.
+
+  Returns the same stats as QueryStatus(), plus 'idle', which is False if
+  |timeout| seconds passed first.
+  """
+  return SendRequest({'message_type': WAIT_FOR_IDLE, 'timeout': timeout})
+
 
 def MaybeRunCommand(name, argv, stamp_file, force):
   """Returns True if the command was successfully sent to the build server."""
@@ -28,6 +66,7 @@ def MaybeRunCommand(name, argv, stamp_file, force):
       sock.connect(SOCKET_ADDRESS)
       sock.sendall(
           json.dumps({
+              'message_type': ADD_TASK,
               'name': name,
               'cmd': argv,
               'cwd': os.getcwd(),
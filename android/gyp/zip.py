@@ -15,6 +15,10 @@ from util import build_utils
 import action_helpers  # build_utils adds //build to sys.path.
 import zip_helpers
 
+# Ninja already runs many actions in parallel, so only a few threads per action
+# are worth using to compress entries.
+_MAX_COMPRESS_WORKERS = 4
+
 
 def main(args):
   args = build_utils.ExpandFileArgs(args)
@@ -52,7 +56,9 @@ def main(args):
         zip_helpers.add_files_to_zip(files,
                                      out_zip,
                                      base_dir=options.input_files_base_dir,
-                                     compress=options.compress)
+                                     compress=options.compress,
+                                     num_workers=min(_MAX_COMPRESS_WORKERS,
+                                                     os.cpu_count() or 1))
 
       if options.input_zips:
         files = action_helpers.parse_gn_list(options.input_zips)
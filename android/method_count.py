@@ -6,8 +6,6 @@
 
 import argparse
 import os
-import re
-import zipfile
 
 from pylib.dex import dex_parser
 
@@ -33,18 +31,12 @@ class DexStatsCollector:
 
   def CollectFromZip(self, label, path):
     """Add dex stats from an .apk/.jar/.aab/.zip."""
-    with zipfile.ZipFile(path, 'r') as z:
-      for subpath in z.namelist():
-        if not re.match(r'.*classes\d*\.dex$', subpath):
-          continue
-        dexfile = dex_parser.DexFile(bytearray(z.read(subpath)))
-        self._CollectFromDexfile('{}!{}'.format(label, subpath), dexfile)
+    for subpath, dexfile in dex_parser.IterDexFilesInZip(path):
+      self._CollectFromDexfile('{}!{}'.format(label, subpath), dexfile)
 
   def CollectFromDex(self, label, path):
     """Add dex stats from a .dex file."""
-    with open(path, 'rb') as f:
-      dexfile = dex_parser.DexFile(bytearray(f.read()))
-    self._CollectFromDexfile(label, dexfile)
+    self._CollectFromDexfile(label, dex_parser.DexFile.FromPath(path))
 
   def MergeFrom(self, parent_label, other):
     """Add dex stats from another DexStatsCollector."""
@@ -8,6 +8,7 @@
 import functools
 import re
 import sys
+import tempfile
 import threading
 
 from lib.results import result_types
@@ -19,6 +20,10 @@ MULTIPROCESS_SUFFIX = '__multiprocess_mode'
 _NULL_MUTATION_SUFFIX = '__null_'
 _MUTATION_SUFFIX_PATTERN = re.compile(r'^(.*)__([a-zA-Z]+)\.\.([a-zA-Z]+)_$')
 
+# Logs longer than this many characters are kept in a temporary file rather
+# than in memory until GetLog() is called.
+_MAX_IN_MEMORY_LOG_LENGTH = 16 * 1024
+
 
 class ResultType:
   """Class enumerating test types.
@@ -41,10 +46,46 @@ class ResultType:
             ResultType.NOTRUN]
 
 
+class _LogSpillFile:
+  """Append-only temporary file holding large test logs.
+
+  The file is deleted when closed, including at exit. Space used by logs that
+  are replaced is not reclaimed.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._file = None
+
+  def Write(self, log):
+    """Stores |log| and returns an (offset, size) tuple to Read() it with."""
+    data = log.encode('utf-8', errors='surrogatepass')
+    with self._lock:
+      if self._file is None:
+        self._file = tempfile.TemporaryFile(prefix='test_logs_')
+      offset = self._file.seek(0, 2)
+      self._file.write(data)
+      return offset, len(data)
+
+  def Read(self, location):
+    offset, size = location
+    with self._lock:
+      self._file.seek(offset)
+      data = self._file.read(size)
+    return data.decode('utf-8', errors='surrogatepass')
+
+
+_log_spill_file = _LogSpillFile()
+
+
 @functools.total_ordering
 class BaseTestResult:
   """Base class for a single test result."""
 
+  # Suites can have 100k+ results per try, so avoid a dict per instance.
+  __slots__ = ('_name', '_test_type', '_duration', '_log', '_failure_reason',
+               '_links', '_webview_multiprocess_mode', '_owners')
+
   def __init__(self, name, test_type, duration=0, log='', failure_reason=None):
     """Construct a BaseTestResult.
 
@@ -59,10 +100,14 @@ class BaseTestResult:
     self._name = name
     self._test_type = test_type
     self._duration = duration
-    self._log = log
+    self._log = None
+    self.SetLog(log)
     self._failure_reason = failure_reason
-    self._links = {}
+    # Created by SetLink(), since most results have no links.
+    self._links = None
     self._webview_multiprocess_mode = MULTIPROCESS_SUFFIX in name
+    # TestRunResults containing this result, which index it by type.
+    self._owners = None
 
   def __str__(self):
     return self._name
@@ -131,7 +176,21 @@ class BaseTestResult:
   def SetType(self, test_type):
     """Set the test result type."""
     assert test_type in ResultType.GetTypes()
+    old_type = self._test_type
+    if test_type == old_type:
+      return
     self._test_type = test_type
+    for owner in tuple(self._owners or ()):
+      owner._OnTypeChanged(self, old_type)  # pylint: disable=protected-access
+
+  def _AddOwner(self, owner):
+    if self._owners is None:
+      self._owners = []
+    self._owners.append(owner)
+
+  def _RemoveOwner(self, owner):
+    if self._owners and owner in self._owners:
+      self._owners.remove(owner)
 
   def GetType(self):
     """Get the test result type."""
@@ -143,10 +202,16 @@ class BaseTestResult:
 
   def SetLog(self, log):
     """Set the test log."""
-    self._log = log
+    if isinstance(log, str) and len(log) > _MAX_IN_MEMORY_LOG_LENGTH:
+      # Stored as an (offset, size) tuple in the spill file.
+      self._log = _log_spill_file.Write(log)
+    else:
+      self._log = log
 
   def GetLog(self):
     """Get the test log."""
+    if isinstance(self._log, tuple):
+      return _log_spill_file.Read(self._log)
     return self._log
 
   def SetFailureReason(self, failure_reason):
@@ -167,10 +232,14 @@ class BaseTestResult:
 
   def SetLink(self, name, link_url):
     """Set link with test result data."""
+    if self._links is None:
+      self._links = {}
     self._links[name] = link_url
 
   def GetLinks(self):
     """Get dict containing links to test result data."""
+    if self._links is None:
+      self._links = {}
     return self._links
 
   def GetVariantForResultSink(self):
@@ -189,9 +258,25 @@ class TestRunResults:
 
   def __init__(self):
     self._links = {}
-    self._results = set()
+    self._listeners = []
+    # Maps test names to results.
+    self._results = {}
+    # Kept up to date by AddResult() and by results' SetType().
+    self._results_by_type = {t: set() for t in ResultType.GetTypes()}
     self._results_lock = threading.RLock()
 
+  def AddListener(self, listener):
+    """Calls |listener| with each result added, starting with existing ones.
+
+    Args:
+      listener: A function taking a BaseTestResult. Called while holding the
+        results lock, so it sees results in the order they were added.
+    """
+    with self._results_lock:
+      for result in self._results.values():
+        listener(result)
+      self._listeners.append(listener)
+
   def SetLink(self, name, link_url):
     """Add link with test run results data."""
     self._links[name] = link_url
@@ -254,7 +339,7 @@ class TestRunResults:
       s = []
       s.append('ALL: %d' % len(self._results))
       for test_type in ResultType.GetTypes():
-        s.append('%s: %d' % (test_type, len(self._GetType(test_type))))
+        s.append('%s: %d' % (test_type, len(self._results_by_type[test_type])))
       return ''.join([x.ljust(15) for x in s])
 
   def __str__(self):
@@ -268,8 +353,16 @@ class TestRunResults:
     """
     assert isinstance(result, BaseTestResult)
     with self._results_lock:
-      self._results.discard(result)
-      self._results.add(result)
+      old = self._results.get(result.GetName())
+      if old is not result:
+        if old is not None:
+          old._RemoveOwner(self)  # pylint: disable=protected-access
+          self._results_by_type[old.GetType()].discard(old)
+        self._results[result.GetName()] = result
+        result._AddOwner(self)  # pylint: disable=protected-access
+      self._results_by_type[result.GetType()].add(result)
+      for listener in self._listeners:
+        listener(result)
 
   def AddResults(self, results):
     """Add |results| to the set.
@@ -291,17 +384,36 @@ class TestRunResults:
            'Expected TestRunResult object: %s' % type(results))
     with self._results_lock:
       # pylint: disable=W0212
-      self._results.update(results._results)
+      # Existing results with the same name are kept.
+      new_results = [
+          r for name, r in results._results.items() if name not in self._results
+      ]
+      for r in new_results:
+        self._results[r.GetName()] = r
+        r._AddOwner(self)
+        self._results_by_type[r.GetType()].add(r)
+      for listener in self._listeners:
+        for result in new_results:
+          listener(result)
 
   def GetAll(self):
     """Get the set of all test results."""
     with self._results_lock:
-      return self._results.copy()
+      return set(self._results.values())
+
+  def _OnTypeChanged(self, result, old_type):
+    """Moves |result| to the index of its new type."""
+    with self._results_lock:
+      # It may have been replaced by another result with the same name.
+      if self._results.get(result.GetName()) is not result:
+        return
+      self._results_by_type[old_type].discard(result)
+      self._results_by_type[result.GetType()].add(result)
 
   def _GetType(self, test_type):
     """Get the set of test results with the given test type."""
     with self._results_lock:
-      return set(t for t in self._results if t.GetType() == test_type)
+      return self._results_by_type[test_type].copy()
 
   def GetPass(self):
     """Get the set of all passed test results."""
@@ -329,8 +441,11 @@ class TestRunResults:
 
   def GetNotPass(self):
     """Get the set of all non-passed test results."""
-    return self.GetAll() - self.GetPass()
+    with self._results_lock:
+      return self.GetAll() - self._results_by_type[ResultType.PASS]
 
   def DidRunPass(self):
     """Return whether the test run was successful."""
-    return not self.GetNotPass() - self.GetSkip()
+    with self._results_lock:
+      return not any(results for t, results in self._results_by_type.items()
+                     if t not in (ResultType.PASS, ResultType.SKIP))
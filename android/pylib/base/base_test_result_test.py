@@ -0,0 +1,129 @@
+#!/usr/bin/env vpython3
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import time
+import unittest
+
+from pylib.base import base_test_result
+
+_RUN_BENCHMARKS = int(os.environ.get('RUN_BENCHMARKS', 0))
+
+ResultType = base_test_result.ResultType
+
+
+def _Result(name, result_type, log=''):
+  return base_test_result.BaseTestResult(name, result_type, log=log)
+
+
+class BaseTestResultTest(unittest.TestCase):
+
+  def testLargeLog(self):
+    log = 'line\n' * base_test_result._MAX_IN_MEMORY_LOG_LENGTH + '☃'
+    result = _Result('a', ResultType.FAIL, log=log)
+    other = _Result('b', ResultType.FAIL, log=log + '!')
+    self.assertIsInstance(result._log, tuple)
+    self.assertEqual(log, result.GetLog())
+    self.assertEqual(log + '!', other.GetLog())
+    result.SetLog('short')
+    self.assertEqual('short', result.GetLog())
+
+  def testLinks(self):
+    result = _Result('a', ResultType.PASS)
+    self.assertEqual({}, result.GetLinks())
+    result.SetLink('logcat', 'http://logcat')
+    self.assertEqual({'logcat': 'http://logcat'}, result.GetLinks())
+
+
+class TestRunResultsTest(unittest.TestCase):
+
+  def testTypedQueries(self):
+    results = base_test_result.TestRunResults()
+    results.AddResults([
+        _Result('a', ResultType.PASS),
+        _Result('b', ResultType.FAIL),
+        _Result('c', ResultType.SKIP),
+    ])
+    self.assertEqual({'a'}, {r.GetName() for r in results.GetPass()})
+    self.assertEqual({'b', 'c'}, {r.GetName() for r in results.GetNotPass()})
+    self.assertFalse(results.DidRunPass())
+
+    # Replacing a result moves it to its new type.
+    results.AddResult(_Result('b', ResultType.PASS))
+    self.assertEqual({'a', 'b'}, {r.GetName() for r in results.GetPass()})
+    self.assertEqual(set(), results.GetFail())
+    self.assertTrue(results.DidRunPass())
+
+  def testTypeChangedAfterAdd(self):
+    results = base_test_result.TestRunResults()
+    result = _Result('a', ResultType.PASS)
+    results.AddResult(result)
+    self.assertEqual(1, len(results.GetPass()))
+    result.SetType(ResultType.CRASH)
+    self.assertEqual(set(), results.GetPass())
+    self.assertEqual({result}, results.GetCrash())
+    self.assertFalse(results.DidRunPass())
+
+  def testTypeChangedInSeveralRuns(self):
+    try_results = base_test_result.TestRunResults()
+    iteration_results = base_test_result.TestRunResults()
+    result = _Result('a', ResultType.UNKNOWN)
+    try_results.AddResult(result)
+    iteration_results.AddTestRunResults(try_results)
+    result.SetType(ResultType.PASS)
+    for results in (try_results, iteration_results):
+      self.assertEqual({result}, results.GetPass())
+      self.assertEqual(set(), results.GetUnknown())
+      self.assertTrue(results.DidRunPass())
+
+  def testTypeChangedAfterReplaced(self):
+    results = base_test_result.TestRunResults()
+    old = _Result('a', ResultType.FAIL)
+    results.AddResult(old)
+    new = _Result('a', ResultType.PASS)
+    results.AddResult(new)
+    # Changes to the replaced result no longer affect the run.
+    old.SetType(ResultType.CRASH)
+    self.assertEqual(set(), results.GetCrash())
+    self.assertIs(new, results.GetPass().pop())
+    self.assertTrue(results.DidRunPass())
+
+  def testAddTestRunResults(self):
+    results = base_test_result.TestRunResults()
+    results.AddResult(_Result('a', ResultType.FAIL))
+    other = base_test_result.TestRunResults()
+    other.AddResults(
+        [_Result('a', ResultType.PASS),
+         _Result('b', ResultType.PASS)])
+    results.AddTestRunResults(other)
+    # Existing results are kept.
+    self.assertEqual({'a'}, {r.GetName() for r in results.GetFail()})
+    self.assertEqual({'b'}, {r.GetName() for r in results.GetPass()})
+    self.assertEqual(2, len(results.GetAll()))
+
+  @unittest.skipUnless(_RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=1 to run.')
+  def testBenchmark(self):
+    start = time.time()
+    results = base_test_result.TestRunResults()
+    for i in range(200000):
+      results.AddResult(
+          _Result('Suite%d.test%d' % (i % 100, i),
+                  ResultType.PASS if i % 50 else ResultType.FAIL))
+    add_time = time.time() - start
+
+    start = time.time()
+    for r in list(results.GetAll())[:100]:
+      # Each type change only moves the result between indexes.
+      r.SetType(ResultType.CRASH)
+      results.GetFail()
+      results.DidRunPass()
+    query_time = time.time() - start
+    print('Added 200000 results in %.2fs, 100 type changes and 200 queries '
+          'took %.3fs.' %
+          (add_time, query_time))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -2,6 +2,8 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+from pylib.utils import run_metrics
+
 
 # TODO(crbug.com/40799394): After Telemetry is supported by python3 we can
 # remove object inheritance from this script.
@@ -38,11 +40,13 @@ class Environment(object):
     raise NotImplementedError
 
   def __enter__(self):
-    self.SetUp()
+    with run_metrics.Timer('environment/set_up'):
+      self.SetUp()
     return self
 
   def __exit__(self, _exc_type, _exc_val, _exc_tb):
-    self.TearDown()
+    with run_metrics.Timer('environment/tear_down'):
+      self.TearDown()
 
   @property
   def output_manager(self):
@@ -3,6 +3,7 @@
 # found in the LICENSE file.
 
 
+import collections
 import threading
 
 
@@ -80,3 +81,73 @@ class TestCollection:
     """Return a list of the names of the tests currently in the collection."""
     with self._lock:
       return list(t.test for t in self._tests)
+
+
+class WorkStealingTestCollection(TestCollection):
+  """A threadsafe collection that balances shards of tests across threads.
+
+  Each consuming thread owns one of the shards and takes chunks of units from
+  its front. Chunks get smaller as the remaining work drains, and a thread whose
+  own shard is empty takes work from the back of the largest remaining shard.
+  Tests added with add() (e.g. reruns) are handed out before any shard work.
+
+  Args:
+    shards: List of shards, each a list of units that must not be split.
+    combine: Function that turns a list of units into the test to yield.
+      Defaults to concatenating the units.
+  """
+
+  def __init__(self, shards, combine=None):
+    super().__init__()
+    self._shards = [collections.deque(s) for s in shards if s]
+    self._shard_index_by_thread = {}
+    self._combine = combine or (lambda units: [t for u in units for t in u])
+    self.num_chunks = 0
+    self.num_steals = 0
+    # Either there are units to take or there is nothing to do at all.
+    self._item_available_or_all_done.set()
+
+  def _pop(self):
+    while True:
+      self._item_available_or_all_done.wait()
+      with self._lock:
+        if self._tests:
+          return self._tests.pop(0)
+        units = self._take_units()
+        if units:
+          self._tests_in_progress += 1
+          return self._combine(units)
+        if self._tests_in_progress == 0:
+          return None
+        self._item_available_or_all_done.clear()
+
+  def _take_units(self):
+    """Takes the next chunk of units for the current thread.
+
+    Must be called with self._lock held.
+    """
+    remaining = sum(len(s) for s in self._shards)
+    if not remaining:
+      return None
+    thread_id = threading.get_ident()
+    index = self._shard_index_by_thread.setdefault(
+        thread_id, len(self._shard_index_by_thread))
+    # Guided self-scheduling: large chunks while there is lots of work left,
+    # down to single units at the end.
+    chunk_size = max(1, remaining // (2 * len(self._shards)))
+    self.num_chunks += 1
+    if index < len(self._shards) and self._shards[index]:
+      shard = self._shards[index]
+      return [shard.popleft() for _ in range(min(chunk_size, len(shard)))]
+
+    victim = max(self._shards, key=len)
+    self.num_steals += 1
+    num_units = min(chunk_size, max(1, len(victim) // 2))
+    units = [victim.pop() for _ in range(num_units)]
+    units.reverse()
+    return units
+
+  def __len__(self):
+    """Return the number of tests and units currently in the collection."""
+    with self._lock:
+      return len(self._tests) + sum(len(s) for s in self._shards)
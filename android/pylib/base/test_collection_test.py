@@ -0,0 +1,71 @@
+#!/usr/bin/env vpython3
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import threading
+import time
+import unittest
+
+from pylib.base import test_collection
+
+
+def _Consume(collection, num_threads, delay_by_thread):
+  taken = [[] for _ in range(num_threads)]
+
+  def consume(i):
+    for test in collection:
+      taken[i].append(test)
+      time.sleep(delay_by_thread[i] * len(test))
+      collection.test_completed()
+
+  threads = [
+      threading.Thread(target=consume, args=(i, )) for i in range(num_threads)
+  ]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  return taken
+
+
+class WorkStealingTestCollectionTest(unittest.TestCase):
+
+  def testAllUnitsTakenOnce(self):
+    shards = [[['a%d' % i] for i in range(40)], [['b%d' % i] for i in range(4)]]
+    collection = test_collection.WorkStealingTestCollection(shards)
+    taken = _Consume(collection, 2, [0.001, 0.001])
+    all_tests = [t for chunks in taken for chunk in chunks for t in chunk]
+    self.assertEqual(sorted(all_tests),
+                     sorted(u[0] for shard in shards for u in shard))
+    # The thread with the small shard finished early and helped with the other.
+    self.assertGreater(collection.num_steals, 0)
+    self.assertEqual(0, len(collection))
+
+  def testUnitsAreNotSplit(self):
+    shards = [[['PRE_a', 'a'], ['b'], ['PRE_c', 'c']] * 5]
+    collection = test_collection.WorkStealingTestCollection(
+        shards, combine=lambda units: units)
+    taken = _Consume(collection, 3, [0, 0, 0])
+    units = [u for chunks in taken for chunk in chunks for u in chunk]
+    self.assertEqual(15, len(units))
+    self.assertEqual(5, units.count(['PRE_a', 'a']))
+    self.assertEqual(5, units.count(['PRE_c', 'c']))
+
+  def testRerunsAreHandedOut(self):
+    collection = test_collection.WorkStealingTestCollection([[['a']]])
+    seen = []
+    for test in collection:
+      seen.append(test)
+      if len(seen) == 1:
+        collection.add(['a'])
+      collection.test_completed()
+    self.assertEqual([['a'], ['a']], seen)
+
+  def testEmpty(self):
+    collection = test_collection.WorkStealingTestCollection([])
+    self.assertEqual([], list(collection))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -2,6 +2,8 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+from pylib.utils import run_metrics
+
 
 class TestInstance:
   """A type of test.
@@ -33,8 +35,10 @@ class TestInstance:
     raise NotImplementedError
 
   def __enter__(self):
-    self.SetUp()
+    with run_metrics.Timer('test_instance/set_up'):
+      self.SetUp()
     return self
 
   def __exit__(self, _exc_type, _exc_val, _exc_tb):
-    self.TearDown()
+    with run_metrics.Timer('test_instance/tear_down'):
+      self.TearDown()
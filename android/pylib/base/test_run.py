@@ -2,6 +2,8 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+from pylib.utils import run_metrics
+
 
 class TestRun:
   """An execution of a particular test on a particular device.
@@ -45,11 +47,13 @@ class TestRun:
     raise NotImplementedError
 
   def __enter__(self):
-    self.SetUp()
+    with run_metrics.Timer('test_run/set_up'):
+      self.SetUp()
     return self
 
   def __exit__(self, exc_type, exc_val, exc_tb):
-    self.TearDown()
+    with run_metrics.Timer('test_run/tear_down'):
+      self.TearDown()
 
   def ReceivedSigterm(self):
     self._received_sigterm = True
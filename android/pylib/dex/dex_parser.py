@@ -12,10 +12,12 @@ is provided, but it does not include error handling or validation.
 import argparse
 import collections
 import errno
+import mmap
 import os
 import re
 import struct
 import sys
+import time
 import zipfile
 
 # https://source.android.com/devices/tech/dalvik/dex-format#header-item
@@ -49,11 +51,14 @@ DexHeader = collections.namedtuple('DexHeader',
                                    ','.join(t[0] for t in _DEX_HEADER_FMT))
 
 # Simple memory items.
+_StringIdItem = collections.namedtuple('StringIdItem', 'string_data_off')
 _TypeIdItem = collections.namedtuple('TypeIdItem', 'descriptor_idx')
 _ProtoIdItem = collections.namedtuple(
     'ProtoIdItem', 'shorty_idx,return_type_idx,parameters_off')
 _MethodIdItem = collections.namedtuple('MethodIdItem',
                                        'type_idx,proto_idx,name_idx')
+_FieldIdItem = collections.namedtuple('FieldIdItem',
+                                      'class_idx,type_idx,name_idx')
 _TypeItem = collections.namedtuple('TypeItem', 'type_idx')
 _StringDataItem = collections.namedtuple('StringItem', 'utf16_size,data')
 _ClassDefItem = collections.namedtuple(
@@ -61,6 +66,38 @@ _ClassDefItem = collections.namedtuple(
     'class_idx,access_flags,superclass_idx,interfaces_off,source_file_idx,'
     'annotations_off,class_data_off,static_values_off')
 
+# A decoded annotation_item. |elements| maps element names to values, which are
+# decoded to Python values. Strings, types, fields, enums and methods are
+# represented by their string, type descriptor or name.
+Annotation = collections.namedtuple('Annotation', 'visibility,type,elements')
+
+# https://source.android.com/devices/tech/dalvik/dex-format#visibility
+VISIBILITY_BUILD = 0
+VISIBILITY_RUNTIME = 1
+VISIBILITY_SYSTEM = 2
+
+# https://source.android.com/devices/tech/dalvik/dex-format#value-formats
+_VALUE_BYTE = 0x00
+_VALUE_SHORT = 0x02
+_VALUE_CHAR = 0x03
+_VALUE_INT = 0x04
+_VALUE_LONG = 0x06
+_VALUE_FLOAT = 0x10
+_VALUE_DOUBLE = 0x11
+_VALUE_STRING = 0x17
+_VALUE_TYPE = 0x18
+_VALUE_FIELD = 0x19
+_VALUE_METHOD = 0x1a
+_VALUE_ENUM = 0x1b
+_VALUE_ARRAY = 0x1c
+_VALUE_ANNOTATION = 0x1d
+_VALUE_NULL = 0x1e
+_VALUE_BOOLEAN = 0x1f
+_SIGNED_VALUE_TYPES = (_VALUE_BYTE, _VALUE_SHORT, _VALUE_INT, _VALUE_LONG)
+
+_DEX_FILE_PATTERN = re.compile(r'.*classes[0-9]*\.dex$')
+_ZIP_LOCAL_HEADER_LEN = 30
+
 
 class _MemoryItemList:
   """Base class for repeated memory items."""
@@ -112,6 +149,137 @@ class _MemoryItemList:
         type(self).__name__, self.offset, self.size, item_type_part)
 
 
+class _LazyItemList:
+  """Like _MemoryItemList, but items are decoded only when accessed.
+
+  Only supports fixed-size items, which are decoded with a struct.Struct.
+  """
+
+  def __init__(self,
+               data,
+               offset,
+               size,
+               item_fmt,
+               item_type,
+               first_item_offset=None):
+    """Creates the item list.
+
+    Args:
+      data: Buffer containing the dex file.
+      offset: Offset from start of the file to the item list, serving as the
+        key for some item types.
+      size: Number of memory items in the list.
+      item_fmt: struct format of a single item.
+      item_type: namedtuple type to return items as.
+      first_item_offset: Optional, specifies a different offset to use for
+        extracting memory items (default is to use offset).
+    """
+    self.offset = offset
+    self.size = size
+    self._data = data
+    self._struct = struct.Struct(item_fmt)
+    self._item_type = item_type
+    self._first_item_offset = first_item_offset or offset
+
+  def __iter__(self):
+    end = self._first_item_offset + self.size * self._struct.size
+    view = memoryview(self._data)[self._first_item_offset:end]
+    return map(self._item_type._make, self._struct.iter_unpack(view))
+
+  def __getitem__(self, key):
+    if isinstance(key, slice):
+      return [self[i] for i in range(*key.indices(self.size))]
+    if key < 0:
+      key += self.size
+    if not 0 <= key < self.size:
+      raise IndexError(key)
+    return self._item_type._make(
+        self._struct.unpack_from(self._data, self._first_item_offset +
+                                 key * self._struct.size))
+
+  def __len__(self):
+    return self.size
+
+  def __repr__(self):
+    item_type_part = ''
+    if self.size != 0:
+      item_type_part = ', item type={}'.format(self._item_type.__name__)
+
+    return '{}(offset={:#x}, size={}{})'.format(
+        type(self).__name__, self.offset, self.size, item_type_part)
+
+
+class _LazyStringItemList:
+  """Like _StringItemList, but strings are decoded and cached when accessed."""
+
+  def __init__(self, reader, data, offset, size):
+    self.offset = offset
+    self.size = size
+    self._reader = reader
+    self._string_ids = _LazyItemList(data, offset, size, '<I', _StringIdItem)
+    self._cache = {}
+
+  def __iter__(self):
+    return (self[i] for i in range(self.size))
+
+  def __getitem__(self, key):
+    if key < 0:
+      key += self.size
+    ret = self._cache.get(key)
+    if ret is None:
+      string = self._reader.ReadString(self._string_ids[key].string_data_off)
+      ret = _StringDataItem(len(string), string)
+      self._cache[key] = ret
+    return ret
+
+  def __len__(self):
+    return self.size
+
+  def __repr__(self):
+    return '{}(offset={:#x}, size={}, item type={})'.format(
+        type(self).__name__, self.offset, self.size,
+        _StringDataItem.__name__)
+
+
+class _LazyTypeListItemList:
+  """Like _TypeListItemList, but type lists are decoded when accessed."""
+
+  def __init__(self, data, offset, size):
+    self.offset = offset
+    self.size = size
+    self._data = data
+    self._by_offset = {}
+
+  def GetByOffset(self, offset):
+    ret = self._by_offset.get(offset)
+    if ret is None:
+      size = struct.unpack_from('<I', self._data, offset)[0]
+      ret = _LazyItemList(self._data,
+                          offset,
+                          size,
+                          '<H',
+                          _TypeItem,
+                          first_item_offset=offset + 4)
+      self._by_offset[offset] = ret
+    return ret
+
+  def __iter__(self):
+    offset = self.offset
+    for _ in range(self.size):
+      type_list = self.GetByOffset(offset)
+      # Lists are 4-byte aligned.
+      offset = type_list.offset + 4 + type_list.size * 2
+      offset += -offset % 4
+      yield type_list
+
+  def __len__(self):
+    return self.size
+
+  def __repr__(self):
+    return '{}(offset={:#x}, size={})'.format(type(self).__name__, self.offset,
+                                            self.size)
+
+
 class _TypeIdItemList(_MemoryItemList):
   def __init__(self, reader, offset, size):
     factory = lambda x: _TypeIdItem(x.ReadUInt())
@@ -131,6 +299,13 @@ class _MethodIdItemList(_MemoryItemList):
     super().__init__(reader, offset, size, factory)
 
 
+class _FieldIdItemList(_MemoryItemList):
+  def __init__(self, reader, offset, size):
+    factory = (
+        lambda x: _FieldIdItem(x.ReadUShort(), x.ReadUShort(), x.ReadUInt()))
+    super().__init__(reader, offset, size, factory)
+
+
 class _StringItemList(_MemoryItemList):
   def __init__(self, reader, offset, size):
     reader.Seek(offset)
@@ -231,9 +406,24 @@ class _DexReader:
   def ReadUInt(self):
     return self._ReadData('<I')
 
+  def ReadULeb128(self):
+    value, length = self._ReadULeb128(self._pos)
+    self._pos += length
+    return value
+
+  def ReadBytes(self, length):
+    ret = bytes(self._data[self._pos:self._pos + length])
+    self._pos += length
+    return ret
+
   def ReadString(self, data_offset):
     string_length, string_offset = self._ReadULeb128(data_offset)
     string_data_offset = string_offset + data_offset
+    # Fast path: For ASCII strings, MUTF-8 is one byte per character.
+    end = string_data_offset + string_length
+    raw = bytes(self._data[string_data_offset:end])
+    if raw.isascii() and b'\0' not in raw and self._data[end] == 0:
+      return raw.decode('ascii')
     return self._DecodeMUtf8(string_length, string_data_offset)
 
   def AlignUpTo(self, align_unit):
@@ -335,11 +525,16 @@ class DexFile:
     type_item_list: _TypeIdItemList containing type_id_items.
     proto_item_list: _ProtoIdItemList containing proto_id_items.
     method_item_list: _MethodIdItemList containing method_id_items.
+    field_item_list: _FieldIdItemList containing field_id_items.
     string_item_list: _StringItemList containing string_data_items that are
       referenced by index in other sections.
     type_list_item_list: _TypeListItemList containing _TypeListItems.
       _TypeListItems are referenced by their offsets from other dex items.
     class_def_item_list: _ClassDefItemList containing _ClassDefItems.
+
+  When constructed with lazy=True, item lists have the same interface but items
+  are decoded only when accessed, and strings are cached once decoded. This is
+  much faster and uses much less memory when only some items are needed.
   """
   _CLASS_ACCESS_FLAGS = {
       0x1: 'public',
@@ -354,15 +549,23 @@ class DexFile:
       0x4000: 'enum',
   }
 
-  def __init__(self, data):
+  def __init__(self, data, lazy=False):
     """Decodes dex file memory sections.
 
     Args:
-      data: bytearray containing the contents of a dex file.
+      data: bytearray containing the contents of a dex file. When |lazy|, may
+        be any buffer (e.g. an mmap or a memoryview).
+      lazy: Whether to decode items on demand rather than up front.
     """
+    self._data = data
     self.reader = _DexReader(data)
     self.header = self.reader.ReadHeader()
     self.map_list = _DexMapList(self.reader, self.header.map_off)
+    # Map of type_idx -> type string, filled in by GetTypeString().
+    self._type_strings = {}
+    if lazy:
+      self._InitLazy(data)
+      return
     self.type_item_list = _TypeIdItemList(self.reader, self.header.type_ids_off,
                                           self.header.type_ids_size)
     self.proto_item_list = _ProtoIdItemList(self.reader,
@@ -371,6 +574,9 @@ class DexFile:
     self.method_item_list = _MethodIdItemList(self.reader,
                                               self.header.method_ids_off,
                                               self.header.method_ids_size)
+    self.field_item_list = _FieldIdItemList(self.reader,
+                                            self.header.field_ids_off,
+                                            self.header.field_ids_size)
     self.string_item_list = _StringItemList(self.reader,
                                             self.header.string_ids_off,
                                             self.header.string_ids_size)
@@ -391,18 +597,66 @@ class DexFile:
         for type_list in self.type_list_item_list
     }
 
+  def _InitLazy(self, data):
+    header = self.header
+    self.type_item_list = _LazyItemList(data, header.type_ids_off,
+                                        header.type_ids_size, '<I',
+                                        _TypeIdItem)
+    self.proto_item_list = _LazyItemList(data, header.proto_ids_off,
+                                         header.proto_ids_size, '<III',
+                                         _ProtoIdItem)
+    self.method_item_list = _LazyItemList(data, header.method_ids_off,
+                                          header.method_ids_size, '<HHI',
+                                          _MethodIdItem)
+    self.field_item_list = _LazyItemList(data, header.field_ids_off,
+                                         header.field_ids_size, '<HHI',
+                                         _FieldIdItem)
+    self.string_item_list = _LazyStringItemList(self.reader, data,
+                                                header.string_ids_off,
+                                                header.string_ids_size)
+    self.class_def_item_list = _LazyItemList(data, header.class_defs_off,
+                                             header.class_defs_size, '<8I',
+                                             _ClassDefItem)
+    type_list_key = _DexMapList.TYPE_TYPE_LIST
+    if type_list_key in self.map_list:
+      map_list_item = self.map_list[type_list_key]
+      self.type_list_item_list = _LazyTypeListItemList(
+          data, map_list_item.offset, map_list_item.size)
+    else:
+      self.type_list_item_list = _LazyTypeListItemList(data, 0, 0)
+    self._type_lists_by_offset = None
+
+  @classmethod
+  def FromPath(cls, path, lazy=True):
+    """Returns a DexFile for the .dex file at |path|.
+
+    When |lazy|, the file is memory-mapped rather than read.
+    """
+    with open(path, 'rb') as f:
+      if not lazy:
+        return cls(bytearray(f.read()))
+      # The mapping remains valid after the file is closed.
+      return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), lazy=True)
+
   def GetString(self, string_item_idx):
     string_item = self.string_item_list[string_item_idx]
     return string_item.data
 
   def GetTypeString(self, type_item_idx):
-    type_item = self.type_item_list[type_item_idx]
-    return self.GetString(type_item.descriptor_idx)
+    ret = self._type_strings.get(type_item_idx)
+    if ret is None:
+      type_item = self.type_item_list[type_item_idx]
+      ret = self.GetString(type_item.descriptor_idx)
+      self._type_strings[type_item_idx] = ret
+    return ret
 
   def GetTypeListStringsByOffset(self, offset):
     if not offset:
       return ()
-    type_list = self._type_lists_by_offset[offset]
+    if self._type_lists_by_offset is None:
+      type_list = self.type_list_item_list.GetByOffset(offset)
+    else:
+      type_list = self._type_lists_by_offset[offset]
     return tuple(self.GetTypeString(item.type_idx) for item in type_list)
 
   @staticmethod
@@ -418,16 +672,131 @@ class DexFile:
       Tuples that look like:
         (class name, return type, method name, (parameter type, ...)).
     """
+    # Map of proto_idx -> (return type, parameter types).
+    proto_strings = {}
     for method_item in self.method_item_list:
       class_name_string = self.GetTypeString(method_item.type_idx)
       method_name_string = self.GetString(method_item.name_idx)
-      proto_item = self.proto_item_list[method_item.proto_idx]
-      return_type_string = self.GetTypeString(proto_item.return_type_idx)
-      parameter_types = self.GetTypeListStringsByOffset(
-          proto_item.parameters_off)
+      proto_parts = proto_strings.get(method_item.proto_idx)
+      if proto_parts is None:
+        proto_item = self.proto_item_list[method_item.proto_idx]
+        proto_parts = (self.GetTypeString(proto_item.return_type_idx),
+                       self.GetTypeListStringsByOffset(
+                           proto_item.parameters_off))
+        proto_strings[method_item.proto_idx] = proto_parts
+      return_type_string, parameter_types = proto_parts
       yield (class_name_string, return_type_string, method_name_string,
              parameter_types)
 
+  def IterClassMethods(self, class_def_item):
+    """Yields the methods defined by a class.
+
+    Direct methods are yielded first, followed by virtual methods.
+
+    Yields:
+      Tuples of (method_idx, access_flags).
+    """
+    if not class_def_item.class_data_off:
+      return
+    # Use a separate reader since decoding strings moves self.reader.
+    reader = _DexReader(self._data)
+    reader.Seek(class_def_item.class_data_off)
+    static_fields_size = reader.ReadULeb128()
+    instance_fields_size = reader.ReadULeb128()
+    direct_methods_size = reader.ReadULeb128()
+    virtual_methods_size = reader.ReadULeb128()
+    for _ in range(2 * (static_fields_size + instance_fields_size)):
+      reader.ReadULeb128()
+    for size in (direct_methods_size, virtual_methods_size):
+      method_idx = 0
+      for _ in range(size):
+        method_idx += reader.ReadULeb128()
+        access_flags = reader.ReadULeb128()
+        reader.ReadULeb128()  # code_off
+        yield method_idx, access_flags
+
+  def GetClassAnnotations(self, class_def_item):
+    """Returns the annotations on a class and on its methods.
+
+    Returns:
+      A tuple of (class annotations, {method_idx: method annotations}), where
+      annotations are lists of Annotation.
+    """
+    if not class_def_item.annotations_off:
+      return [], {}
+    reader = _DexReader(self._data)
+    reader.Seek(class_def_item.annotations_off)
+    class_annotations_off = reader.ReadUInt()
+    fields_size = reader.ReadUInt()
+    annotated_methods_size = reader.ReadUInt()
+    reader.ReadUInt()  # annotated_parameters_size
+    reader.Seek(reader.Tell() + 8 * fields_size)
+    method_annotation_offs = [(reader.ReadUInt(), reader.ReadUInt())
+                              for _ in range(annotated_methods_size)]
+    class_annotations = self._ReadAnnotationSet(reader, class_annotations_off)
+    method_annotations = {
+        method_idx: self._ReadAnnotationSet(reader, offset)
+        for method_idx, offset in method_annotation_offs
+    }
+    return class_annotations, method_annotations
+
+  def _ReadAnnotationSet(self, reader, offset):
+    if not offset:
+      return []
+    reader.Seek(offset)
+    annotation_offs = [reader.ReadUInt() for _ in range(reader.ReadUInt())]
+    ret = []
+    for annotation_off in annotation_offs:
+      reader.Seek(annotation_off)
+      visibility = reader.ReadUByte()
+      type_string, elements = self._ReadEncodedAnnotation(reader)
+      ret.append(Annotation(visibility, type_string, elements))
+    return ret
+
+  def _ReadEncodedAnnotation(self, reader):
+    type_string = self.GetTypeString(reader.ReadULeb128())
+    elements = {}
+    for _ in range(reader.ReadULeb128()):
+      name = self.GetString(reader.ReadULeb128())
+      elements[name] = self._ReadEncodedValue(reader)
+    return type_string, elements
+
+  def _ReadEncodedValue(self, reader):
+    header = reader.ReadUByte()
+    value_type = header & 0x1f
+    value_arg = header >> 5
+    if value_type == _VALUE_NULL:
+      return None
+    if value_type == _VALUE_BOOLEAN:
+      return bool(value_arg)
+    if value_type == _VALUE_ARRAY:
+      size = reader.ReadULeb128()
+      return [self._ReadEncodedValue(reader) for _ in range(size)]
+    if value_type == _VALUE_ANNOTATION:
+      type_string, elements = self._ReadEncodedAnnotation(reader)
+      return Annotation(None, type_string, elements)
+
+    raw = reader.ReadBytes(value_arg + 1)
+    if value_type in _SIGNED_VALUE_TYPES:
+      return int.from_bytes(raw, 'little', signed=True)
+    # Floating point values are zero-extended to the right, which is the
+    # low-order end.
+    if value_type == _VALUE_FLOAT:
+      return struct.unpack('<f', raw.rjust(4, b'\0'))[0]
+    if value_type == _VALUE_DOUBLE:
+      return struct.unpack('<d', raw.rjust(8, b'\0'))[0]
+    index = int.from_bytes(raw, 'little')
+    if value_type == _VALUE_STRING:
+      return self.GetString(index)
+    if value_type == _VALUE_TYPE:
+      return self.GetTypeString(index)
+    if value_type in (_VALUE_FIELD, _VALUE_ENUM):
+      return self.GetString(self.field_item_list[index].name_idx)
+    if value_type == _VALUE_METHOD:
+      return self.GetString(self.method_item_list[index].name_idx)
+    # _VALUE_CHAR, and method types and handles, which are left as indices.
+    return index
+
   def __repr__(self):
     items = [
         self.header,
@@ -442,6 +811,70 @@ class DexFile:
     return '\n'.join(str(item) for item in items)
 
 
+def ListDexFilesInZip(path):
+  """Returns the names of the classes*.dex entries in a .zip/.apk/.jar."""
+  with zipfile.ZipFile(path) as z:
+    return [n for n in z.namelist() if _DEX_FILE_PATTERN.match(n)]
+
+
+def IterDexFilesInZip(path, lazy=True, names=None):
+  """Yields (entry name, DexFile) for each classes*.dex in a .zip/.apk/.jar.
+
+  When |lazy|, the zip is memory-mapped and uncompressed entries are parsed in
+  place without being copied. The mapping is closed when the generator finishes
+  or is closed, unless yielded DexFiles are still alive, in which case it is
+  freed along with them. When |names| is given, only those entries are parsed.
+  """
+  with zipfile.ZipFile(path) as z:
+    infos = [i for i in z.infolist() if _DEX_FILE_PATTERN.match(i.filename)]
+    if names is not None:
+      infos = [i for i in infos if i.filename in names]
+    if not lazy:
+      for info in infos:
+        yield info.filename, DexFile(bytearray(z.read(info)))
+      return
+    with open(path, 'rb') as f:
+      mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = None
+    try:
+      for info in infos:
+        if info.compress_type != zipfile.ZIP_STORED:
+          yield info.filename, DexFile(z.read(info), lazy=True)
+          continue
+        # The central directory's extra field may differ from the local one, so
+        # the data offset must be computed from the local header.
+        name_len, extra_len = struct.unpack_from('<HH', mapped,
+                                                 info.header_offset + 26)
+        data_offset = (info.header_offset + _ZIP_LOCAL_HEADER_LEN + name_len +
+                       extra_len)
+        view = memoryview(mapped)[data_offset:data_offset + info.file_size]
+        yield info.filename, DexFile(view, lazy=True)
+    finally:
+      view = None
+      try:
+        mapped.close()
+      except BufferError:
+        # A DexFile that the caller kept still references the mapping.
+        pass
+
+
+def _Benchmark(path):
+  """Compares eager and lazy parsing of all dex files within |path|."""
+  is_zip = zipfile.is_zipfile(path)
+  for lazy in (False, True):
+    start = time.time()
+    if is_zip:
+      dexfiles = [d for _, d in IterDexFilesInZip(path, lazy=lazy)]
+    else:
+      dexfiles = [DexFile.FromPath(path, lazy=lazy)]
+    parse_time = time.time() - start
+    num_methods = sum(
+        sum(1 for _ in d.IterMethodSignatureParts()) for d in dexfiles)
+    total_time = time.time() - start
+    print('{}: parse={:.3f}s, parse+iterate {} methods={:.3f}s'.format(
+        'lazy' if lazy else 'eager', parse_time, num_methods, total_time))
+
+
 class _DumpCommand:
   def __init__(self, dexfile):
     self._dexfile = dexfile
@@ -482,8 +915,7 @@ class _DumpSummary(_DumpCommand):
     print(self._dexfile)
 
 
-def _DumpDexItems(dexfile_data, name, item):
-  dexfile = DexFile(bytearray(dexfile_data))
+def _DumpDexItems(dexfile, name, item):
   print('dex_parser: Dumping {} for {}'.format(item, name))
   cmds = {
       'summary': _DumpSummary,
@@ -504,28 +936,29 @@ def main():
   parser.add_argument('input',
                       help='Input (.dex, .jar, .zip, .aab, .apk) file path.')
   parser.add_argument('item',
-                      choices=('methods', 'strings', 'classes', 'summary'),
+                      choices=('methods', 'strings', 'classes', 'summary',
+                               'benchmark'),
                       help='Item to dump',
                       nargs='?',
                       default='summary')
   args = parser.parse_args()
 
+  if args.item == 'benchmark':
+    _Benchmark(args.input)
+    return
+
   if os.path.splitext(args.input)[1] in ('.apk', '.jar', '.zip', '.aab'):
-    with zipfile.ZipFile(args.input) as z:
-      dex_file_paths = [
-          f for f in z.namelist() if re.match(r'.*classes[0-9]*\.dex$', f)
-      ]
-      if not dex_file_paths:
-        print('Error: {} does not contain any classes.dex files'.format(
-            args.input))
-        sys.exit(1)
-
-      for path in dex_file_paths:
-        _DumpDexItems(z.read(path), path, args.item)
+    found = False
+    for path, dexfile in IterDexFilesInZip(args.input):
+      found = True
+      _DumpDexItems(dexfile, path, args.item)
+    if not found:
+      print('Error: {} does not contain any classes.dex files'.format(
+          args.input))
+      sys.exit(1)
 
   else:
-    with open(args.input, 'rb') as f:
-      _DumpDexItems(f.read(), args.input, args.item)
+    _DumpDexItems(DexFile.FromPath(args.input), args.input, args.item)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import struct
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from pylib.dex import dex_parser
+
+# Set to run benchmarks, which are skipped by default since they are slow.
+_RUN_BENCHMARKS = int(os.environ.get('RUN_BENCHMARKS', 0))
+
+_TYPE_LIST_MAP_TYPE = 0x1001
+
+
+def _EncodeULeb128(value):
+  ret = bytearray()
+  while True:
+    byte = value & 0x7f
+    value >>= 7
+    if value:
+      ret.append(byte | 0x80)
+    else:
+      ret.append(byte)
+      return bytes(ret)
+
+
+def _EncodeMUtf8(string):
+  ret = bytearray()
+  for char in string:
+    code = ord(char)
+    if 0 < code < 0x80:
+      ret.append(code)
+    elif code < 0x800:
+      ret += bytes([0xc0 | (code >> 6), 0x80 | (code & 0x3f)])
+    else:
+      ret += bytes([
+          0xe0 | (code >> 12), 0x80 | ((code >> 6) & 0x3f), 0x80 | (code & 0x3f)
+      ])
+  return bytes(ret)
+
+
+def _Align(buf, alignment):
+  buf += b'\0' * (-len(buf) % alignment)
+
+
+def EncodeValue(value_type, value=0, size=None):
+  """Returns an encoded_value of |value_type| holding the integer |value|."""
+  if value_type in (0x1e, 0x1f):  # VALUE_NULL, VALUE_BOOLEAN
+    return bytes([(value << 5) | value_type])
+  if size is None:
+    size = max(1, (value.bit_length() + 8) // 8)
+  payload = value.to_bytes(size, 'little', signed=value < 0)
+  return bytes([((size - 1) << 5) | value_type]) + payload
+
+
+def EncodeArray(encoded_values):
+  return (bytes([0x1c]) + _EncodeULeb128(len(encoded_values)) +
+          b''.join(encoded_values))
+
+
+def _EncodeAnnotation(type_idx, elements):
+  ret = _EncodeULeb128(type_idx) + _EncodeULeb128(len(elements))
+  for name_idx, encoded_value in elements:
+    ret += _EncodeULeb128(name_idx) + encoded_value
+  return ret
+
+
+def BuildDex(strings, types, protos, methods, class_defs=(), fields=()):
+  """Returns the bytes of a minimal dex file with the given items.
+
+  Args:
+    strings: List of strings.
+    types: List of string indices.
+    protos: List of (shorty_idx, return_type_idx, [parameter type_idx, ...]).
+    methods: List of (class type_idx, proto_idx, name string_idx).
+    class_defs: List of (class_idx, access_flags, superclass_idx,
+      [interface type_idx, ...]), optionally followed by
+      [(method_idx, access_flags), ...] for the class's direct methods and by
+      (class annotations, {method_idx: method annotations}). Annotations are
+      lists of (visibility, type_idx, [(name string_idx, EncodeValue()), ...]).
+    fields: List of (class type_idx, type_idx, name string_idx).
+  """
+  header_size = 0x70
+  string_ids_off = header_size
+  type_ids_off = string_ids_off + 4 * len(strings)
+  proto_ids_off = type_ids_off + 4 * len(types)
+  field_ids_off = proto_ids_off + 12 * len(protos)
+  method_ids_off = field_ids_off + 8 * len(fields)
+  class_defs_off = method_ids_off + 8 * len(methods)
+  data_off = class_defs_off + 32 * len(class_defs)
+
+  data = bytearray(data_off)
+  type_list_offsets = {}
+  type_lists = [p[2] for p in protos] + [c[3] for c in class_defs]
+  type_lists_off = len(data)
+  for type_list in type_lists:
+    key = tuple(type_list)
+    if not key or key in type_list_offsets:
+      continue
+    _Align(data, 4)
+    type_list_offsets[key] = len(data)
+    data += struct.pack('<I', len(key))
+    data += b''.join(struct.pack('<H', t) for t in key)
+
+  string_data_offsets = []
+  for string in strings:
+    string_data_offsets.append(len(data))
+    data += _EncodeULeb128(len(string)) + _EncodeMUtf8(string) + b'\0'
+
+  def add_annotation_set(annotations):
+    if not annotations:
+      return 0
+    annotation_offs = []
+    for visibility, type_idx, elements in annotations:
+      annotation_offs.append(len(data))
+      data.append(visibility)
+      data.extend(_EncodeAnnotation(type_idx, elements))
+    _Align(data, 4)
+    ret = len(data)
+    data.extend(struct.pack('<I', len(annotation_offs)))
+    data.extend(b''.join(struct.pack('<I', o) for o in annotation_offs))
+    return ret
+
+  class_data_offsets = []
+  annotations_offsets = []
+  for class_def in class_defs:
+    class_methods = class_def[4] if len(class_def) > 4 else ()
+    class_annotations, method_annotations = (class_def[5] if len(class_def) > 5
+                                             else ((), {}))
+    class_data_off = 0
+    if class_methods:
+      class_data_off = len(data)
+      data += _EncodeULeb128(0) + _EncodeULeb128(0)
+      data += _EncodeULeb128(len(class_methods)) + _EncodeULeb128(0)
+      prev_idx = 0
+      for method_idx, access_flags in class_methods:
+        data += (_EncodeULeb128(method_idx - prev_idx) +
+                 _EncodeULeb128(access_flags) + _EncodeULeb128(0))
+        prev_idx = method_idx
+    class_data_offsets.append(class_data_off)
+
+    annotations_off = 0
+    if class_annotations or method_annotations:
+      class_set_off = add_annotation_set(class_annotations)
+      method_set_offs = [(idx, add_annotation_set(a))
+                         for idx, a in sorted(method_annotations.items())]
+      _Align(data, 4)
+      annotations_off = len(data)
+      data += struct.pack('<IIII', class_set_off, 0, len(method_set_offs), 0)
+      for method_idx, set_off in method_set_offs:
+        data += struct.pack('<II', method_idx, set_off)
+    annotations_offsets.append(annotations_off)
+
+  _Align(data, 4)
+  map_off = len(data)
+  map_items = [(0, 1, 0), (1, len(strings), string_ids_off)]
+  if type_list_offsets:
+    map_items.append(
+        (_TYPE_LIST_MAP_TYPE, len(type_list_offsets), type_lists_off))
+  data += struct.pack('<I', len(map_items))
+  for item_type, size, offset in map_items:
+    data += struct.pack('<HHII', item_type, 0, size, offset)
+
+  struct.pack_into('<8sI20sIIIII', data, 0, b'dex\n035\0', 0, b'\0' * 20,
+                   len(data), header_size, 0x12345678, 0, 0)
+  struct.pack_into('<I', data, 0x34, map_off)
+  struct.pack_into('<14I', data, 0x38, len(strings), string_ids_off,
+                   len(types), type_ids_off, len(protos), proto_ids_off,
+                   len(fields), field_ids_off, len(methods), method_ids_off,
+                   len(class_defs), class_defs_off, len(data) - data_off,
+                   data_off)
+  for i, offset in enumerate(string_data_offsets):
+    struct.pack_into('<I', data, string_ids_off + 4 * i, offset)
+  for i, string_idx in enumerate(types):
+    struct.pack_into('<I', data, type_ids_off + 4 * i, string_idx)
+  for i, (shorty_idx, return_type_idx, params) in enumerate(protos):
+    struct.pack_into('<III', data, proto_ids_off + 12 * i, shorty_idx,
+                     return_type_idx, type_list_offsets.get(tuple(params), 0))
+  for i, field in enumerate(fields):
+    struct.pack_into('<HHI', data, field_ids_off + 8 * i, *field)
+  for i, method in enumerate(methods):
+    struct.pack_into('<HHI', data, method_ids_off + 8 * i, *method)
+  for i, class_def in enumerate(class_defs):
+    class_idx, access_flags, superclass_idx, interfaces = class_def[:4]
+    struct.pack_into('<8I', data, class_defs_off + 32 * i, class_idx,
+                     access_flags, superclass_idx,
+                     type_list_offsets.get(tuple(interfaces), 0), 0,
+                     annotations_offsets[i], class_data_offsets[i], 0)
+  return bytes(data)
+
+
+def _BuildSampleDex():
+  strings = [
+      'I', 'II', 'LFoo;', 'Ljava/lang/Object;', 'V', 'VI', 'bar', 'foo',
+      'café'
+  ]
+  types = [0, 2, 3, 4]
+  protos = [(4, 3, []), (5, 3, [0]), (1, 0, [0])]
+  methods = [(1, 0, 7), (1, 1, 6), (1, 2, 8), (2, 0, 7)]
+  class_defs = [(1, 0x1, 2, [])]
+  return BuildDex(strings, types, protos, methods, class_defs)
+
+
+def BuildTestDex():
+  """Returns a dex file with annotated test classes."""
+  strings = [
+      'Lorg/chromium/foo/FooTest;',  # 0
+      'Ljava/lang/Object;',
+      'Lorg/chromium/foo/AbstractTest;',
+      'Lorg/chromium/foo/Outer$InnerTest;',
+      'Lorg/chromium/base/test/util/Batch;',
+      'Landroidx/test/filters/SmallTest;',  # 5
+      'Lorg/chromium/base/test/util/Feature;',
+      'Ldalvik/annotation/Signature;',
+      'Lorg/chromium/base/test/util/Timeout;',
+      'V',
+      'testA',  # 10
+      'testB',
+      'helper',
+      'testPrivate',
+      '<init>',
+      'value',  # 15
+      'UnitTests',
+      'Cronet',
+      'Other',
+      'mode',
+      'FAST',  # 20
+      'enabled',
+      'testC',
+      'scale',
+      'Lorg/chromium/foo/Outer$InnerSubTest;',
+  ]
+  # Type indices are the same as the string indices of the first 10 strings.
+  types = list(range(10)) + [24]
+  protos = [(9, 9, [])]
+  fields = [(8, 8, 20)]
+  methods = [
+      (0, 0, 10),  # 0: FooTest.testA
+      (0, 0, 11),  # 1: FooTest.testB
+      (0, 0, 12),  # 2: FooTest.helper
+      (0, 0, 13),  # 3: FooTest.testPrivate
+      (0, 0, 14),  # 4: FooTest.<init>
+      (2, 0, 10),  # 5: AbstractTest.testA
+      (3, 0, 22),  # 6: Outer$InnerTest.testC
+      (10, 0, 22),  # 7: Outer$InnerSubTest.testC
+  ]
+  class_annotations = [
+      (1, 4, [(15, EncodeValue(0x17, 16))]),
+      (2, 7, [(15, EncodeArray([EncodeValue(0x17, 17)]))]),
+  ]
+  method_annotations = {
+      0: [(1, 6,
+           [(15, EncodeArray([EncodeValue(0x17, 17),
+                              EncodeValue(0x17, 18)]))])],
+      1: [
+          (1, 5, []),
+          (1, 8, [(15, EncodeValue(0x04, -5000)), (19, EncodeValue(0x1b, 0)),
+                  (21, EncodeValue(0x1f, 1)), (23, EncodeValue(0x1e)),
+                  (12, EncodeArray([]))]),
+      ],
+  }
+  class_defs = [
+      (0, 0x1, 1, [], [(0, 0x1), (1, 0x1), (2, 0x1), (3, 0x2), (4, 0x10001)],
+       (class_annotations, method_annotations)),
+      (2, 0x401, 1, [], [(5, 0x1)]),
+      (3, 0x1, 1, [], [(6, 0x1)]),
+      (10, 0x1, 3, [], [(7, 0x1)]),
+  ]
+  return BuildDex(strings, types, protos, methods, class_defs, fields)
+
+
+def _BuildLargeDex(num_classes, methods_per_class):
+  strings = ['I', 'II', 'Ljava/lang/Object;', 'V', 'VI']
+  types = [0, 2, 3]
+  protos = [(3, 2, []), (4, 2, [0]), (1, 0, [0])]
+  methods = []
+  class_defs = []
+  for i in range(num_classes):
+    strings.append('Lorg/chromium/pkg{}/Class{};'.format(i % 50, i))
+    types.append(len(strings) - 1)
+    class_defs.append((len(types) - 1, 0x1, 1, []))
+    for j in range(methods_per_class):
+      strings.append('method{}'.format(j + i * methods_per_class))
+      methods.append((len(types) - 1, j % len(protos), len(strings) - 1))
+  # Dex requires sorted strings, which the parser does not rely on.
+  return BuildDex(strings, types, protos, methods, class_defs)
+
+
+class DexParserTest(unittest.TestCase):
+  def _AssertSameItems(self, eager, lazy):
+    for name in ('type_item_list', 'proto_item_list', 'method_item_list',
+                 'string_item_list', 'class_def_item_list'):
+      eager_list = getattr(eager, name)
+      lazy_list = getattr(lazy, name)
+      self.assertEqual(len(eager_list), len(lazy_list), name)
+      self.assertEqual(list(eager_list), list(lazy_list), name)
+      for i in range(len(eager_list)):
+        self.assertEqual(eager_list[i], lazy_list[i], name)
+    self.assertEqual([list(t) for t in eager.type_list_item_list],
+                     [list(t) for t in lazy.type_list_item_list])
+    self.assertEqual(list(eager.IterMethodSignatureParts()),
+                     list(lazy.IterMethodSignatureParts()))
+
+  def testEagerParsing(self):
+    dexfile = dex_parser.DexFile(bytearray(_BuildSampleDex()))
+    self.assertEqual([
+        ('LFoo;', 'V', 'foo', ()),
+        ('LFoo;', 'V', 'bar', ('I', )),
+        ('LFoo;', 'I', 'café', ('I', )),
+        ('Ljava/lang/Object;', 'V', 'foo', ()),
+    ], list(dexfile.IterMethodSignatureParts()))
+
+  def testLazyMatchesEager(self):
+    data = _BuildSampleDex()
+    self._AssertSameItems(dex_parser.DexFile(bytearray(data)),
+                          dex_parser.DexFile(data, lazy=True))
+
+  def testLazyFromPath(self):
+    data = _BuildSampleDex()
+    with tempfile.NamedTemporaryFile(suffix='.dex') as f:
+      f.write(data)
+      f.flush()
+      self._AssertSameItems(dex_parser.DexFile(bytearray(data)),
+                            dex_parser.DexFile.FromPath(f.name))
+
+  def testIterDexFilesInZip(self):
+    data = _BuildSampleDex()
+    with tempfile.NamedTemporaryFile(suffix='.apk') as f:
+      with zipfile.ZipFile(f, 'w') as z:
+        z.writestr('AndroidManifest.xml', 'manifest')
+        z.writestr('classes.dex', data, zipfile.ZIP_STORED)
+        z.writestr('classes2.dex', data, zipfile.ZIP_DEFLATED)
+      f.flush()
+      for lazy in (False, True):
+        dexfiles = list(dex_parser.IterDexFilesInZip(f.name, lazy=lazy))
+        self.assertEqual(['classes.dex', 'classes2.dex'],
+                         [name for name, _ in dexfiles])
+        for _, dexfile in dexfiles:
+          self._AssertSameItems(dex_parser.DexFile(bytearray(data)), dexfile)
+
+  def testIterDexFilesInZipClosesMapping(self):
+    data = _BuildSampleDex()
+    mappings = []
+    real_mmap = dex_parser.mmap.mmap
+
+    def record_mmap(*args, **kwargs):
+      mappings.append(real_mmap(*args, **kwargs))
+      return mappings[-1]
+
+    with tempfile.NamedTemporaryFile(suffix='.apk') as f:
+      with zipfile.ZipFile(f, 'w') as z:
+        z.writestr('classes.dex', data, zipfile.ZIP_STORED)
+        z.writestr('classes2.dex', data, zipfile.ZIP_STORED)
+      f.flush()
+      with mock.patch.object(dex_parser.mmap, 'mmap', side_effect=record_mmap):
+        # Stop after the first entry.
+        dexfiles = dex_parser.IterDexFilesInZip(f.name)
+        self.assertEqual('classes.dex', next(dexfiles)[0])
+        dexfiles.close()
+        # Run to completion while keeping a DexFile alive.
+        kept = list(dex_parser.IterDexFilesInZip(f.name))
+    self.assertTrue(mappings[0].closed)
+    self.assertFalse(mappings[1].closed)
+    self._AssertSameItems(dex_parser.DexFile(bytearray(data)), kept[1][1])
+
+  def testClassMethodsAndAnnotations(self):
+    data = BuildTestDex()
+    for dexfile in (dex_parser.DexFile(bytearray(data)),
+                    dex_parser.DexFile(data, lazy=True)):
+      class_defs = list(dexfile.class_def_item_list)
+      self.assertEqual([(0, 0x1), (1, 0x1), (2, 0x1), (3, 0x2), (4, 0x10001)],
+                       list(dexfile.IterClassMethods(class_defs[0])))
+      self.assertEqual([(6, 0x1)], list(dexfile.IterClassMethods(class_defs[2])))
+
+      class_annotations, method_annotations = dexfile.GetClassAnnotations(
+          class_defs[0])
+      self.assertEqual([
+          dex_parser.Annotation(dex_parser.VISIBILITY_RUNTIME,
+                                'Lorg/chromium/base/test/util/Batch;',
+                                {'value': 'UnitTests'}),
+          dex_parser.Annotation(dex_parser.VISIBILITY_SYSTEM,
+                                'Ldalvik/annotation/Signature;',
+                                {'value': ['Cronet']}),
+      ], class_annotations)
+      self.assertEqual({0, 1}, set(method_annotations))
+      self.assertEqual({'value': ['Cronet', 'Other']},
+                       method_annotations[0][0].elements)
+      self.assertEqual('Landroidx/test/filters/SmallTest;',
+                       method_annotations[1][0].type)
+      self.assertEqual(
+          {
+              'value': -5000,
+              'mode': 'FAST',
+              'enabled': True,
+              'scale': None,
+              'helper': [],
+          }, method_annotations[1][1].elements)
+      self.assertEqual(([], {}), dexfile.GetClassAnnotations(class_defs[1]))
+
+  @unittest.skipUnless(_RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=1 to run.')
+  def testBenchmarkLazyParsing(self):
+    data = _BuildLargeDex(num_classes=5000, methods_per_class=12)
+    print()
+    for lazy in (False, True):
+      start = time.time()
+      dexfile = dex_parser.DexFile(data if lazy else bytearray(data), lazy=lazy)
+      parse_time = time.time() - start
+      num_methods = sum(1 for _ in dexfile.IterMethodSignatureParts())
+      total_time = time.time() - start
+      print('{}: parse={:.3f}s, parse+iterate {} methods={:.3f}s'.format(
+          'lazy' if lazy else 'eager', parse_time, num_methods, total_time))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -10,7 +10,6 @@ import logging
 import os
 import re
 import tempfile
-import threading
 import xml.etree.ElementTree
 
 from devil.android import apk_helper
@@ -21,9 +20,6 @@ from pylib.base import test_instance
 from pylib.symbols import stack_symbolizer
 from pylib.utils import test_filter
 
-with host_paths.SysPath(host_paths.BUILD_UTIL_PATH):
-  from lib.common import unittest_util
-
 BROWSER_TEST_SUITES = [
     'android_browsertests',
     'android_sync_integration_tests',
@@ -336,7 +332,6 @@ class GtestTestInstance(test_instance.TestInstance):
     self._exe_dist_dir = None
     self._external_shard_index = args.test_launcher_shard_index
     self._extract_test_list_from_filter = args.extract_test_list_from_filter
-    self._filter_tests_lock = threading.Lock()
     self._gs_test_artifacts_bucket = args.gs_test_artifacts_bucket
     self._isolated_script_test_output = args.isolated_script_test_output
     self._isolated_script_test_perf_output = (
@@ -607,25 +602,22 @@ class GtestTestInstance(test_instance.TestInstance):
       gtest_filter_strings.extend(self._gtest_filters)
 
     filtered_test_list = test_list
-    # This lock is required because on older versions of Python
-    # |unittest_util.FilterTestNames| use of |fnmatch| is not threadsafe.
-    with self._filter_tests_lock:
-      for gtest_filter_string in gtest_filter_strings:
-        logging.debug('Filtering tests using: %s', gtest_filter_string)
-        filtered_test_list = unittest_util.FilterTestNames(
-            filtered_test_list, gtest_filter_string)
-
-      if self._run_disabled and self._gtest_filters:
-        out_filtered_test_list = list(set(test_list)-set(filtered_test_list))
-        for test in out_filtered_test_list:
-          test_name_no_disabled = TestNameWithoutDisabledPrefix(test)
-          if test_name_no_disabled == test:
-            continue
-          if all(
-              unittest_util.FilterTestNames([test_name_no_disabled],
-                                            gtest_filter)
-              for gtest_filter in self._gtest_filters):
-            filtered_test_list.append(test)
+    for gtest_filter_string in gtest_filter_strings:
+      logging.debug('Filtering tests using: %s', gtest_filter_string)
+      filtered_test_list = test_filter.CompiledFilter(
+          gtest_filter_string).FilterTestNames(filtered_test_list)
+
+    if self._run_disabled and self._gtest_filters:
+      compiled_filters = [
+          test_filter.CompiledFilter(f) for f in self._gtest_filters
+      ]
+      out_filtered_test_list = list(set(test_list)-set(filtered_test_list))
+      for test in out_filtered_test_list:
+        test_name_no_disabled = TestNameWithoutDisabledPrefix(test)
+        if test_name_no_disabled == test:
+          continue
+        if all(f.Matches(test_name_no_disabled) for f in compiled_filters):
+          filtered_test_list.append(test)
     return filtered_test_list
 
   def _GenerateDisabledFilterString(self, disabled_prefixes):
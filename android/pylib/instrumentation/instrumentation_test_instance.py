@@ -3,6 +3,7 @@
 # found in the LICENSE file.
 
 
+import collections
 import copy
 import logging
 import os
@@ -13,18 +14,15 @@ from pylib import constants
 from pylib.base import base_test_result
 from pylib.base import test_exception
 from pylib.base import test_instance
-from pylib.constants import host_paths
 from pylib.instrumentation import instrumentation_parser
 from pylib.instrumentation import test_result
 from pylib.symbols import deobfuscator
 from pylib.symbols import stack_symbolizer
 from pylib.utils import dexdump
 from pylib.utils import gold_utils
+from pylib.utils import run_metrics
 from pylib.utils import test_filter
 
-with host_paths.SysPath(host_paths.BUILD_UTIL_PATH):
-  from lib.common import unittest_util
-
 # Ref: http://developer.android.com/reference/android/app/Activity.html
 _ACTIVITY_RESULT_CANCELED = 0
 _ACTIVITY_RESULT_OK = -1
@@ -244,27 +242,6 @@ def FilterTests(tests,
     A list of filtered tests
   """
 
-  def test_names_from_pattern(combined_pattern, test_names):
-    patterns = combined_pattern.split(':')
-
-    hashable_patterns = set()
-    filename_patterns = []
-    for pattern in patterns:
-      if ('*' in pattern or '?' in pattern or '[' in pattern):
-        filename_patterns.append(pattern)
-      else:
-        hashable_patterns.add(pattern)
-
-    filter_test_names = set(
-        unittest_util.FilterTestNames(test_names, ':'.join(
-            filename_patterns))) if len(filename_patterns) > 0 else set()
-
-    for test_name in test_names:
-      if test_name in hashable_patterns:
-        filter_test_names.add(test_name)
-
-    return filter_test_names
-
   def get_test_names(test):
     test_names = set()
     # Allow fully-qualified name as well as an omitted package.
@@ -290,53 +267,6 @@ def FilterTests(tests,
     test_names.add(unqualified_junit4_test_name)
     return test_names
 
-  def get_tests_from_names(tests, test_names, tests_to_names):
-    ''' Returns the tests for which the given names apply
-
-    Args:
-      tests: a list of tests. e.g. [
-            {'annotations": {}, 'class': 'com.example.TestA', 'method':'test1'},
-            {'annotations": {}, 'class': 'com.example.TestB', 'method':'test2'}]
-      test_names: a collection of names determining tests to return.
-
-    Return:
-      A list of tests that match the given test names
-    '''
-    filtered_tests = []
-    for t in tests:
-      current_test_names = tests_to_names[id(t)]
-
-      for current_test_name in current_test_names:
-        if current_test_name in test_names:
-          filtered_tests.append(t)
-          break
-
-    return filtered_tests
-
-  def remove_tests_from_names(tests, remove_test_names, tests_to_names):
-    ''' Returns the tests from the given list with given names removed
-
-    Args:
-      tests: a list of tests. e.g. [
-            {'annotations": {}, 'class': 'com.example.TestA', 'method':'test1'},
-            {'annotations": {}, 'class': 'com.example.TestB', 'method':'test2'}]
-      remove_test_names: a collection of names determining tests to remove.
-      tests_to_names: a dcitionary of test ids to a collection of applicable
-            names for that test
-
-    Return:
-      A list of tests that don't match the given test names
-    '''
-    filtered_tests = []
-
-    for t in tests:
-      for name in tests_to_names[id(t)]:
-        if name in remove_test_names:
-          break
-      else:
-        filtered_tests.append(t)
-    return filtered_tests
-
   def gtests_filter(tests, combined_filters):
     ''' Returns the tests after the combined_filters have been applied
 
@@ -354,47 +284,39 @@ def FilterTests(tests,
     if not combined_filters:
       return tests
 
-    # Collect all test names
-    all_test_names = set()
-    tests_to_names = {}
+    compiled_filters = [test_filter.CompiledFilter(f) for f in combined_filters]
+    filtered_tests = []
     for t in tests:
-      tests_to_names[id(t)] = get_test_names(t)
-      for name in tests_to_names[id(t)]:
-        all_test_names.add(name)
-
-    for combined_filter in combined_filters:
-      pattern_groups = combined_filter.split('-')
-      negative_pattern = pattern_groups[1] if len(pattern_groups) > 1 else None
-      positive_pattern = pattern_groups[0]
-      if positive_pattern:
-        # Only use the test names that match the positive pattern
-        positive_test_names = test_names_from_pattern(positive_pattern,
-                                                      all_test_names)
-        tests = get_tests_from_names(tests, positive_test_names, tests_to_names)
-
-      if negative_pattern:
-        # Remove any test the negative filter matches
-        remove_names = test_names_from_pattern(negative_pattern, all_test_names)
-        tests = remove_tests_from_names(tests, remove_names, tests_to_names)
-
-    return tests
+      test_names = get_test_names(t)
+      if all(f.MatchesAnyName(test_names) for f in compiled_filters):
+        filtered_tests.append(t)
+    return filtered_tests
 
   def annotation_filter(all_annotations):
     if not annotations:
       return True
-    return any_annotation_matches(annotations, all_annotations)
+    return any_annotation_matches(annotations_index, all_annotations)
 
   def excluded_annotation_filter(all_annotations):
     if not excluded_annotations:
       return True
-    return not any_annotation_matches(excluded_annotations,
+    return not any_annotation_matches(excluded_annotations_index,
                                       all_annotations)
 
-  def any_annotation_matches(filter_annotations, all_annotations):
+  def index_annotations(filter_annotations):
+    index = collections.defaultdict(list)
+    for ak, av in filter_annotations or []:
+      index[ak].append(av)
+    return index
+
+  annotations_index = index_annotations(annotations)
+  excluded_annotations_index = index_annotations(excluded_annotations)
+
+  def any_annotation_matches(filter_annotations_index, all_annotations):
     return any(
-        ak in all_annotations
-        and annotation_value_matches(av, all_annotations[ak])
-        for ak, av in filter_annotations)
+        annotation_value_matches(av, all_annotations[ak])
+        for ak, avs in filter_annotations_index.items() if ak in all_annotations
+        for av in avs)
 
   def annotation_value_matches(filter_av, av):
     if filter_av is None:
@@ -425,7 +347,15 @@ def FilterTests(tests,
 
 
 def GetTestsFromDexdump(test_apk):
-  dex_dumps = dexdump.Dump(test_apk)
+  return _GetTestsFromDexDumps(dexdump.Dump(test_apk))
+
+
+def GetTestsFromDex(test_apk):
+  """Like GetTestsFromDexdump(), but parses the APK's dex files in-process."""
+  return _GetTestsFromDexDumps(dexdump.DumpWithDexParser(test_apk))
+
+
+def _GetTestsFromDexDumps(dex_dumps):
   tests = []
 
   def get_test_methods(methods, annotations):
@@ -1083,7 +1013,8 @@ class InstrumentationTestInstance(test_instance.TestInstance):
   def MaybeDeobfuscateLines(self, lines):
     if not self._deobfuscator:
       return lines
-    return self._deobfuscator.TransformLines(lines)
+    with run_metrics.Timer('deobfuscate'):
+      return self._deobfuscator.TransformLines(lines)
 
   def ProcessRawTests(self, raw_tests):
     inflated_tests = self._ParameterizeTestsWithFlags(
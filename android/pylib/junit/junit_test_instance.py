@@ -21,6 +21,7 @@ class JunitTestInstance(test_instance.TestInstance):
     self._robolectric_runtime_deps_dir = args.robolectric_runtime_deps_dir
     self._runner_filter = args.runner_filter
     self._json_config = args.json_config
+    self._reuse_jvms = args.reuse_jvms
     self._shadows_allowlist = args.shadows_allowlist
     self._shards = args.shards
     self._shard_filter = None
@@ -53,6 +54,10 @@ class JunitTestInstance(test_instance.TestInstance):
   def debug_socket(self):
     return self._debug_socket
 
+  @property
+  def reuse_jvms(self):
+    return self._reuse_jvms
+
   @property
   def native_libs_dir(self):
     return self._native_libs_dir
@@ -24,6 +24,8 @@ from pylib import constants
 from pylib.constants import host_paths
 from pylib.base import environment
 from pylib.utils import instrumentation_tracing
+from pylib.utils import test_list_cache
+from pylib.utils import test_timing_db
 from py_trace_event import trace_event
 
 
@@ -121,6 +123,12 @@ class LocalDeviceEnvironment(environment.Environment):
       self._force_main_user = args.force_main_user
     self._use_persistent_shell = args.use_persistent_shell
     self._disable_test_server = args.disable_test_server
+    self._test_timing_db = None
+    if getattr(args, 'test_timing_db', None):
+      self._test_timing_db = test_timing_db.TestTimingDb(args.test_timing_db)
+    self._work_stealing = getattr(args, 'work_stealing', False)
+    self._test_list_cache_dir = getattr(args, 'test_list_cache_dir', None)
+    self._test_list_cache = None
 
     use_local_devil_tools = False
     if hasattr(args, 'use_local_devil_tools'):
@@ -266,6 +274,22 @@ class LocalDeviceEnvironment(environment.Environment):
   def force_main_user(self):
     return self._force_main_user
 
+  @property
+  def test_timing_db(self):
+    return self._test_timing_db
+
+  @property
+  def work_stealing(self):
+    return self._work_stealing
+
+  @property
+  def test_list_cache(self):
+    if not self._test_list_cache:
+      self._test_list_cache = test_list_cache.TestListCache(
+          self._test_list_cache_dir
+          or os.path.join(constants.GetOutDirectory(), 'test_list_cache'))
+    return self._test_list_cache
+
   #override
   def TearDown(self):
     if self.trace_output and self._trace_all:
@@ -273,6 +297,11 @@ class LocalDeviceEnvironment(environment.Environment):
     elif self.trace_output:
       self.DisableTracing()
 
+    if self._test_timing_db:
+      self._test_timing_db.Save()
+    if self._test_list_cache:
+      self._test_list_cache.LogStats()
+
     # By default, teardown will invoke ADB. When receiving SIGTERM due to a
     # timeout, there's a high probability that ADB is non-responsive. In these
     # cases, sending an ADB command will potentially take a long time to time
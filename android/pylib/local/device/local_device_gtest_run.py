@@ -25,6 +25,7 @@ from devil.utils import reraiser_thread
 from incremental_install import installer
 from pylib import constants
 from pylib.base import base_test_result
+from pylib.base import test_collection
 from pylib.gtest import gtest_test_instance
 from pylib.local import local_test_server_spawner
 from pylib.local.device import local_device_environment
@@ -33,6 +34,8 @@ from pylib.symbols import stack_symbolizer
 from pylib.utils import code_coverage_utils
 from pylib.utils import google_storage_helper
 from pylib.utils import logdog_helper
+from pylib.utils import run_metrics
+from pylib.utils import test_list_cache
 from py_trace_event import trace_event
 from py_utils import contextlib_ext
 from py_utils import tempfile_ext
@@ -447,7 +450,8 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
     def individual_device_set_up(device, host_device_tuples):
       def install_apk(dev):
         # Install test APK.
-        self._delegate.Install(dev)
+        with run_metrics.Timer('install_apk'):
+          self._delegate.Install(dev)
 
       def push_test_data(dev):
         if self._test_instance.use_existing_test_data:
@@ -562,6 +566,31 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
     shards.extend(self._PartitionTests(tests, device_count, max_shard_size))
     return shards
 
+  #override
+  def _CreateWorkStealingCollection(self, shards):
+    # Each shard runs as a single gtest invocation. Let the collection split
+    # them into smaller invocations, keeping PRE_ tests with their test.
+    return test_collection.WorkStealingTestCollection(
+        [self._GetPartitionUnits(shard) for shard in shards])
+
+  def _MakeTestListCacheKey(self, flags):
+    # Which tests are compiled in or listed can depend on the device's ABI and
+    # SDK level.
+    devices = sorted({(d.product_cpu_abi, d.build_version_sdk)
+                      for d in self._env.devices})
+    key = test_list_cache.CacheKey('gtest', {
+        'flags': flags,
+        'devices': devices
+    })
+    if self._test_instance.apk:
+      # Native libraries are large, so hash entry CRCs rather than contents.
+      key.AddZipEntries(self._test_instance.apk)
+    else:
+      # The executable loads shared libraries and data files from the
+      # directory, and those can affect the test list too.
+      key.AddDirectory(self._test_instance.exe_dist_dir)
+    return key
+
   #override
   def _GetTests(self):
     if self._test_instance.extract_test_list_from_filter:
@@ -575,6 +604,14 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
     # Even when there's only one device, it still makes sense to retrieve the
     # test list so that tests can be split up and run in batches rather than all
     # at once (since test output is not streamed).
+    flags = [
+        f for f in self._test_instance.flags if f not in [
+            '--wait-for-debugger', '--wait-for-java-debugger',
+            '--gtest_also_run_disabled_tests'
+        ]
+    ]
+    flags.append('--gtest_list_tests')
+
     @local_device_environment.handle_shard_failures_with(
         on_failure=self._env.DenylistDevice)
     def list_tests(dev):
@@ -583,14 +620,6 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
       if self._test_instance.wait_for_java_debugger:
         timeout = None
 
-      flags = [
-          f for f in self._test_instance.flags if f not in [
-              '--wait-for-debugger', '--wait-for-java-debugger',
-              '--gtest_also_run_disabled_tests'
-          ]
-      ]
-      flags.append('--gtest_list_tests')
-
       # TODO(crbug.com/40522854): Remove retries when no longer necessary.
       for i in range(0, retries + 1):
         logging.info('flags:')
@@ -614,15 +643,19 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
           break
       return tests
 
-    # Query all devices in case one fails.
-    test_lists = self._env.parallel_devices.pMap(list_tests).pGet(None)
+    def list_tests_on_all_devices():
+      # Query all devices in case one fails.
+      test_lists = self._env.parallel_devices.pMap(list_tests).pGet(None)
+
+      # If all devices failed to list tests, raise an exception.
+      # Check that tl is not None and is not empty.
+      if all(not tl for tl in test_lists):
+        raise device_errors.CommandFailedError(
+            'Failed to list tests on any device')
+      return list(sorted(set().union(*[set(tl) for tl in test_lists if tl])))
 
-    # If all devices failed to list tests, raise an exception.
-    # Check that tl is not None and is not empty.
-    if all(not tl for tl in test_lists):
-      raise device_errors.CommandFailedError(
-          'Failed to list tests on any device')
-    tests = list(sorted(set().union(*[set(tl) for tl in test_lists if tl])))
+    tests = self._env.test_list_cache.GetOrList(
+        lambda: self._MakeTestListCacheKey(flags), list_tests_on_all_devices)
     tests = self._test_instance.FilterTests(tests)
     tests = self._ApplyExternalSharding(
         tests, self._test_instance.external_shard_index,
@@ -677,6 +710,27 @@ class LocalDeviceGtestRun(local_device_test_run.LocalDeviceTestRun):
   def _GroupTestsAfterSharding(self, tests):
     return self._GroupTests(tests)
 
+  #override
+  def _GetPartitionUnits(self, tests):
+    # Keep PRE_ tests in the same partition as, and in front of, the test they
+    # prepare for.
+    pre_tests, _ = _GroupPreTests(tests)
+    chain_by_test = {}
+    for trim_test, test_list in pre_tests.items():
+      for test in test_list:
+        chain_by_test[test] = trim_test
+
+    units = []
+    last_chain = None
+    for test in tests:
+      chain = chain_by_test.get(test)
+      if chain is not None and chain == last_chain:
+        units[-1].append(test)
+      else:
+        units.append([test])
+      last_chain = chain
+    return units
+
   def _UploadTestArtifacts(self, device, test_artifacts_device_dir):
     # TODO(jbudorick): Reconcile this with the output manager once
     # https://codereview.chromium.org/2933993002/ lands.
@@ -8,6 +8,7 @@
 
 
 import os
+import tempfile
 import unittest
 
 from pylib.gtest import gtest_test_instance
@@ -84,6 +85,69 @@ class LocalDeviceGtestRunTest(unittest.TestCase):
     self.assertTrue(isSliceInList(expectedTestcase2, actualTestCase))
     self.assertTrue(isSliceInList(expectedOtherTestcase, actualTestCase))
 
+  def testGetPartitionUnits(self):
+    tests = self._obj._GroupTests([
+        "TestClass1.testcase1",
+        "TestClass1.otherTestCase",
+        "TestClass1.PRE_testcase1",
+        "TestClass1.PRE_PRE_testcase1",
+    ])
+    units = self._obj._GetPartitionUnits(tests)
+    self.assertIn(["TestClass1.otherTestCase"], units)
+    self.assertIn([
+        "TestClass1.PRE_PRE_testcase1",
+        "TestClass1.PRE_testcase1",
+        "TestClass1.testcase1",
+    ], units)
+    self.assertEqual(2, len(units))
+
+  def testPartitionTestsKeepsPreTestsTogether(self):
+    self._obj._env.test_timing_db = None
+    tests = self._obj._GroupTests([
+        "TestClass1.a",
+        "TestClass1.b",
+        "TestClass1.c",
+        "TestClass1.PRE_c",
+        "TestClass1.PRE_PRE_c",
+    ])
+    partitions = self._obj._PartitionTests(tests, 3, float('inf'))
+    self.assertTrue(
+        any(
+            isSliceInList([
+                "TestClass1.PRE_PRE_c",
+                "TestClass1.PRE_c",
+                "TestClass1.c",
+            ], p) for p in partitions))
+
+  def testMakeTestListCacheKey(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      exe_dist_dir = os.path.join(tmp_dir, 'suite__dist')
+      os.makedirs(os.path.join(exe_dist_dir, 'lib'))
+      for name in ('suite', os.path.join('lib', 'libbase.so')):
+        with open(os.path.join(exe_dist_dir, name), 'w') as f:
+          f.write(name)
+      self._obj._test_instance.apk = None
+      self._obj._test_instance.exe_dist_dir = exe_dist_dir
+      device = mock.MagicMock(product_cpu_abi='arm64-v8a',
+                              build_version_sdk=30)
+      self._obj._env.devices = [device]
+
+      def digest():
+        return self._obj._MakeTestListCacheKey(['--flag']).HexDigest()
+
+      digests = [digest()]
+      self.assertEqual(digests[0], digest())
+      # Shared libraries next to the executable are part of the key.
+      with open(os.path.join(exe_dist_dir, 'lib', 'libbase.so'), 'w') as f:
+        f.write('changed')
+      digests.append(digest())
+      # So are the ABI and SDK level of the devices.
+      device.product_cpu_abi = 'x86_64'
+      digests.append(digest())
+      device.build_version_sdk = 31
+      digests.append(digest())
+      self.assertEqual(4, len(set(digests)))
+
   def testAppendPreTests(self):
     failed_tests = [
         "TestClass1.PRE_PRE_testcase1",
@@ -9,7 +9,6 @@ import hashlib
 import json
 import logging
 import os
-import pickle
 import posixpath
 import re
 import shutil
@@ -33,6 +32,7 @@ from pylib import constants
 from pylib.base import base_test_result
 from pylib.base import output_manager
 from pylib.constants import host_paths
+from pylib.dex import dex_parser
 from pylib.instrumentation import instrumentation_parser
 from pylib.instrumentation import instrumentation_test_instance
 from pylib.local.device import local_device_environment
@@ -43,6 +43,8 @@ from pylib.utils import chrome_proxy_utils
 from pylib.utils import code_coverage_utils
 from pylib.utils import gold_utils
 from pylib.utils import instrumentation_tracing
+from pylib.utils import run_metrics
+from pylib.utils import test_list_cache
 from pylib.utils.device_dependencies import DevicePathComponentsFor
 from py_trace_event import trace_event
 from py_trace_event import trace_time
@@ -137,8 +139,6 @@ _UNIT_TEST_MAX_GROUP_SIZE = 200
 # run.
 _NON_UNIT_TEST_MAX_GROUP_SIZE = 30
 
-_PICKLE_FORMAT_VERSION = 12
-
 
 def _dict2list(d):
   if isinstance(d, dict):
@@ -150,35 +150,6 @@ def _dict2list(d):
   return d
 
 
-class _TestListPickleException(Exception):
-  pass
-
-
-def _LoadTestsFromPickle(pickle_path, test_mtime, pickle_extras):
-  if not os.path.exists(pickle_path):
-    raise _TestListPickleException('%s does not exist.' % pickle_path)
-  if os.path.getmtime(pickle_path) <= test_mtime:
-    raise _TestListPickleException('File is stale: %s' % pickle_path)
-
-  with open(pickle_path, 'rb') as f:
-    pickle_data = pickle.load(f)
-  if pickle_data['VERSION'] != _PICKLE_FORMAT_VERSION:
-    raise _TestListPickleException('PICKLE_FORMAT_VERSION has changed.')
-  if pickle_data.get('EXTRAS') != pickle_extras:
-    raise _TestListPickleException('PICKLE EXTRAS has changed.')
-  return pickle_data['TEST_METHODS']
-
-
-def _SaveTestsToPickle(pickle_path, tests, pickle_extras):
-  pickle_data = {
-      'VERSION': _PICKLE_FORMAT_VERSION,
-      'EXTRAS': pickle_extras,
-      'TEST_METHODS': tests,
-  }
-  with open(pickle_path, 'wb') as pickle_file:
-    pickle.dump(pickle_data, pickle_file)
-
-
 @contextlib.contextmanager
 def _LogTestEndpoints(device, test_name):
   device.RunShellCommand(
@@ -394,14 +365,15 @@ class LocalDeviceInstrumentationTestRun(
         @trace_event.traced
         def install_helper_internal(d, apk_path=None):
           # pylint: disable=unused-argument
-          d.Install(
-              apk,
-              modules=modules,
-              fake_modules=fake_modules,
-              permissions=permissions,
-              additional_locales=additional_locales,
-              instant_app=instant_app,
-              force_queryable=self._test_instance.IsApkForceQueryable(apk))
+          with run_metrics.Timer('install_apk'):
+            d.Install(
+                apk,
+                modules=modules,
+                fake_modules=fake_modules,
+                permissions=permissions,
+                additional_locales=additional_locales,
+                instant_app=instant_app,
+                force_queryable=self._test_instance.IsApkForceQueryable(apk))
 
         return install_helper_internal
 
@@ -410,7 +382,8 @@ class LocalDeviceInstrumentationTestRun(
         @trace_event.traced
         def install_helper_internal(d, apk_path=None):
           # pylint: disable=unused-argument
-          d.InstallApex(apex)
+          with run_metrics.Timer('install_apex'):
+            d.InstallApex(apex)
 
         return install_helper_internal
 
@@ -419,7 +392,8 @@ class LocalDeviceInstrumentationTestRun(
         @trace_event.traced
         def incremental_install_helper_internal(d, apk_path=None):
           # pylint: disable=unused-argument
-          installer.Install(d, json_path, apk=apk, permissions=permissions)
+          with run_metrics.Timer('install_apk'):
+            installer.Install(d, json_path, apk=apk, permissions=permissions)
 
         return incremental_install_helper_internal
 
@@ -770,27 +744,21 @@ class LocalDeviceInstrumentationTestRun(
     # Each test or test batch will be a single shard.
     return tests
 
-  def _GetTestsFromPickle(self, pickle_extras):
-    test_apk_path = self._test_instance.test_apk.path
-    pickle_path = '%s-testlist.pickle' % test_apk_path
-    # For incremental APKs, the code doesn't live in the apk, so instead check
-    # the timestamp of the target's .dex files.
+  def _MakeTestListCacheKey(self, extras):
+    key = test_list_cache.CacheKey('instrumentation', extras)
+    # For incremental APKs, the code doesn't live in the apk, so instead hash
+    # the target's .dex files.
     if self._test_instance.test_apk_incremental_install_json:
       with open(self._test_instance.test_apk_incremental_install_json) as f:
         data = json.load(f)
       out_dir = constants.GetOutDirectory()
-      test_mtime = max(
-          os.path.getmtime(os.path.join(out_dir, p)) for p in data['dex_files'])
+      for p in data['dex_files']:
+        key.AddFile(os.path.join(out_dir, p))
     else:
-      test_mtime = os.path.getmtime(test_apk_path)
-
-    try:
-      raw_tests = _LoadTestsFromPickle(pickle_path, test_mtime, pickle_extras)
-      logging.info('Using cached test list.')
-    except _TestListPickleException as e:
-      logging.info('Not using cached test list: %s', e)
-      raw_tests = None
-    return raw_tests, pickle_path
+      test_apk_path = self._test_instance.test_apk.path
+      key.AddZipEntryContents(test_apk_path,
+                              dex_parser.ListDexFilesInZip(test_apk_path))
+    return key
 
   #override
   def _GetTests(self):
@@ -800,10 +768,9 @@ class LocalDeviceInstrumentationTestRun(
     run_disabled = ti.GetRunDisabledFlag()
     # run_disabled effects test listing only when using AndroidJUnitRunner.
     use_androidx_runner = not use_dexdump and not ti.has_chromium_test_listener
-    pickle_extras = (use_dexdump, use_androidx_runner and run_disabled)
-    raw_tests, pickle_path = self._GetTestsFromPickle(pickle_extras)
+    cache_extras = [use_dexdump, use_androidx_runner and run_disabled]
 
-    if raw_tests is None:
+    def list_tests():
       if use_dexdump:
         # This path is hit by CTS tests.
         # Dexdump is not able to find parameterized tests, so some tests might
@@ -811,14 +778,14 @@ class LocalDeviceInstrumentationTestRun(
         # We should consider using AndroidJunitRunner's "-e annotation Foo,Bar"
         # and "-e notAnnotation Foo,Bar" to list tests when annotation filters
         # exist instead.
-        logging.info('Getting tests from dexdump (due to annotation filters)')
-        raw_tests = instrumentation_test_instance.GetTestsFromDexdump(
-            ti.test_apk.path)
-      else:
-        logging.info('Getting tests by having %s list them.',
-                     ti.junit4_runner_class)
-        raw_tests = self._GetTestsFromRunner(run_disabled=run_disabled)
-      _SaveTestsToPickle(pickle_path, raw_tests, pickle_extras)
+        logging.info('Getting tests from dex files (due to annotation filters)')
+        return instrumentation_test_instance.GetTestsFromDex(ti.test_apk.path)
+      logging.info('Getting tests by having %s list them.',
+                   ti.junit4_runner_class)
+      return self._GetTestsFromRunner(run_disabled=run_disabled)
+
+    raw_tests = self._env.test_list_cache.GetOrList(
+        lambda: self._MakeTestListCacheKey(cache_extras), list_tests)
 
     tests = ti.ProcessRawTests(raw_tests)
     tests = self._ApplyExternalSharding(tests, ti.external_shard_index,
@@ -2,6 +2,8 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import bisect
+import collections
 import fnmatch
 import hashlib
 import logging
@@ -12,6 +14,7 @@ try:
 except ImportError:
   import thread
 import threading
+import time
 
 from devil import base_error
 from devil.android import crash_handler
@@ -24,6 +27,8 @@ from pylib.base import test_collection
 from pylib.base import test_exception
 from pylib.base import test_run
 from pylib.local.device import local_device_environment
+from pylib.utils import run_metrics
+from pylib.utils import test_timing_db
 
 from lib.proto import exception_recorder
 
@@ -45,6 +50,34 @@ class TestsTerminated(Exception):
   pass
 
 
+class _ResultNameIndex:
+  """Finds the result names matching a wildcard test name.
+
+  Names are kept sorted, so a pattern only needs to be checked against the
+  names that share its literal prefix.
+  """
+
+  def __init__(self, names):
+    self._names = sorted(names)
+
+  def Match(self, pattern):
+    """Returns the names that match |pattern|, like fnmatch.filter()."""
+    prefix_len = len(pattern)
+    for c in '*?[':
+      i = pattern.find(c)
+      if i != -1:
+        prefix_len = min(prefix_len, i)
+    prefix = pattern[:prefix_len]
+    start = bisect.bisect_left(self._names, prefix)
+    end = start
+    while end < len(self._names) and self._names[end].startswith(prefix):
+      end += 1
+    candidates = self._names[start:end]
+    if pattern == prefix + '*':
+      return candidates
+    return fnmatch.filter(candidates, pattern)
+
+
 class LocalDeviceTestRun(test_run.TestRun):
 
   def __init__(self, env, test_instance):
@@ -55,9 +88,12 @@ class LocalDeviceTestRun(test_run.TestRun):
 
   #override
   def RunTests(self, results, raw_logs_fh=None):
-    tests = self._GetTests()
+    with run_metrics.Timer('list_tests'):
+      tests = self._GetTests()
 
     exit_now = threading.Event()
+    # Time each device spent running tests during the current try.
+    device_busy_times = collections.defaultdict(float)
 
     @local_device_environment.handle_shard_failures
     def run_tests_on_device(dev, tests, results):
@@ -74,6 +110,7 @@ class LocalDeviceTestRun(test_run.TestRun):
         if exit_now.isSet():
           thread.exit()
 
+        test_start_time = time.time()
         result = None
         rerun = None
         try:
@@ -142,6 +179,9 @@ class LocalDeviceTestRun(test_run.TestRun):
               str(dev), consecutive_device_errors)
 
         finally:
+          test_duration = time.time() - test_start_time
+          device_busy_times[str(dev)] += test_duration
+          run_metrics.RecordDuration('run_tests/test', test_duration)
           if isinstance(tests, test_collection.TestCollection):
             if rerun:
               tests.add(rerun)
@@ -194,12 +234,16 @@ class LocalDeviceTestRun(test_run.TestRun):
           # try_results.AddResult() as they are run.
           results.append(try_results)
 
+          device_busy_times = collections.defaultdict(float)
+          try_start_time = time.time()
           try:
             if self._ShouldShardTestsForDevices():
-              tc = test_collection.TestCollection(
-                  self._CreateShardsForDevices(grouped_tests))
+              tc = self._CreateTestCollection(grouped_tests)
               self._env.parallel_devices.pMap(
                   run_tests_on_device, tc, try_results).pGet(None)
+              if isinstance(tc, test_collection.WorkStealingTestCollection):
+                logging.info('Work stealing: %d chunks, %d stolen.',
+                             tc.num_chunks, tc.num_steals)
             else:
               self._env.parallel_devices.pMap(run_tests_on_device,
                                               grouped_tests,
@@ -213,17 +257,32 @@ class LocalDeviceTestRun(test_run.TestRun):
                       log=_SIGTERM_TEST_LOG))
             raise
 
+          if self._env.test_timing_db:
+            self._env.test_timing_db.AddResults(try_results)
+          try_duration = time.time() - try_start_time
+          self._LogDeviceUtilization(device_busy_times, try_duration)
+          run_metrics.RecordDuration('run_tests/try', try_duration)
+          run_metrics.Increment('run_tests/tries')
           self._env.IncrementCurrentTry()
           tests = self._GetTestsToRetry(tests, try_results)
 
           logging.info('FINISHED TRY #%d/%d', tries + 1, self._env.max_tries)
           if tests:
             logging.info('%d failed tests remain.', len(tests))
+            if self._env.current_try < self._env.max_tries:
+              run_metrics.Increment('run_tests/retried_tests', len(tests))
           else:
             logging.info('All tests completed.')
     except TestsTerminated:
       pass
 
+  def _LogDeviceUtilization(self, device_busy_times, try_duration):
+    logging.info('Device utilization (busy / idle):')
+    for dev in self._env.devices:
+      busy = min(device_busy_times.get(str(dev), 0), try_duration)
+      logging.info('  %s: %.1fs / %.1fs', str(dev), busy, try_duration - busy)
+      run_metrics.RecordDuration('run_tests/shard', busy)
+
   def _GetTestsToRetry(self, tests, try_results):
 
     def is_failure_result(test_result):
@@ -236,6 +295,7 @@ class LocalDeviceTestRun(test_run.TestRun):
               base_test_result.ResultType.SKIP))
 
     all_test_results = {r.GetName(): r for r in try_results.GetAll()}
+    result_index = _ResultNameIndex(all_test_results)
 
     tests_and_names = ((t, self._GetUniqueTestName(t)) for t in tests)
 
@@ -243,7 +303,7 @@ class LocalDeviceTestRun(test_run.TestRun):
     for test, name in tests_and_names:
       if name.endswith('*'):
         tests_and_results[name] = (test, [
-            r for n, r in all_test_results.items() if fnmatch.fnmatch(n, name)
+            all_test_results[n] for n in result_index.Match(name)
         ])
       else:
         tests_and_results[name] = (test, all_test_results.get(name))
@@ -274,9 +334,13 @@ class LocalDeviceTestRun(test_run.TestRun):
     # unit tests or batched tests.
     grouped_tests = self._GroupTests(tests)
 
-    # Partition grouped tests approximately evenly across shards.
-    partitioned_tests = self._PartitionTests(grouped_tests, total_shards,
-                                             float('inf'))
+    # Partition grouped tests approximately evenly across shards. Each shard
+    # computes the partitions on its own, so they must not depend on the test
+    # timing db, which shards update when they finish.
+    partitioned_tests = self._PartitionTests(grouped_tests,
+                                             total_shards,
+                                             float('inf'),
+                                             use_timing_db=False)
     if len(partitioned_tests) <= shard_index:
       return []
     for t in partitioned_tests[shard_index]:
@@ -303,56 +367,93 @@ class LocalDeviceTestRun(test_run.TestRun):
   # keep test order relatively stable to minimize flakes, so when tests are
   # grouped (eg. batched tests), we cannot perfectly fill all paritions as that
   # would require breaking up groups.
-  def _PartitionTests(self, tests, num_desired_partitions, max_partition_size):
-    # pylint: disable=no-self-use
-    partitions = []
-
-
-    num_not_yet_allocated = sum(
-        [len(test) - 1 for test in tests if self._CountTestsIndividually(test)])
-    num_not_yet_allocated += len(tests)
-
-    # Fast linear partition approximation capped by max_partition_size. We
-    # cannot round-robin or otherwise re-order tests dynamically because we want
-    # test order to remain stable.
-    partition_size = min(num_not_yet_allocated // num_desired_partitions,
-                         max_partition_size)
-    partitions.append([])
-    last_partition_size = 0
-    for test in tests:
-      test_count = len(test) if self._CountTestsIndividually(test) else 1
-      # Make a new shard whenever we would overfill the previous one. However,
-      # if the size of the test group is larger than the max partition size on
-      # its own, just put the group in its own shard instead of splitting up the
-      # group.
-      # TODO(crbug.com/40200835): Add logic to support PRE_ test recognition but
-      # it may hurt performance in most scenarios. Currently all PRE_ tests are
-      # partitioned into the last shard. Unless the number of PRE_ tests are
-      # larger than the partition size, the PRE_ test may get assigned into a
-      # different shard and cause test failure.
-      if (last_partition_size + test_count > partition_size
-          and last_partition_size > 0):
-        num_desired_partitions -= 1
-        if num_desired_partitions <= 0:
-          # Too many tests for number of partitions, just fill all partitions
-          # beyond num_desired_partitions.
-          partition_size = max_partition_size
-        else:
-          # Re-balance remaining partitions.
-          partition_size = min(num_not_yet_allocated // num_desired_partitions,
-                               max_partition_size)
-        partitions.append([])
-        partitions[-1].append(test)
-        last_partition_size = test_count
-      else:
-        partitions[-1].append(test)
-        last_partition_size += test_count
+  #
+  # When |use_timing_db| is set and the test timing db knows the duration of
+  # some of the tests, partitions are balanced by expected duration instead of
+  # by test count. Tests keep their relative order within each partition either
+  # way.
+  def _PartitionTests(self,
+                      tests,
+                      num_desired_partitions,
+                      max_partition_size,
+                      use_timing_db=True):
+    units = self._GetPartitionUnits(tests)
+    counts = [
+        sum(
+            len(test) if self._CountTestsIndividually(test) else 1
+            for test in unit) for unit in units
+    ]
+    durations = self._GetExpectedDurations(units) if use_timing_db else None
+    if durations:
+      partition_indices = test_timing_db.PartitionByDuration(
+          durations, counts, num_desired_partitions, max_partition_size)
+      logging.info(
+          'Partitioned by duration. Longest partition is expected to take '
+          '%.1fs.', test_timing_db.GetMakespan(partition_indices, durations) /
+          1000.0)
+    else:
+      partition_indices = test_timing_db.PartitionByCount(
+          counts, num_desired_partitions, max_partition_size)
+    return [[test for i in indices for test in units[i]]
+            for indices in partition_indices]
+
+  def _GetPartitionUnits(self, tests):
+    """Splits |tests| into runs of tests that must stay in the same partition.
 
-      num_not_yet_allocated -= test_count
+    Args:
+      tests: List of tests or test groups.
 
-    if not partitions[-1]:
-      partitions.pop()
-    return partitions
+    Returns:
+      A list of lists of elements of |tests|, in their original order.
+    """
+    # pylint: disable=no-self-use
+    return [[test] for test in tests]
+
+  def _GetExpectedDurations(self, units):
+    """Estimates how long each partition unit takes to run.
+
+    Tests missing from the timing db are assumed to take the median duration
+    of those that are known, which makes the estimate fall back to balancing
+    by test count.
+
+    Returns:
+      A list with the expected duration in ms of each unit, or None if the
+      timing db knows none of the tests.
+    """
+    timing_db = self._env.test_timing_db
+    if not timing_db:
+      return None
+
+    known = []
+    unit_durations = []
+    for unit in units:
+      test_durations = []
+      for test in unit:
+        group = test if isinstance(test, list) else [test]
+        names = [self._GetUniqueTestName(t) for t in group]
+        test_durations.append([timing_db.GetDuration(n) for n in names])
+        known.extend(d for d in test_durations[-1] if d is not None)
+      unit_durations.append(test_durations)
+    if not known:
+      return None
+
+    default = sorted(known)[len(known) // 2]
+    durations = []
+    for unit, test_durations in zip(units, unit_durations):
+      total = 0
+      for test, group_durations in zip(unit, test_durations):
+        known_durations = [d for d in group_durations if d is not None]
+        if self._CountTestsIndividually(test) or not isinstance(test, list):
+          total += sum(known_durations)
+          total += default * (len(group_durations) - len(known_durations))
+        else:
+          # Groups that are counted as a single test count as a single unknown
+          # test when none of their members are known.
+          total += sum(known_durations) if known_durations else default
+      durations.append(total)
+    logging.info('Test timing db knows %d of %d partitioned tests.', len(known),
+                 sum(len(d) for t in unit_durations for d in t))
+    return durations
 
   def _CountTestsIndividually(self, test):
     # pylint: disable=no-self-use
@@ -367,6 +468,23 @@ class LocalDeviceTestRun(test_run.TestRun):
   def _CreateShardsForDevices(self, tests):
     raise NotImplementedError
 
+  def _CreateTestCollection(self, tests):
+    shards = self._CreateShardsForDevices(tests)
+    if self._env.work_stealing:
+      collection = self._CreateWorkStealingCollection(shards)
+      if collection:
+        return collection
+    return test_collection.TestCollection(shards)
+
+  def _CreateWorkStealingCollection(self, shards):
+    """Returns a WorkStealingTestCollection for |shards|.
+
+    Returns None when shards are already the smallest units that may run on
+    their own, in which case a plain TestCollection balances them just as well.
+    """
+    # pylint: disable=no-self-use,unused-argument
+    return None
+
   def _GetUniqueTestName(self, test):
     # pylint: disable=no-self-use
     return test
@@ -377,7 +495,8 @@ class LocalDeviceTestRun(test_run.TestRun):
 
   #override
   def GetTestsForListing(self):
-    ret = self._GetTests()
+    with run_metrics.Timer('list_tests'):
+      ret = self._GetTests()
     ret = FlattenTestList(ret)
     ret.sort()
     return ret
@@ -6,13 +6,20 @@
 # pylint: disable=protected-access
 
 
+import fnmatch
+import os
+import tempfile
+import time
 import unittest
 
 from pylib.base import base_test_result
 from pylib.local.device import local_device_test_run
+from pylib.utils import test_timing_db
 
 import mock  # pylint: disable=import-error
 
+_RUN_BENCHMARKS = int(os.environ.get('RUN_BENCHMARKS', 0))
+
 
 class SubstituteDeviceRootTest(unittest.TestCase):
 
@@ -40,6 +47,16 @@ class SubstituteDeviceRootTest(unittest.TestCase):
             ['/', 'another', 'fake', 'device', 'path'], '/fake/device/root'))
 
 
+class ResultNameIndexTest(unittest.TestCase):
+
+  def testMatch(self):
+    names = ['Foo.a', 'Foo.b', 'FooBar.a', 'Bar.a', 'Foo']
+    index = local_device_test_run._ResultNameIndex(names)
+    for pattern in ('Foo.*', 'Foo*', '*.a', 'Foo.?', 'F[o]o.*', 'Baz.*', '*'):
+      self.assertEqual(sorted(index.Match(pattern)),
+                       sorted(fnmatch.filter(names, pattern)), pattern)
+
+
 class TestLocalDeviceTestRun(local_device_test_run.LocalDeviceTestRun):
 
   # pylint: disable=abstract-method
@@ -169,6 +186,76 @@ class LocalDeviceTestRunTest(unittest.TestCase):
     self.assertIsInstance(tests_to_retry[0], dict)
     self.assertEqual(tests[1], tests_to_retry[0])
 
+  def testPartitionTests_byCount(self):
+    test_run = TestLocalDeviceTestRun()
+    test_run._env.test_timing_db = None
+    self.assertEqual(test_run._PartitionTests(['a', 'b', 'c', 'd'], 2,
+                                              float('inf')),
+                     [['a', 'b'], ['c', 'd']])
+
+  def testPartitionTests_byDuration(self):
+    timing_db = mock.MagicMock()
+    timing_db.GetDuration.side_effect = {'a': 1000, 'b': 10, 'c': 10}.get
+    test_run = TestLocalDeviceTestRun()
+    test_run._env.test_timing_db = timing_db
+    # 'd' is unknown, so is expected to take the median duration.
+    self.assertEqual(test_run._PartitionTests(['a', 'b', 'c', 'd'], 2,
+                                              float('inf')),
+                     [['a'], ['b', 'c', 'd']])
+
+  def testApplyExternalSharding_timingDbChangesBetweenShards(self):
+    tests = ['Test%d' % i for i in range(20)]
+    num_shards = 4
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      db_path = os.path.join(tmp_dir, 'durations.json')
+      sharded_tests = []
+      for shard_index in range(num_shards):
+        # Each shard loads the db when it starts, and saves it when it is done.
+        test_run = TestLocalDeviceTestRun()
+        test_run._env.test_timing_db = test_timing_db.TestTimingDb(db_path)
+        shard = test_run._ApplyExternalSharding(tests, shard_index, num_shards)
+        sharded_tests.extend(shard)
+        results = base_test_result.TestRunResults()
+        results.AddResults(
+            base_test_result.BaseTestResult(
+                t, base_test_result.ResultType.PASS, duration=1000 * (i + 1))
+            for i, t in enumerate(shard))
+        test_run._env.test_timing_db.AddResults(results)
+        test_run._env.test_timing_db.Save()
+    self.assertEqual(sorted(tests), sorted(sharded_tests))
+
+  @unittest.skipUnless(_RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=1 to run.')
+  def testBenchmarkGetTestsToRetry_wildcards(self):
+    num_suites = 500
+    results = [
+        base_test_result.BaseTestResult(
+            'Suite%d.Test%d' % (i % num_suites, i),
+            base_test_result.ResultType.FAIL
+            if i % 999 == 0 else base_test_result.ResultType.PASS)
+        for i in range(50000)
+    ]
+    tests = ['Suite%d.*' % i for i in range(num_suites)]
+    try_results = base_test_result.TestRunResults()
+    try_results.AddResults(results)
+
+    test_run = TestLocalDeviceTestRun()
+    start = time.time()
+    tests_to_retry = test_run._GetTestsToRetry(tests, try_results)
+    indexed_time = time.time() - start
+
+    start = time.time()
+    all_names = [r.GetName() for r in try_results.GetAll()]
+    for t in tests:
+      fnmatch.filter(all_names, t)
+    linear_time = time.time() - start
+
+    self.assertEqual(
+        len({'Suite%d.*' % (i % num_suites)
+             for i in range(0, 50000, 999)}), len(tests_to_retry))
+    print('\n50k results, %d wildcard tests: indexed=%.3fs, '
+          'fnmatch over all results=%.3fs' %
+          (num_suites, indexed_time, linear_time))
+
 
 if __name__ == '__main__':
   unittest.main(verbosity=2)
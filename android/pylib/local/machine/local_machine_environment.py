@@ -2,13 +2,35 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import os
+
+from pylib import constants
 from pylib.base import environment
+from pylib.utils import test_list_cache
+from pylib.utils import test_timing_db
 
 
 class LocalMachineEnvironment(environment.Environment):
 
-  def __init__(self, _args, output_manager, _error_func):
+  def __init__(self, args, output_manager, _error_func):
     super().__init__(output_manager)
+    self._test_list_cache_dir = getattr(args, 'test_list_cache_dir', None)
+    self._test_list_cache = None
+    self._test_timing_db = None
+    if getattr(args, 'test_timing_db', None):
+      self._test_timing_db = test_timing_db.TestTimingDb(args.test_timing_db)
+
+  @property
+  def test_timing_db(self):
+    return self._test_timing_db
+
+  @property
+  def test_list_cache(self):
+    if not self._test_list_cache:
+      self._test_list_cache = test_list_cache.TestListCache(
+          self._test_list_cache_dir
+          or os.path.join(constants.GetOutDirectory(), 'test_list_cache'))
+    return self._test_list_cache
 
   #override
   def SetUp(self):
@@ -16,4 +38,7 @@ class LocalMachineEnvironment(environment.Environment):
 
   #override
   def TearDown(self):
-    pass
+    if self._test_timing_db:
+      self._test_timing_db.Save()
+    if self._test_list_cache:
+      self._test_list_cache.LogStats()
@@ -22,6 +22,7 @@ from pylib.base import test_exception
 from pylib.base import test_run
 from pylib.local.machine import local_machine_junit_test_run as junitrun
 from pylib.symbols import stack_symbolizer
+from pylib.utils import run_metrics
 
 
 _FAILURE_TYPES = (
@@ -72,7 +73,8 @@ class LocalMachineHostsideTestRun(test_run.TestRun):
           requested_devices=None,
           denylist_file=None)[0]
       for apk in self._test_instance.additional_apks:
-        self.device.Install(apk)
+        with run_metrics.Timer('install_apk'):
+          self.device.Install(apk)
       self.webview_context = webview_app.UseWebViewProvider(
           self.device,
           self._test_instance.use_webview_provider)
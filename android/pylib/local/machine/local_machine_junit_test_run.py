@@ -2,7 +2,9 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
 import dataclasses
+import heapq
 import json
 import logging
 import multiprocessing
@@ -24,6 +26,9 @@ from pylib.base import base_test_result
 from pylib.base import test_run
 from pylib.constants import host_paths
 from pylib.results import json_results
+from pylib.utils import run_metrics
+from pylib.utils import test_list_cache
+from pylib.utils import test_timing_db
 
 # Chosen after timing test runs of chrome_junit_tests with 7,16,32,
 # and 64 workers in threadpool and different classes_per_job.
@@ -49,6 +54,8 @@ _TEST_FAILED_RE = re.compile(r'.*\[\s+(?:FAILED|CRASHED|TIMEOUT)\s+\]')
 class _TestGroup:
   config: str
   methods_by_class: dict
+  # Expected duration in ms, when grouped by duration.
+  expected_duration: float = dataclasses.field(default=None, compare=False)
 
 
 @dataclasses.dataclass
@@ -155,35 +162,57 @@ class LocalMachineJunitTestRun(test_run.TestRun):
     return os.path.join(constants.GetOutDirectory(), 'bin', 'helper',
                         self._test_instance.suite)
 
+  def _MakeTestListCacheKey(self, shadows_allowlist):
+    key = test_list_cache.CacheKey(
+        'junit', [self._GetFilterArgs(), bool(shadows_allowlist)])
+    key.AddFile(self._wrapper_path)
+    key.AddJavaBinaryClasspath(self._wrapper_path)
+    if shadows_allowlist:
+      key.AddFile(shadows_allowlist)
+    return key
+
   def _QueryTestJsonConfig(self,
                            temp_dir,
                            allow_debugging=True,
                            enable_shadow_allowlist=False):
-    json_config_path = os.path.join(temp_dir, 'main_test_config.json')
-    cmd = [self._wrapper_path]
-    # Allow debugging of test listing when run as:
-    # "--wait-for-java-debugger --list-tests"
-    jvm_args = self._CreateJvmArgsList(for_listing=True,
-                                       allow_debugging=allow_debugging)
-    if jvm_args:
-      cmd += ['--jvm-args', '"%s"' % ' '.join(jvm_args)]
-    cmd += ['--classpath', self._CreatePropertiesJar(temp_dir)]
-    cmd += ['--list-tests', '--json-config', json_config_path]
-    if enable_shadow_allowlist and self._test_instance.shadows_allowlist:
-      cmd += ['--shadows-allowlist', self._test_instance.shadows_allowlist]
-    cmd += self._GetFilterArgs()
-    subprocess.run(cmd, check=True)
-    with open(json_config_path) as f:
-      return json.load(f)
-
-  def _MakeJob(self, shard_id, temp_dir, test_group, properties_jar_path,
+    shadows_allowlist = None
+    if enable_shadow_allowlist:
+      shadows_allowlist = self._test_instance.shadows_allowlist
+
+    def list_tests():
+      json_config_path = os.path.join(temp_dir, 'main_test_config.json')
+      cmd = [self._wrapper_path]
+      # Allow debugging of test listing when run as:
+      # "--wait-for-java-debugger --list-tests"
+      jvm_args = self._CreateJvmArgsList(for_listing=True,
+                                         allow_debugging=allow_debugging)
+      if jvm_args:
+        cmd += ['--jvm-args', '"%s"' % ' '.join(jvm_args)]
+      cmd += ['--classpath', self._CreatePropertiesJar(temp_dir)]
+      cmd += ['--list-tests', '--json-config', json_config_path]
+      if shadows_allowlist:
+        cmd += ['--shadows-allowlist', shadows_allowlist]
+      cmd += self._GetFilterArgs()
+      subprocess.run(cmd, check=True)
+      with open(json_config_path) as f:
+        return json.load(f)
+
+    if self._test_instance.debug_socket and allow_debugging:
+      # Listing is being debugged, so it has to actually happen.
+      return list_tests()
+    return self._env.test_list_cache.GetOrList(
+        lambda: self._MakeTestListCacheKey(shadows_allowlist), list_tests)
+
+  def _MakeJob(self, shard_id, temp_dir, test_groups, properties_jar_path,
                json_config):
     json_results_path = os.path.join(temp_dir, f'results{shard_id}.json')
     job_json_config_path = os.path.join(temp_dir, f'config{shard_id}.json')
     job_json_config = json_config.copy()
-    job_json_config['configs'] = {
-        test_group.config: test_group.methods_by_class
-    }
+    # The runner runs every config listed, so several groups can share a JVM.
+    job_json_config['configs'] = {}
+    for test_group in test_groups:
+      job_json_config['configs'].setdefault(test_group.config, {}).update(
+          test_group.methods_by_class)
     with open(job_json_config_path, 'w') as f:
       json.dump(job_json_config, f)
 
@@ -199,8 +228,9 @@ class LocalMachineJunitTestRun(test_run.TestRun):
       # 20 seconds for process init,
       # 5 seconds per class,
       # 3 seconds per method.
-      num_classes = len(test_group.methods_by_class)
-      num_tests = sum(len(x) for x in test_group.methods_by_class.values())
+      num_classes = sum(len(g.methods_by_class) for g in test_groups)
+      num_tests = sum(
+          len(x) for g in test_groups for x in g.methods_by_class.values())
       timeout = 20 + 5 * num_classes + num_tests * 3
     return _Job(shard_id=shard_id,
                 cmd=cmd,
@@ -232,13 +262,21 @@ class LocalMachineJunitTestRun(test_run.TestRun):
       # TODO(crbug.com/40878339): This step can take 3-4 seconds for
       # chrome_junit_tests.
       try:
-        json_config = self._QueryTestJsonConfig(temp_dir,
-                                                allow_debugging=False,
-                                                enable_shadow_allowlist=True)
+        with run_metrics.Timer('list_tests'):
+          json_config = self._QueryTestJsonConfig(
+              temp_dir, allow_debugging=False, enable_shadow_allowlist=True)
       except subprocess.CalledProcessError:
         results.append(_MakeUnknownFailureResult('Filter matched no tests'))
         return
-    test_groups = GroupTests(json_config, _MAX_TESTS_PER_JOB)
+    test_groups = None
+    timing_db = self._env.test_timing_db
+    if timing_db:
+      num_classes = sum(len(c) for c in json_config['configs'].values())
+      test_groups = GroupTestsByDuration(json_config, _MAX_TESTS_PER_JOB,
+                                         self._ChooseNumWorkers(num_classes),
+                                         timing_db)
+    if not test_groups:
+      test_groups = GroupTests(json_config, _MAX_TESTS_PER_JOB)
 
     shard_list = list(range(len(test_groups)))
     shard_filter = self._test_instance.shard_filter
@@ -258,12 +296,25 @@ class LocalMachineJunitTestRun(test_run.TestRun):
           'Running tests with %d shard(s) using %s concurrent process(es).',
           len(shard_list), num_workers)
 
+    groups_by_job = [[test_groups[i]] for i in shard_list]
+    job_ids = shard_list
+    reuse_jvms = (self._test_instance.reuse_jvms
+                  and len(shard_list) > num_workers)
+    if reuse_jvms:
+      groups_by_job = AssignGroupsToWorkers(
+          [test_groups[i] for i in shard_list], num_workers)
+      job_ids = list(range(len(groups_by_job)))
+      logging.warning('Running %d shard(s) in %d JVM(s).', len(shard_list),
+                      len(groups_by_job))
+
     properties_jar_path = self._CreatePropertiesJar(temp_dir)
     jobs = [
-        self._MakeJob(i, temp_dir, test_groups[i], properties_jar_path,
-                      json_config) for i in shard_list
+        self._MakeJob(job_id, temp_dir, groups, properties_jar_path,
+                      json_config)
+        for job_id, groups in zip(job_ids, groups_by_job)
     ]
 
+    start_time = time.time()
     show_logcat = logging.getLogger().isEnabledFor(logging.INFO)
     num_omitted_lines = 0
     failed_test_logs = {}
@@ -291,6 +342,8 @@ class LocalMachineJunitTestRun(test_run.TestRun):
       else:
         log_lines.append(line)
 
+    elapsed_time = time.time() - start_time
+    run_metrics.RecordDuration('run_tests/try', elapsed_time)
     if num_omitted_lines > 0:
       logging.critical('%d log lines omitted.', num_omitted_lines)
     sys.stdout.flush()
@@ -326,15 +379,25 @@ class LocalMachineJunitTestRun(test_run.TestRun):
         print(json.dumps(job.json_config, indent=2))
         print()
 
-      print(
-          f'To re-run the {len(failed_jobs)} failed shard(s), use: '
-          f'--shards {num_workers} --shard-filter',
-          ','.join(str(j.shard_id) for j in failed_jobs))
+      # Duration-based groups change as timings are recorded, so shard
+      # indices are only meaningful for the next run without a timing db.
+      # Jobs that ran several shards in one JVM are not shards.
+      if not timing_db and not reuse_jvms:
+        print(
+            f'To re-run the {len(failed_jobs)} failed shard(s), use: '
+            f'--shards {num_workers} --shard-filter',
+            ','.join(str(j.shard_id) for j in failed_jobs))
 
     test_run_results = base_test_result.TestRunResults()
     test_run_results.AddResults(results_list)
     results.append(test_run_results)
 
+    if test_groups[0].expected_duration is not None:
+      _PrintMakespanReport(groups_by_job, jobs, results_list, num_workers,
+                           elapsed_time)
+    if timing_db:
+      timing_db.AddResults(test_run_results)
+
   # override
   def TearDown(self):
     pass
@@ -373,6 +436,125 @@ def GroupTests(json_config, max_per_job):
   return ret
 
 
+def GroupTestsByDuration(json_config, max_per_job, num_workers, timing_db):
+  """Groups tests so that shards take similar amounts of time.
+
+  Classes are packed longest first into about |num_workers| groups, using
+  durations recorded in |timing_db|. Tests without a recorded
+  duration are assumed to take the median duration of those with one.
+
+  Args:
+    json_config: The result from _QueryTestJsonConfig().
+    max_per_job: Maximum number of tests in a group, unless a single class has
+      more.
+    num_workers: Number of shards that will run concurrently.
+    timing_db: A test_timing_db.TestTimingDb.
+
+  Return:
+    Returns a list of _TestGroup, longest first, or None if |timing_db| has no
+    durations for any of the tests.
+  """
+  units = []
+  known_durations = []
+  for config, methods_by_class in json_config['configs'].items():
+    for class_name, methods in methods_by_class.items():
+      durations = [
+          timing_db.GetDuration(f'{class_name}#{m}') for m in methods
+      ]
+      known_durations.extend(d for d in durations if d is not None)
+      units.append((config, class_name, methods, durations))
+  if not known_durations:
+    return None
+  default_duration = sorted(known_durations)[len(known_durations) // 2]
+
+  units_by_config = collections.defaultdict(list)
+  for config, class_name, methods, durations in units:
+    duration = sum(default_duration if d is None else d for d in durations)
+    units_by_config[config].append((class_name, methods, duration))
+  total_duration = sum(u[2] for us in units_by_config.values() for u in us)
+
+  ret = []
+  for config, config_units in units_by_config.items():
+    # Classes from different configs cannot share a group, so give each config
+    # a share of the workers proportional to its duration.
+    config_duration = sum(u[2] for u in config_units)
+    num_groups = max(
+        1, round(num_workers * config_duration / (total_duration or 1)))
+    durations = [u[2] for u in config_units]
+    partitions = test_timing_db.PartitionByDuration(
+        durations, [len(u[1]) for u in config_units], num_groups, max_per_job)
+    for partition in partitions:
+      methods_by_class = {config_units[i][0]: config_units[i][1]
+                          for i in partition}
+      ret.append(
+          _TestGroup(config,
+                     methods_by_class,
+                     expected_duration=sum(durations[i] for i in partition)))
+
+  # Run the longest groups first so that workers finish at similar times.
+  ret.sort(key=lambda g: -g.expected_duration)
+  return ret
+
+
+def AssignGroupsToWorkers(test_groups, num_workers):
+  """Splits |test_groups| into |num_workers| lists, each run by one JVM.
+
+  Groups are balanced by expected duration when known, and by test count
+  otherwise.
+
+  Return:
+    Returns a list of lists of _TestGroup, longest first.
+  """
+  if all(g.expected_duration is not None for g in test_groups):
+    durations = [g.expected_duration for g in test_groups]
+  else:
+    durations = [
+        sum(len(m) for m in g.methods_by_class.values()) for g in test_groups
+    ]
+  partitions = test_timing_db.PartitionByDuration(durations,
+                                                  [1] * len(test_groups),
+                                                  num_workers, float('inf'))
+  partitions.sort(key=lambda p: -sum(durations[i] for i in p))
+  return [[test_groups[i] for i in p] for p in partitions]
+
+
+def PredictMakespan(durations, num_workers):
+  """Returns when the last of |durations| would finish.
+
+  Models RunCommandsAndSerializeOutput(): the first job runs alongside the
+  worker pool, and the rest start in order as workers become free.
+  """
+  if not durations:
+    return 0
+  workers = [0] * min(num_workers, len(durations) - 1)
+  heapq.heapify(workers)
+  for duration in durations[1:]:
+    heapq.heappush(workers, heapq.heappop(workers) + duration)
+  return max([durations[0]] + workers)
+
+
+def _PrintMakespanReport(groups_by_job, jobs, results_list, num_workers,
+                         elapsed_time):
+  durations_by_class = collections.Counter()
+  for r in results_list:
+    if r.GetDuration():
+      durations_by_class[r.GetName().split('#')[0]] += r.GetDuration()
+
+  print()
+  print('Shard durations, expected vs actual (sum of test durations):')
+  expected_durations = []
+  for groups, job in zip(groups_by_job, jobs):
+    expected = sum(g.expected_duration for g in groups)
+    actual = sum(durations_by_class[c] for g in groups
+                 for c in g.methods_by_class)
+    expected_durations.append(expected)
+    print(f'  Shard {job.shard_id:2}: {expected / 1000:8.1f}s '
+          f'{actual / 1000:8.1f}s')
+  predicted = PredictMakespan(expected_durations, num_workers)
+  print(f'Predicted makespan: {predicted / 1000:.1f}s, '
+        f'actual: {elapsed_time:.1f}s (including JVM startup).')
+
+
 def _MakeUnknownFailureResult(message):
   results_list = [
       base_test_result.BaseTestResult(message,
@@ -6,9 +6,24 @@
 # pylint: disable=protected-access
 
 
+import os
+import tempfile
 import unittest
 
+from pylib.base import base_test_result
 from pylib.local.machine import local_machine_junit_test_run
+from pylib.utils import test_timing_db
+
+
+def _MakeTimingDb(tmp_dir, durations):
+  timing_db = test_timing_db.TestTimingDb(os.path.join(tmp_dir, 'db.json'))
+  results = base_test_result.TestRunResults()
+  results.AddResults(
+      base_test_result.BaseTestResult(
+          name, base_test_result.ResultType.PASS, duration=duration)
+      for name, duration in durations.items())
+  timing_db.AddResults(results)
+  return timing_db
 
 
 class LocalMachineJunitTestRunTests(unittest.TestCase):
@@ -44,6 +59,79 @@ class LocalMachineJunitTestRunTests(unittest.TestCase):
     ]
     self.assertEqual(expected, actual)
 
+  def testGroupTestsByDuration(self):
+    json_config = {
+        'configs': {
+            'config1': {
+                'Slow': ['m1'],
+                'Medium': ['m1', 'm2'],
+                'Fast1': ['m1'],
+                'Fast2': ['m1', 'm2'],
+                'Unknown': ['m1'],
+            },
+        }
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      timing_db = _MakeTimingDb(
+          tmp_dir, {
+              'Slow#m1': 10000,
+              'Medium#m1': 3000,
+              'Medium#m2': 3000,
+              'Fast1#m1': 100,
+              'Fast2#m1': 100,
+              'Fast2#m2': 100,
+          })
+      actual = local_machine_junit_test_run.GroupTestsByDuration(
+          json_config, 10, 2, timing_db)
+    self.assertEqual([
+        local_machine_junit_test_run._TestGroup(
+            config='config1', methods_by_class={'Slow': ['m1']}),
+        local_machine_junit_test_run._TestGroup(config='config1',
+                                                methods_by_class={
+                                                    'Medium': ['m1', 'm2'],
+                                                    'Fast1': ['m1'],
+                                                    'Fast2': ['m1', 'm2'],
+                                                    'Unknown': ['m1'],
+                                                }),
+    ], actual)
+    # Unknown is assumed to take the median duration.
+    self.assertEqual([10000, 9300], [g.expected_duration for g in actual])
+
+  def testGroupTestsByDuration_noTimings(self):
+    json_config = {'configs': {'config1': {'class1': ['m1']}}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      self.assertIsNone(
+          local_machine_junit_test_run.GroupTestsByDuration(
+              json_config, 10, 2, _MakeTimingDb(tmp_dir, {})))
+
+  def testAssignGroupsToWorkers(self):
+    TestGroup = local_machine_junit_test_run._TestGroup
+    groups = [
+        TestGroup('c1', {'A': ['m1', 'm2', 'm3']}),
+        TestGroup('c1', {'B': ['m1']}),
+        TestGroup('c2', {'A': ['m1', 'm2']}),
+        TestGroup('c1', {'C': ['m1']}),
+    ]
+    self.assertEqual([[groups[0], groups[3]], [groups[1], groups[2]]],
+                     local_machine_junit_test_run.AssignGroupsToWorkers(
+                         groups, 2))
+
+    # Expected durations are used when known.
+    for g, d in zip(groups, [1, 10, 1, 1]):
+      g.expected_duration = d
+    self.assertEqual([[groups[1]], [groups[0], groups[2], groups[3]]],
+                     local_machine_junit_test_run.AssignGroupsToWorkers(
+                         groups, 2))
+
+  def testPredictMakespan(self):
+    # The first job runs alongside the pool.
+    self.assertEqual(
+        10, local_machine_junit_test_run.PredictMakespan([10, 5, 5], 1))
+    self.assertEqual(
+        11, local_machine_junit_test_run.PredictMakespan([10, 5, 5, 1], 1))
+    self.assertEqual(
+        6, local_machine_junit_test_run.PredictMakespan([6, 3, 3, 3], 2))
+    self.assertEqual(0, local_machine_junit_test_run.PredictMakespan([], 2))
 
 
 if __name__ == '__main__':
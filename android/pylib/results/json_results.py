@@ -7,10 +7,23 @@ import collections
 import itertools
 import json
 import logging
+import threading
 import time
 
 from pylib.base import base_test_result
 
+
+def _ResultToDict(r):
+  return {
+      'status': r.GetType(),
+      'elapsed_time_ms': r.GetDuration(),
+      'output_snippet': r.GetLog(),
+      'losless_snippet': True,
+      'output_snippet_base64': '',
+      'links': r.GetLinks(),
+  }
+
+
 def GenerateResultsDict(test_run_results, global_tags=None):
   """Create a results dict from |test_run_results| suitable for writing to JSON.
   Args:
@@ -90,15 +103,7 @@ def GenerateResultsDict(test_run_results, global_tags=None):
       test_run_links.update(test_run_result.GetLinks())
 
     for r in results_iterable:
-      result_dict = {
-          'status': r.GetType(),
-          'elapsed_time_ms': r.GetDuration(),
-          'output_snippet': r.GetLog(),
-          'losless_snippet': True,
-          'output_snippet_base64': '',
-          'links': r.GetLinks(),
-      }
-      iteration_data[r.GetName()].append(result_dict)
+      iteration_data[r.GetName()].append(_ResultToDict(r))
 
     all_tests = all_tests.union(set(iteration_data.keys()))
     per_iteration_data.append(iteration_data)
@@ -113,6 +118,19 @@ def GenerateResultsDict(test_run_results, global_tags=None):
   }
 
 
+def _TestResultFormatStatus(result_type):
+  """Returns the JSON Test Results Format status of a ResultType."""
+  if result_type == base_test_result.ResultType.PASS:
+    return 'PASS'
+  if result_type == base_test_result.ResultType.SKIP:
+    return 'SKIP'
+  if result_type == base_test_result.ResultType.CRASH:
+    return 'CRASH'
+  if result_type == base_test_result.ResultType.TIMEOUT:
+    return 'TIMEOUT'
+  return 'FAIL'
+
+
 def GenerateJsonTestResultFormatDict(test_run_results, interrupted):
   """Create a results dict from |test_run_results| suitable for writing to JSON.
 
@@ -141,16 +159,7 @@ def GenerateJsonTestResultFormatDict(test_run_results, interrupted):
 
       element['expected'] = 'PASS'
 
-      if r.GetType() == base_test_result.ResultType.PASS:
-        result = 'PASS'
-      elif r.GetType() == base_test_result.ResultType.SKIP:
-        result = 'SKIP'
-      elif r.GetType() == base_test_result.ResultType.CRASH:
-        result = 'CRASH'
-      elif r.GetType() == base_test_result.ResultType.TIMEOUT:
-        result = 'TIMEOUT'
-      else:
-        result = 'FAIL'
+      result = _TestResultFormatStatus(r.GetType())
 
       if 'actual' in element:
         element['actual'] += ' ' + result
@@ -174,40 +183,157 @@ def GenerateJsonTestResultFormatDict(test_run_results, interrupted):
   }
 
 
+def _WriteResultsJson(f, iterations, global_tags, links_func, **kwargs):
+  """Writes the format of GenerateResultsDict() one test at a time.
+
+  Args:
+    f: File to write to.
+    iterations: Iterable of iterations, each an iterable of
+      (test name, iterable of result dicts) with each name appearing once.
+    global_tags: List of tags.
+    links_func: Function returning the test run links. Called after all
+      iterations have been written.
+    **kwargs: Passed to json.dumps() for each test's results.
+  """
+  all_tests = set()
+  f.write('{"per_iteration_data": [')
+  for i, iteration in enumerate(iterations):
+    f.write(',\n{' if i else '\n{')
+    for j, (name, result_dicts) in enumerate(iteration):
+      all_tests.add(name)
+      f.write(',\n' if j else '\n')
+      f.write('%s: %s' % (json.dumps(name), json.dumps(list(result_dicts),
+                                                       **kwargs)))
+    f.write('\n}')
+  f.write('\n],\n')
+  f.write('"global_tags": %s,\n' % json.dumps(global_tags or []))
+  f.write('"all_tests": %s,\n' % json.dumps(sorted(all_tests), **kwargs))
+  # TODO(jbudorick): Add support for disabled tests within base_test_result.
+  f.write('"disabled_tests": [],\n')
+  f.write('"links": %s\n}\n' % json.dumps(links_func(), **kwargs))
+
+
 def GenerateJsonResultsFile(test_run_result, file_path, global_tags=None,
                             **kwargs):
   """Write |test_run_result| to JSON.
 
   This emulates the format of the JSON emitted by
-  base/test/launcher/test_results_tracker.cc:SaveSummaryAsJSON.
+  base/test/launcher/test_results_tracker.cc:SaveSummaryAsJSON. Results are
+  written one test at a time rather than built into a single dict first.
 
   Args:
     test_run_result: a base_test_result.TestRunResults object.
     file_path: The path to the JSON file to write.
   """
+  test_run_links = {}
+
+  def iterate_tests(tries):
+    results_by_name = collections.defaultdict(list)
+    for tr in tries:
+      test_run_links.update(tr.GetLinks())
+      for r in tr.GetAll():
+        results_by_name[r.GetName()].append(r)
+    for name, results in results_by_name.items():
+      yield name, (_ResultToDict(r) for r in results)
+
+  iterations = (iterate_tests(t if isinstance(t, list) else [t])
+                for t in test_run_result)
   with open(file_path, 'w') as json_result_file:
-    json_result_file.write(json.dumps(
-        GenerateResultsDict(test_run_result, global_tags=global_tags),
-        **kwargs))
+    _WriteResultsJson(json_result_file,
+                      iterations,
+                      global_tags,
+                      lambda: test_run_links,
+                      **kwargs)
     logging.info('Generated json results file at %s', file_path)
 
 
+def _WriteJsonTestResultFormat(f, results, interrupted, **kwargs):
+  """Writes the format of GenerateJsonTestResultFormatDict() one test at a time.
+
+  Only the status and duration of each test are kept in memory, rather than
+  the whole dict and its serialized form.
+
+  Args:
+    f: File to write to.
+    results: Iterable of (test name, ResultType, duration) tuples, in the order
+      the tests were run.
+    interrupted: True if tests were interrupted, e.g. timeout listing tests
+    **kwargs: Passed to json.dumps() for each value.
+  """
+  counts = {'PASS': 0, 'FAIL': 0, 'SKIP': 0, 'CRASH': 0, 'TIMEOUT': 0}
+  # Maps test names to their element in the "tests" trie.
+  elements = {}
+  for name, result_type, duration in results:
+    result = _TestResultFormatStatus(result_type)
+    element = elements.get(name)
+    if element:
+      element['actual'] += ' ' + result
+    else:
+      counts[result] += 1
+      element = elements[name] = {'expected': 'PASS', 'actual': result}
+      if result == 'FAIL':
+        element['is_unexpected'] = True
+    if duration != 0:
+      element['time'] = duration
+
+  def dumps(value):
+    return json.dumps(value, **kwargs)
+
+  f.write('{"interrupted": %s,\n' % dumps(interrupted))
+  f.write('"num_failures_by_type": %s,\n' % dumps(counts))
+  f.write('"path_delimiter": ".",\n')
+  f.write('"seconds_since_epoch": %s,\n' % dumps(time.time()))
+  f.write('"version": 3,\n')
+  f.write('"tests": {')
+  # Sorting visits each node of the trie in one go, before its children.
+  path = []
+  # Whether the object of each node in |path|, and of the root, has a key yet.
+  has_keys = [False]
+  for keys, element in sorted(
+      (name.split('.'), element) for name, element in elements.items()):
+    common = 0
+    while (common < len(path) and common < len(keys)
+           and path[common] == keys[common]):
+      common += 1
+    while len(path) > common:
+      f.write('}')
+      path.pop()
+      has_keys.pop()
+    for key in keys[common:]:
+      f.write('%s\n%s: {' % (',' if has_keys[-1] else '', dumps(key)))
+      has_keys[-1] = True
+      path.append(key)
+      has_keys.append(False)
+    for field, value in element.items():
+      f.write('%s%s: %s' % (', ' if has_keys[-1] else '', dumps(field),
+                            dumps(value)))
+      has_keys[-1] = True
+  f.write('}' * len(path))
+  f.write('\n}\n}\n')
+
+
 def GenerateJsonTestResultFormatFile(test_run_result, interrupted, file_path,
                                      **kwargs):
   """Write |test_run_result| to JSON.
 
-  This uses the official Chromium Test Results Format.
+  This uses the official Chromium Test Results Format. Results are written
+  one test at a time rather than built into a single dict first.
 
   Args:
     test_run_result: a base_test_result.TestRunResults object.
     interrupted: True if tests were interrupted, e.g. timeout listing tests
     file_path: The path to the JSON file to write.
   """
+
+  def iterate_results():
+    for t in test_run_result:
+      for tr in (t if isinstance(t, list) else [t]):
+        for r in tr.GetAll():
+          yield r.GetName(), r.GetType(), r.GetDuration()
+
   with open(file_path, 'w') as json_result_file:
-    json_result_file.write(
-        json.dumps(
-            GenerateJsonTestResultFormatDict(test_run_result, interrupted),
-            **kwargs))
+    _WriteJsonTestResultFormat(json_result_file, iterate_results(),
+                               interrupted, **kwargs)
     logging.info('Generated json results file at %s', file_path)
 
 
@@ -235,3 +361,209 @@ def ParseResultsFromJson(json_results):
                                            log=tr.get('output_snippet'))
           for tr in test_runs])
   return results_list
+
+
+# Version of the results log format.
+_RESULTS_LOG_VERSION = 1
+
+
+class ResultsLogWriter:
+  """Appends each test result to a JSON lines file as it is added.
+
+  Unlike the JSON results files, which are written at the end of a run, the
+  log survives the runner being killed. ReadResultsLog() and
+  GenerateJsonResultsFileFromLog() turn it back into results.
+  """
+
+  def __init__(self, path):
+    self._lock = threading.Lock()
+    self._file = open(path, 'w')  # pylint: disable=consider-using-with
+    self._Write({'version': _RESULTS_LOG_VERSION})
+
+  def _Write(self, record):
+    line = json.dumps(record) + '\n'
+    with self._lock:
+      self._file.write(line)
+      self._file.flush()
+
+  def TrackTestRunResults(self, iteration, try_index, test_run_results):
+    """Writes results already in, or later added to, |test_run_results|.
+
+    Args:
+      iteration: Index of the iteration the results are from.
+      try_index: Index of the try within the iteration.
+      test_run_results: The try's base_test_result.TestRunResults.
+    """
+
+    def on_result(r):
+      self._Write({
+          'iteration': iteration,
+          'try': try_index,
+          'name': r.GetName(),
+          'status': r.GetType(),
+          'elapsed_time_ms': r.GetDuration(),
+          'output_snippet': r.GetLog(),
+          'links': r.GetLinks(),
+      })
+
+    test_run_results.AddListener(on_result)
+
+  def Close(self, test_run_results=(), global_tags=None):
+    """Marks the log as complete.
+
+    Args:
+      test_run_results: The lists of each iteration's tries' TestRunResults,
+        whose links are recorded.
+      global_tags: List of tags for the run.
+    """
+    links = {}
+    for tries in test_run_results:
+      for tr in tries:
+        links.update(tr.GetLinks())
+    self._Write({'complete': True, 'global_tags': global_tags or [],
+                 'links': links})
+    self._file.close()
+
+
+def _IndexResultsLog(f):
+  """Reads a results log, keeping only the offsets of results.
+
+  Later records for the same test in the same try replace earlier ones, as
+  TestRunResults.AddResult() does.
+
+  Returns:
+    A tuple of (iterations, footer), where iterations is a list of lists of
+    tries, each a dict of test name to the offset of its latest record, and
+    footer is the final record of a complete log, or None.
+  """
+  header = json.loads(f.readline() or '{}')
+  if header.get('version') != _RESULTS_LOG_VERSION:
+    raise ValueError('Unsupported results log version: %s' %
+                     header.get('version'))
+  iterations = []
+  footer = None
+  while True:
+    offset = f.tell()
+    line = f.readline()
+    if not line:
+      break
+    try:
+      record = json.loads(line)
+    except ValueError:
+      # The last line of a killed run's log may be truncated.
+      logging.warning('Ignoring malformed results log line at offset %d.',
+                      offset)
+      continue
+    if record.get('complete'):
+      footer = record
+      continue
+    i = record['iteration']
+    while len(iterations) <= i:
+      iterations.append([])
+    tries = iterations[i]
+    while len(tries) <= record['try']:
+      tries.append({})
+    tries[record['try']][record['name']] = offset
+  # Iterations that produced no results are not reported.
+  return [t for t in iterations if t], footer
+
+
+def _ReadRecord(f, offset):
+  f.seek(offset)
+  return json.loads(f.readline())
+
+
+def ReadResultsLog(path):
+  """Reads a possibly incomplete results log.
+
+  Returns:
+    A tuple of (results, global_tags, complete), where results is a list of
+    lists of base_test_result.TestRunResults, as passed to
+    GenerateJsonResultsFile(), and complete is whether the run finished.
+  """
+  with open(path) as f:
+    iterations, footer = _IndexResultsLog(f)
+    all_raw_results = []
+    for tries in iterations:
+      raw_results = []
+      for offsets in tries:
+        test_run_results = base_test_result.TestRunResults()
+        for offset in offsets.values():
+          record = _ReadRecord(f, offset)
+          r = base_test_result.BaseTestResult(
+              record['name'],
+              record['status'],
+              duration=record['elapsed_time_ms'],
+              log=record['output_snippet'])
+          for link_name, link_url in record['links'].items():
+            r.SetLink(link_name, link_url)
+          test_run_results.AddResult(r)
+        raw_results.append(test_run_results)
+      all_raw_results.append(raw_results)
+  if footer:
+    return all_raw_results, footer['global_tags'], True
+  return all_raw_results, [], False
+
+
+def GenerateJsonResultsFileFromLog(log_path, file_path, **kwargs):
+  """Writes the results in |log_path| in the format of GenerateJsonResultsFile.
+
+  Results are streamed from the log one test at a time. Logs of runs that did
+  not finish are tagged UNRELIABLE_RESULTS.
+
+  Returns:
+    Whether the log was complete.
+  """
+  with open(log_path) as f, open(file_path, 'w') as out:
+    iterations, footer = _IndexResultsLog(f)
+
+    def to_result_dict(record):
+      return {
+          'status': record['status'],
+          'elapsed_time_ms': record['elapsed_time_ms'],
+          'output_snippet': record['output_snippet'],
+          'losless_snippet': True,
+          'output_snippet_base64': '',
+          'links': record['links'],
+      }
+
+    def iterate_tests(tries):
+      names = {}
+      for offsets in tries:
+        names.update(dict.fromkeys(offsets))
+      for name in names:
+        yield name, (to_result_dict(_ReadRecord(f, offsets[name]))
+                     for offsets in tries if name in offsets)
+
+    global_tags = footer['global_tags'] if footer else ['UNRELIABLE_RESULTS']
+    _WriteResultsJson(out, (iterate_tests(t) for t in iterations), global_tags,
+                      lambda: footer['links'] if footer else {}, **kwargs)
+  logging.info('Generated json results file at %s', file_path)
+  return footer is not None
+
+
+def GenerateJsonTestResultFormatFileFromLog(log_path, file_path, **kwargs):
+  """Writes the results in |log_path| like GenerateJsonTestResultFormatFile.
+
+  Results are streamed from the log one test at a time. Runs that did not
+  finish, or finished with UNRELIABLE_RESULTS, are marked as interrupted.
+
+  Returns:
+    Whether the log was complete.
+  """
+  with open(log_path) as f, open(file_path, 'w') as out:
+    iterations, footer = _IndexResultsLog(f)
+
+    def iterate_results():
+      for tries in iterations:
+        for offsets in tries:
+          for offset in offsets.values():
+            record = _ReadRecord(f, offset)
+            yield (record['name'], record['status'],
+                   record['elapsed_time_ms'])
+
+    interrupted = (footer is None
+                   or 'UNRELIABLE_RESULTS' in footer['global_tags'])
+    _WriteJsonTestResultFormat(out, iterate_results(), interrupted, **kwargs)
+  logging.info('Generated json results file at %s', file_path)
+  return footer is not None
@@ -4,6 +4,9 @@
 # found in the LICENSE file.
 
 
+import json
+import os
+import tempfile
 import unittest
 
 from pylib.base import base_test_result
@@ -306,5 +309,153 @@ class JsonResultsTest(unittest.TestCase):
     self.assertEqual(1, results_dict['num_failures_by_type']['FAIL'])
 
 
+def _Result(name, result_type, duration=0, log=''):
+  return base_test_result.BaseTestResult(name,
+                                         result_type,
+                                         duration=duration,
+                                         log=log)
+
+
+class ResultsLogTest(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    self._log_path = os.path.join(self._tmp_dir.name, 'results.jsonl')
+    self._json_path = os.path.join(self._tmp_dir.name, 'results.json')
+
+  def tearDown(self):
+    self._tmp_dir.cleanup()
+
+  def _WriteLog(self, close=True):
+    writer = json_results.ResultsLogWriter(self._log_path)
+    try_1 = base_test_result.TestRunResults()
+    try_1.AddResult(_Result('a', base_test_result.ResultType.NOTRUN))
+    writer.TrackTestRunResults(0, 0, try_1)
+    # Replaces the placeholder added before the try was tracked.
+    try_1.AddResult(_Result('a', base_test_result.ResultType.FAIL, 5, 'oops'))
+    try_1.AddResult(_Result('b', base_test_result.ResultType.PASS, 3))
+    try_2 = base_test_result.TestRunResults()
+    writer.TrackTestRunResults(0, 1, try_2)
+    retry = base_test_result.TestRunResults()
+    retry.AddResult(_Result('a', base_test_result.ResultType.PASS, 4))
+    try_2.AddTestRunResults(retry)
+    try_2.SetLink('logcat', 'http://logcat')
+    if close:
+      writer.Close([[try_1, try_2]], ['tag'])
+    return [[try_1, try_2]]
+
+  def testRoundTrip(self):
+    all_raw_results = self._WriteLog()
+    expected = json_results.GenerateResultsDict(all_raw_results, ['tag'])
+    self.assertTrue(
+        json_results.GenerateJsonResultsFileFromLog(self._log_path,
+                                                    self._json_path))
+    with open(self._json_path) as f:
+      self.assertEqual(expected, json.load(f))
+
+    results, global_tags, complete = json_results.ReadResultsLog(
+        self._log_path)
+    self.assertTrue(complete)
+    self.assertEqual(['tag'], global_tags)
+    self.assertEqual(1, len(results))
+    self.assertEqual(
+        {('a', 'FAILURE', 'oops'), ('b', 'SUCCESS', '')},
+        {(r.GetName(), r.GetType(), r.GetLog())
+         for r in results[0][0].GetAll()})
+    self.assertEqual({('a', 'SUCCESS')},
+                     {(r.GetName(), r.GetType())
+                      for r in results[0][1].GetAll()})
+
+  def testIncompleteLog(self):
+    self._WriteLog(close=False)
+    # Simulate the runner being killed while writing a record.
+    with open(self._log_path, 'a') as f:
+      f.write('{"iteration": 0, "try": 1, "na')
+    self.assertFalse(
+        json_results.GenerateJsonResultsFileFromLog(self._log_path,
+                                                    self._json_path))
+    with open(self._json_path) as f:
+      results_dict = json.load(f)
+    self.assertEqual(['UNRELIABLE_RESULTS'], results_dict['global_tags'])
+    self.assertEqual(['a', 'b'], results_dict['all_tests'])
+    self.assertEqual(
+        ['FAILURE', 'SUCCESS'],
+        [r['status'] for r in results_dict['per_iteration_data'][0]['a']])
+
+    _, global_tags, complete = json_results.ReadResultsLog(self._log_path)
+    self.assertFalse(complete)
+    self.assertEqual([], global_tags)
+
+  def testGenerateJsonResultsFile_matchesResultsDict(self):
+    run_results = base_test_result.TestRunResults()
+    run_results.AddResult(_Result('a', base_test_result.ResultType.PASS, 1))
+    run_results.AddResult(_Result('b', base_test_result.ResultType.FAIL, 2))
+    run_results.SetLink('link', 'http://link')
+    all_raw_results = [[run_results], [run_results]]
+    json_results.GenerateJsonResultsFile(all_raw_results,
+                                         self._json_path,
+                                         global_tags=['tag'],
+                                         indent=2)
+    with open(self._json_path) as f:
+      results_dict = json.load(f)
+    self.assertEqual(
+        json_results.GenerateResultsDict(all_raw_results, ['tag']),
+        results_dict)
+    self.assertEqual(
+        4, len(json_results.ParseResultsFromJson(results_dict)))
+
+
+  def _LoadTestResultFormat(self):
+    with open(self._json_path) as f:
+      results_dict = json.load(f)
+    self.assertIsInstance(results_dict.pop('seconds_since_epoch'), float)
+    return results_dict
+
+  def testGenerateJsonTestResultFormatFile_matchesDict(self):
+    try_1 = base_test_result.TestRunResults()
+    try_1.AddResults([
+        _Result('a.B.test1', base_test_result.ResultType.FAIL, 1),
+        _Result('a.B.test2', base_test_result.ResultType.PASS, 2),
+        # A test whose name is a prefix of another's.
+        _Result('a.B', base_test_result.ResultType.SKIP),
+        _Result('c', base_test_result.ResultType.CRASH),
+    ])
+    try_2 = base_test_result.TestRunResults()
+    try_2.AddResult(_Result('a.B.test1', base_test_result.ResultType.PASS, 3))
+    other_iteration = base_test_result.TestRunResults()
+    other_iteration.AddResult(
+        _Result('d', base_test_result.ResultType.TIMEOUT))
+    all_raw_results = [[try_1, try_2], other_iteration]
+    json_results.GenerateJsonTestResultFormatFile(all_raw_results,
+                                                  True,
+                                                  self._json_path,
+                                                  indent=2)
+    expected = json_results.GenerateJsonTestResultFormatDict(
+        all_raw_results, True)
+    del expected['seconds_since_epoch']
+    self.assertEqual(expected, self._LoadTestResultFormat())
+
+  def testGenerateJsonTestResultFormatFile_noResults(self):
+    json_results.GenerateJsonTestResultFormatFile([], False, self._json_path)
+    self.assertEqual({}, self._LoadTestResultFormat()['tests'])
+
+  def testGenerateJsonTestResultFormatFileFromLog(self):
+    all_raw_results = self._WriteLog()
+    self.assertTrue(
+        json_results.GenerateJsonTestResultFormatFileFromLog(
+            self._log_path, self._json_path))
+    expected = json_results.GenerateJsonTestResultFormatDict(
+        all_raw_results, False)
+    del expected['seconds_since_epoch']
+    self.assertEqual(expected, self._LoadTestResultFormat())
+    self.assertEqual('FAIL PASS', expected['tests']['a']['actual'])
+
+    self._WriteLog(close=False)
+    self.assertFalse(
+        json_results.GenerateJsonTestResultFormatFileFromLog(
+            self._log_path, self._json_path))
+    self.assertTrue(self._LoadTestResultFormat()['interrupted'])
+
+
 if __name__ == '__main__':
   unittest.main(verbosity=2)
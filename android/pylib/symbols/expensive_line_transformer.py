@@ -3,13 +3,21 @@
 # found in the LICENSE file.
 
 from abc import ABC, abstractmethod
+import collections
 import logging
+import queue
 import subprocess
 import threading
 import time
 import uuid
 
-from devil.utils import reraiser_thread
+# Requests are coalesced into batches of up to this many lines.
+_MAX_BATCH_LINES = 2000
+# Add a transformer to the pool when there are more than this many queued
+# requests per transformer.
+_BACKLOG_PER_TRANSFORMER = 4
+# Close transformers beyond the first after they have been idle this long.
+_IDLE_SECONDS = 60.0
 
 
 class ExpensiveLineTransformer(ABC):
@@ -18,7 +26,7 @@ class ExpensiveLineTransformer(ABC):
     self._minimum_timeout = minimum_timeout
     self._per_line_timeout = per_line_timeout
     self._started = False
-    # Allow only one thread to call TransformLines() at a time.
+    # Allow only one thread to call TransformBatch() at a time.
     self._lock = threading.Lock()
     # Ensure that only one thread attempts to kill self._proc in Close().
     self._close_lock = threading.Lock()
@@ -27,6 +35,11 @@ class ExpensiveLineTransformer(ABC):
     self._proc = None
     # Start process eagerly to hide start-up latency.
     self._proc_start_time = None
+    # Lines of output from the process, or None once it reaches EOF. Filled by
+    # a single reader thread that lives as long as the process.
+    self._output_queue = queue.Queue()
+    self._num_lines = 0
+    self._busy_time = 0.0
 
   def start(self):
     # delay the start of the process, to allow the initialization of the
@@ -48,8 +61,21 @@ class ExpensiveLineTransformer(ABC):
                                   stdout=subprocess.PIPE,
                                   universal_newlines=True,
                                   close_fds=True)
+    reader_thread = threading.Thread(name='{}-reader'.format(self.name),
+                                     target=self._ReadOutput,
+                                     args=(self._proc.stdout, ))
+    reader_thread.daemon = True
+    reader_thread.start()
     self._started = True
 
+  def _ReadOutput(self, stdout):
+    try:
+      for line in stdout:
+        self._output_queue.put(line[:-1])
+    except (IOError, ValueError):
+      pass  # Raised when stdout is closed by Close().
+    self._output_queue.put(None)
+
   def IsClosed(self):
     return (not self._started or self._closed_called
             or self._proc.returncode is not None)
@@ -60,6 +86,12 @@ class ExpensiveLineTransformer(ABC):
   def IsReady(self):
     return self._started and not self.IsClosed() and not self.IsBusy()
 
+  def GetLinesPerSecond(self):
+    """Returns the throughput of this transformer while busy."""
+    if not self._busy_time:
+      return 0.0
+    return self._num_lines / self._busy_time
+
   def TransformLines(self, lines):
     """Symbolizes names found in the given lines.
 
@@ -71,27 +103,35 @@ class ExpensiveLineTransformer(ABC):
     Returns:
       A list of strings without trailing newlines.
     """
-    if not lines:
-      return []
+    return self.TransformBatch([lines])[0]
+
+  def TransformBatch(self, requests):
+    """Transforms several lists of lines with a single write to the process.
+
+    If anything goes wrong (process crashes, timeout, etc), returns the
+    unmodified lines for each request that did not complete.
+
+    Args:
+      requests: A list of lists of strings without trailing newlines.
+
+    Returns:
+      A list with the transformed lines for each request.
+    """
+    results = list(requests)
+    pending = [i for i, lines in enumerate(requests) if lines]
+    for i, lines in enumerate(requests):
+      if not lines:
+        results[i] = []
+    if not pending:
+      return results
 
     # symbolized output contain more lines than the input, as the symbolized
     # stacktraces will be added. To account for the extra output lines, keep
-    # reading until this eof_line token is reached. Using a format that will
-    # be considered a "useful line" without modifying its output by
+    # reading until each request's eof_line token is reached. Using a format
+    # that will be considered a "useful line" without modifying its output by
     # third_party/android_platform/development/scripts/stack_core.py
-    eof_line = self.getEofLine()
-    out_lines = []
-
-    def _reader():
-      while True:
-        line = self._proc.stdout.readline()
-        # Return an empty string at EOF (when stdin is closed).
-        if not line:
-          break
-        line = line[:-1]
-        if line == eof_line:
-          break
-        out_lines.append(line)
+    eof_lines = {i: self.getEofLine() for i in pending}
+    num_lines = sum(len(requests[i]) for i in pending)
 
     if self.IsBusy():
       logging.warning('%s: Having to wait for transformation.', self.name)
@@ -103,42 +143,56 @@ class ExpensiveLineTransformer(ABC):
           logging.warning('%s: Process exited with code=%d.', self.name,
                           self._proc.returncode)
           self.Close()
-        return lines
-
-      reader_thread = reraiser_thread.ReraiserThread(_reader)
-      reader_thread.start()
+        return results
 
+      start_time = time.time()
       try:
-        self._proc.stdin.write('\n'.join(lines))
-        self._proc.stdin.write('\n{}\n'.format(eof_line))
+        self._proc.stdin.write(''.join('{}\n{}\n'.format(
+            '\n'.join(requests[i]), eof_lines[i]) for i in pending))
         self._proc.stdin.flush()
-        time_since_proc_start = time.time() - self._proc_start_time
-        timeout = (max(0, self._process_start_timeout - time_since_proc_start) +
-                   max(self._minimum_timeout,
-                       len(lines) * self._per_line_timeout))
-        reader_thread.join(timeout)
-        if self.IsClosed():
-          logging.warning('%s: Close() called by another thread during join().',
-                          self.name)
-          return lines
-        if reader_thread.is_alive():
-          logging.error('%s: Timed out after %f seconds with input:', self.name,
-                        timeout)
-          for l in lines:
-            logging.error(l)
-          logging.error(eof_line)
-          logging.error('%s: End of timed out input.', self.name)
-          logging.error('%s: Timed out output was:', self.name)
-          for l in out_lines:
-            logging.error(l)
-          logging.error('%s: End of timed out output.', self.name)
-          self.Close()
-          return lines
-        return out_lines
       except IOError:
         logging.exception('%s: Exception during transformation', self.name)
         self.Close()
-        return lines
+        return results
+
+      time_since_proc_start = start_time - self._proc_start_time
+      timeout = (max(0, self._process_start_timeout - time_since_proc_start) +
+                 max(self._minimum_timeout, num_lines * self._per_line_timeout))
+      deadline = start_time + timeout
+      for i in pending:
+        out_lines = []
+        while True:
+          try:
+            line = self._output_queue.get(
+                timeout=max(0, deadline - time.time()))
+          except queue.Empty:
+            self._LogTimeout(timeout, requests[i], eof_lines[i], out_lines)
+            self.Close()
+            return results
+          if line is None:
+            logging.warning('%s: Process closed its output.', self.name)
+            self.Close()
+            return results
+          if line == eof_lines[i]:
+            break
+          out_lines.append(line)
+        results[i] = out_lines
+
+      self._num_lines += num_lines
+      self._busy_time += time.time() - start_time
+      return results
+
+  def _LogTimeout(self, timeout, lines, eof_line, out_lines):
+    logging.error('%s: Timed out after %f seconds with input:', self.name,
+                  timeout)
+    for l in lines:
+      logging.error(l)
+    logging.error(eof_line)
+    logging.error('%s: End of timed out input.', self.name)
+    logging.error('%s: Timed out output was:', self.name)
+    for l in out_lines:
+      logging.error(l)
+    logging.error('%s: End of timed out output.', self.name)
 
   def Close(self):
     with self._close_lock:
@@ -146,7 +200,11 @@ class ExpensiveLineTransformer(ABC):
       self._closed_called = True
 
     if needs_closing:
-      self._proc.stdin.close()
+      try:
+        self._proc.stdin.close()
+      except OSError:
+        # Flushing buffered input fails if the process already exited.
+        pass
       self._proc.kill()
       self._proc.wait()
 
@@ -173,14 +231,56 @@ class ExpensiveLineTransformer(ABC):
     return "Generic useful log header: \'{}\'".format(uuid.uuid4().hex)
 
 
+class _Request:
+  """A call to ExpensiveLineTransformerPool.TransformLines()."""
+
+  def __init__(self, lines):
+    self.lines = lines
+    self.result = None
+    self.error = None
+    self.enqueue_time = time.time()
+    self.queue_latency = None
+    self._done = threading.Event()
+
+  def Finish(self, result, error=None):
+    self.result = result
+    self.error = error
+    self._done.set()
+
+  def Wait(self):
+    self._done.wait()
+
+
 class ExpensiveLineTransformerPool(ABC):
+  """Transforms lines using a pool of transformer processes.
+
+  Requests from all threads go into a single queue. Each transformer has a
+  dispatcher thread that takes as many queued requests as fit in a batch and
+  sends them to its process with a single write. The pool starts with one
+  transformer, adds more (up to |pool_size|) while requests are backing up, and
+  closes extra ones once they have been idle for a while.
+  """
+
   def __init__(self, max_restarts, pool_size, passthrough_on_failure):
     self._max_restarts = max_restarts
-    self._pool = [self.CreateTransformer() for _ in range(pool_size)]
+    self._max_pool_size = pool_size
     self._passthrough_on_failure = passthrough_on_failure
-    # Allow only one thread to select from the pool at a time.
+    # Guards all of the state below.
     self._lock = threading.Lock()
+    self._cond = threading.Condition(self._lock)
+    self._requests = collections.deque()
     self._num_restarts = 0
+    self._closed = False
+    self._broken = False
+    self._dispatchers = []
+    self._num_requests = 0
+    self._num_batches = 0
+    self._total_queue_latency = 0.0
+    self._max_queue_latency = 0.0
+    self._pool = []
+    # Start one transformer eagerly to hide start-up latency.
+    with self._lock:
+      self._AddTransformer()
 
   def __enter__(self):
     pass
@@ -188,40 +288,183 @@ class ExpensiveLineTransformerPool(ABC):
   def __exit__(self, *args):
     self.Close()
 
+  def _AddTransformer(self):
+    """Starts a transformer and its dispatcher thread. Requires self._lock."""
+    transformer = self.CreateTransformer()
+    self._pool.append(transformer)
+    thread = threading.Thread(name='{}-dispatcher'.format(self.name),
+                              target=self._DispatchLoop,
+                              args=(transformer, ))
+    thread.daemon = True
+    self._dispatchers.append(thread)
+    thread.start()
+
   def TransformLines(self, lines):
+    if not lines:
+      return []
+    request = _Request(lines)
     with self._lock:
-      assert self._pool, 'TransformLines() called on a closed Pool.'
-
-      # transformation is broken.
+      assert not self._closed, 'TransformLines() called on a closed Pool.'
+      if self._broken:
+        return self._BrokenResult(lines)
+      self._requests.append(request)
+      if (len(self._pool) < self._max_pool_size and
+          len(self._requests) > _BACKLOG_PER_TRANSFORMER * len(self._pool)):
+        logging.info('%s: Adding instance for backlog of %d requests.',
+                     self.name, len(self._requests))
+        self._AddTransformer()
+      self._cond.notify()
+    request.Wait()
+    if request.error:
+      raise request.error
+    return request.result
+
+  def _BrokenResult(self, lines):
+    # transformation is broken.
+    if self._passthrough_on_failure:
+      return lines
+    raise Exception('%s is broken.' % self.name)
+
+  def _TakeBatch(self):
+    """Pops queued requests up to _MAX_BATCH_LINES. Requires self._lock."""
+    batch = [self._requests.popleft()]
+    num_lines = len(batch[0].lines)
+    while self._requests:
+      num_lines += len(self._requests[0].lines)
+      if num_lines > _MAX_BATCH_LINES:
+        break
+      batch.append(self._requests.popleft())
+    now = time.time()
+    for request in batch:
+      request.queue_latency = now - request.enqueue_time
+      self._total_queue_latency += request.queue_latency
+      self._max_queue_latency = max(self._max_queue_latency,
+                                    request.queue_latency)
+    self._num_requests += len(batch)
+    self._num_batches += 1
+    return batch
+
+  def _FinishFailed(self, request, error):
+    """Finishes a request that could not be transformed."""
+    if self._passthrough_on_failure:
+      request.Finish(request.lines)
+    else:
+      request.Finish(None, error=error)
+
+  def _DispatchLoop(self, transformer):
+    batch = []
+    try:
+      while True:
+        with self._lock:
+          idle_since = time.time()
+          while not self._requests and not self._closed:
+            if (len(self._pool) > 1
+                and time.time() - idle_since > _IDLE_SECONDS):
+              logging.info('%s: Closing idle instance.', self.name)
+              self._pool.remove(transformer)
+              transformer.Close()
+              return
+            self._cond.wait(_IDLE_SECONDS)
+          if self._closed:
+            return
+          batch = self._TakeBatch()
+
+        results = transformer.TransformBatch([r.lines for r in batch])
+        for request, result in zip(batch, results):
+          request.Finish(result)
+        batch = []
+
+        if transformer.IsClosed():
+          transformer = self._RestartTransformer(transformer)
+          if transformer is None:
+            return
+    except Exception as e:  # pylint: disable=broad-except
+      # Callers wait for their requests without a timeout, so every request
+      # this thread is responsible for must be finished.
+      logging.exception('%s: Dispatcher failed.', self.name)
+      for request in batch:
+        self._FinishFailed(request, e)
+      self._RemoveFailedTransformer(transformer, e)
+
+  def _RemoveFailedTransformer(self, transformer, error):
+    """Removes the transformer of a dispatcher that failed. Fails queued
+    requests if no dispatchers are left to handle them."""
+    with self._lock:
+      if self._pool is None:
+        # Close() passes through the queued requests.
+        return
+      if transformer in self._pool:
+        self._pool.remove(transformer)
+      try:
+        transformer.Close()
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('%s: Failed to close instance.', self.name)
+      if self._pool:
+        return
+      self._broken = True
+      while self._requests:
+        self._FinishFailed(self._requests.popleft(), error)
+
+  def _RestartTransformer(self, transformer):
+    """Replaces a closed transformer. Returns None if it should not be."""
+    with self._lock:
+      if self._closed or self._broken:
+        return None
+      self._num_restarts += 1
       if self._num_restarts == self._max_restarts:
-        if self._passthrough_on_failure:
-          return lines
-        raise Exception('%s is broken.' % self.name)
-
-      # Restart any closed transformer.
-      for i, d in enumerate(self._pool):
-        if d.IsClosed():
-          logging.warning('%s: Restarting closed instance.', self.name)
-          self._pool[i] = self.CreateTransformer()
-          self._num_restarts += 1
-          if self._num_restarts == self._max_restarts:
-            logging.warning('%s: MAX_RESTARTS reached.', self.name)
-            if self._passthrough_on_failure:
-              return lines
-            raise Exception('%s is broken.' % self.name)
-
-      selected = next((x for x in self._pool if x.IsReady()), self._pool[0])
-      # Rotate the order so that next caller will not choose the same one.
-      self._pool.remove(selected)
-      self._pool.append(selected)
-
-    return selected.TransformLines(lines)
+        logging.warning('%s: MAX_RESTARTS reached.', self.name)
+        self._broken = True
+        self._pool.remove(transformer)
+        # Fail everything that is still waiting.
+        while self._requests:
+          self._FinishFailed(self._requests.popleft(),
+                             Exception('%s is broken.' % self.name))
+        return None
+      logging.warning('%s: Restarting closed instance.', self.name)
+      new_transformer = self.CreateTransformer()
+      self._pool[self._pool.index(transformer)] = new_transformer
+      return new_transformer
+
+  def GetStats(self):
+    """Returns a dict of queue latency and throughput stats."""
+    with self._lock:
+      return {
+          'requests': self._num_requests,
+          'batches': self._num_batches,
+          'mean_queue_latency': (self._total_queue_latency /
+                                 max(1, self._num_requests)),
+          'max_queue_latency': self._max_queue_latency,
+          'lines_per_second': [t.GetLinesPerSecond() for t in self._pool or []],
+      }
 
   def Close(self):
+    stats = self.GetStats()
     with self._lock:
-      for d in self._pool:
-        d.Close()
+      if self._closed:
+        return
+      self._closed = True
+      self._cond.notify_all()
+      pool = self._pool
+      dispatchers = self._dispatchers
       self._pool = None
+      self._dispatchers = []
+    # Closing the processes unblocks dispatchers that are mid-batch.
+    for d in pool:
+      d.Close()
+    for thread in dispatchers:
+      thread.join()
+    with self._lock:
+      # Requests that were never dispatched are passed through.
+      while self._requests:
+        request = self._requests.popleft()
+        request.Finish(request.lines)
+    if stats['requests']:
+      logging.info(
+          '%s: %d requests in %d batches, queue latency mean=%.3fs '
+          'max=%.3fs, lines/sec per instance: %s', self.name, stats['requests'],
+          stats['batches'], stats['mean_queue_latency'],
+          stats['max_queue_latency'],
+          ', '.join('%.0f' % x for x in stats['lines_per_second']))
 
   @abstractmethod
   def CreateTransformer(self):
@@ -0,0 +1,186 @@
+#!/usr/bin/env vpython3
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import sys
+import threading
+import unittest
+
+from pylib.symbols import expensive_line_transformer
+
+# Upper-cases its input, except for the end-of-request lines.
+_UPPER_SCRIPT = '''
+import sys
+for line in sys.stdin:
+  if not line.startswith('Generic useful log header'):
+    line = line.upper()
+  sys.stdout.write(line)
+  sys.stdout.flush()
+'''
+
+# Reads its input but never answers.
+_SILENT_SCRIPT = '''
+import sys
+for line in sys.stdin:
+  pass
+'''
+
+# Fails the test instead of hanging when a call never returns.
+_CALL_TIMEOUT = 30
+
+
+class _Transformer(expensive_line_transformer.ExpensiveLineTransformer):
+
+  def __init__(self, command, minimum_timeout=10):
+    super().__init__(10, minimum_timeout, 0.01)
+    self._command = command
+    self.start()
+
+  @property
+  def name(self):
+    return 'test-transformer'
+
+  @property
+  def command(self):
+    return self._command
+
+
+class _Pool(expensive_line_transformer.ExpensiveLineTransformerPool):
+
+  def __init__(self, commands, max_restarts=3, pool_size=1,
+               passthrough_on_failure=True, minimum_timeout=10):
+    # Each new transformer takes the next command; the last one is reused.
+    self._commands = list(commands)
+    self._minimum_timeout = minimum_timeout
+    self.num_created = 0
+    super().__init__(max_restarts, pool_size, passthrough_on_failure)
+
+  @property
+  def name(self):
+    return 'test-pool'
+
+  def CreateTransformer(self):
+    command = self._commands[min(self.num_created, len(self._commands) - 1)]
+    self.num_created += 1
+    if command is None:
+      raise OSError('Could not start transformer')
+    return _Transformer(command, self._minimum_timeout)
+
+
+def _Python(script):
+  return [sys.executable, '-c', script]
+
+
+def _CallAll(funcs):
+  """Calls |funcs| on separate threads. Returns results or exceptions."""
+  results = [None] * len(funcs)
+
+  def call(i):
+    try:
+      results[i] = funcs[i]()
+    except Exception as e:  # pylint: disable=broad-except
+      results[i] = e
+
+  threads = [
+      threading.Thread(target=call, args=(i, )) for i in range(len(funcs))
+  ]
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+  for thread in threads:
+    thread.join(_CALL_TIMEOUT)
+    if thread.is_alive():
+      raise AssertionError('Call did not return.')
+  return results
+
+
+class ExpensiveLineTransformerPoolTest(unittest.TestCase):
+
+  def testConcurrentCallers(self):
+    pool = _Pool([_Python(_UPPER_SCRIPT)], pool_size=2)
+    with pool:
+      inputs = [['line %d' % i, 'other %d' % i] for i in range(50)]
+      results = _CallAll([lambda l=l: pool.TransformLines(l) for l in inputs])
+    self.assertEqual([[x.upper() for x in l] for l in inputs], results)
+    self.assertEqual(50, pool.GetStats()['requests'])
+
+  def testTransformerDies(self):
+    # The first transformer exits immediately, so writing to it fails.
+    pool = _Pool([_Python('pass'), _Python(_UPPER_SCRIPT)])
+    with pool:
+      results = _CallAll([lambda: pool.TransformLines(['a'])] * 3)
+      # Failed requests are passed through; later ones use the restarted
+      # transformer.
+      self.assertTrue(all(r in (['a'], ['A']) for r in results))
+      self.assertEqual(['B'], pool.TransformLines(['b']))
+    self.assertEqual(2, pool.num_created)
+
+  def testMaxRestarts(self):
+    pool = _Pool([_Python('pass')], max_restarts=2)
+    with pool:
+      results = _CallAll([lambda: pool.TransformLines(['a'])] * 5)
+      self.assertEqual([['a']] * 5, results)
+      # Once broken, no more transformers are started.
+      self.assertEqual(['b'], pool.TransformLines(['b']))
+    self.assertEqual(2, pool.num_created)
+
+  def testMaxRestartsWithoutPassthrough(self):
+    pool = _Pool([_Python('pass')], max_restarts=1,
+                 passthrough_on_failure=False)
+    with pool:
+      results = _CallAll([lambda: pool.TransformLines(['a'])] * 3)
+      # The batch sent to the failed transformer is returned unmodified, like
+      # for a single transformer. Requests after it fail.
+      self.assertTrue(all(r == ['a'] or isinstance(r, Exception)
+                          for r in results))
+      with self.assertRaises(Exception):
+        pool.TransformLines(['a'])
+
+  def testCreateTransformerFails(self):
+    pool = _Pool([_Python('pass'), None])
+    with pool:
+      results = _CallAll([lambda: pool.TransformLines(['a'])] * 3)
+      self.assertEqual([['a']] * 3, results)
+      self.assertEqual(['b'], pool.TransformLines(['b']))
+
+  def testCreateTransformerFailsWithoutPassthrough(self):
+    pool = _Pool([_Python('pass'), None], passthrough_on_failure=False)
+    with pool:
+      results = _CallAll([lambda: pool.TransformLines(['a'])] * 3)
+      self.assertTrue(all(r == ['a'] or isinstance(r, Exception)
+                          for r in results))
+      with self.assertRaises(Exception):
+        pool.TransformLines(['a'])
+
+  def testCloseWithQueuedRequests(self):
+    pool = _Pool([_Python(_SILENT_SCRIPT)], minimum_timeout=_CALL_TIMEOUT)
+    results = []
+    callers = threading.Thread(target=lambda: results.extend(
+        _CallAll([lambda i=i: pool.TransformLines(['%d' % i])
+                  for i in range(5)])))
+    callers.start()
+    # Wait until one batch was sent and the rest are queued.
+    # pylint: disable=protected-access
+    while pool.GetStats()['requests'] + len(pool._requests) < 5:
+      callers.join(0.01)
+    pool.Close()
+    callers.join(_CALL_TIMEOUT)
+    self.assertFalse(callers.is_alive())
+    self.assertEqual(sorted([['%d' % i] for i in range(5)]), sorted(results))
+
+
+class ExpensiveLineTransformerTest(unittest.TestCase):
+
+  def testCloseAfterProcessExited(self):
+    transformer = _Transformer(_Python('pass'))
+    transformer._proc.wait()
+    # Writing fails, and so does flushing stdin when closing.
+    self.assertEqual(['a' * 100000],
+                     transformer.TransformLines(['a' * 100000]))
+    self.assertTrue(transformer.IsClosed())
+    transformer.Close()
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
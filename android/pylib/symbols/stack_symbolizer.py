@@ -11,6 +11,7 @@ import time
 from devil.utils import cmd_helper
 from pylib import constants
 from pylib.constants import host_paths
+from pylib.utils import run_metrics
 from .expensive_line_transformer import ExpensiveLineTransformer
 from .expensive_line_transformer import ExpensiveLineTransformerPool
 
@@ -87,7 +88,9 @@ class Symbolizer:
       try:
         _, output = cmd_helper.GetCmdStatusAndOutput(cmd + [f.name], env=env)
       finally:
-        self._time_spent_symbolizing += time.time() - start
+        elapsed = time.time() - start
+        self._time_spent_symbolizing += elapsed
+        run_metrics.RecordDuration('symbolize', elapsed)
     for line in output.splitlines():
       if not include_stack and 'Stack Data:' in line:
         break
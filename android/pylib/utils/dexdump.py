@@ -2,6 +2,9 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import concurrent.futures
+import contextlib
+import itertools
 import os
 import re
 import shutil
@@ -13,6 +16,7 @@ from typing import Dict
 
 from devil.utils import cmd_helper
 from pylib import constants
+from pylib.dex import dex_parser
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'gyp'))
 from util import build_utils
@@ -37,6 +41,10 @@ DEXDUMP_PATH = os.path.join(constants.ANDROID_SDK_TOOLS, 'dexdump')
 Annotations = namedtuple('Annotations',
                          ['classAnnotations', 'methodsAnnotations'])
 
+_ACC_PUBLIC = 0x1
+_ACC_ABSTRACT = 0x400
+_NO_INDEX = 0xffffffff
+
 # Finds each space-separated "foo=..." (where ... can contain spaces).
 _ANNOTATION_VALUE_MATCHER = re.compile(r'\w+=.*?(?:$|(?= \w+=))')
 
@@ -95,6 +103,99 @@ def Dump(apk_path):
     shutil.rmtree(dexfile_dir)
 
 
+def DumpWithDexParser(apk_path):
+  """Like Dump(), but parses the dex files in-process with dex_parser.
+
+  Dex files are read from the APK without extracting them, and are parsed in
+  parallel when there are several. Annotation values are converted to strings
+  the way dexdump prints them.
+  """
+  names = dex_parser.ListDexFilesInZip(apk_path)
+  if len(names) <= 1:
+    return [_DumpDexFileInZip(apk_path, n) for n in names]
+  num_workers = min(len(names), os.cpu_count() or 1)
+  with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+    return list(
+        executor.map(_DumpDexFileInZip, itertools.repeat(apk_path), names))
+
+
+def _DumpDexFileInZip(apk_path, name):
+  with contextlib.closing(
+      dex_parser.IterDexFilesInZip(apk_path, names=[name])) as dexfiles:
+    return _DumpDexFile(next(dexfiles)[1])
+
+
+def _DumpDexFile(dexfile):
+  """Returns the dict that Dump() returns for a single dex file."""
+  results = {}
+  for class_def in dexfile.class_def_item_list:
+    descriptor = dexfile.GetTypeString(class_def.class_idx)
+    package_name, _, class_name = descriptor[1:-1].rpartition('/')
+    package_name = package_name.replace('/', '.')
+    class_name = class_name.replace('$', '.')
+
+    methods = []
+    for method_idx, access_flags in dexfile.IterClassMethods(class_def):
+      method_name = dexfile.GetString(
+          dexfile.method_item_list[method_idx].name_idx)
+      # dexdump lists constructors separately.
+      if access_flags & _ACC_PUBLIC and not method_name.startswith('<'):
+        methods.append(method_name)
+
+    class_annotations, method_annotations = dexfile.GetClassAnnotations(
+        class_def)
+    methods_annotations = {}
+    for method_idx, annotations in method_annotations.items():
+      method_name = dexfile.GetString(
+          dexfile.method_item_list[method_idx].name_idx)
+      methods_annotations[method_name] = _ConvertAnnotations(annotations)
+
+    superclass = ''
+    if class_def.superclass_idx != _NO_INDEX:
+      superclass = dexfile.GetTypeString(class_def.superclass_idx)
+      superclass = superclass[1:-1].replace('/', '.').replace('$', '.')
+
+    package = results.setdefault(package_name, {'classes': {}})
+    package['classes'][class_name] = {
+        'methods':
+        methods,
+        'superclass':
+        superclass,
+        'is_abstract':
+        bool(class_def.access_flags & _ACC_ABSTRACT),
+        'annotations':
+        Annotations(classAnnotations=_ConvertAnnotations(class_annotations),
+                    methodsAnnotations=methods_annotations),
+    }
+  return results
+
+
+def _ConvertAnnotations(annotations):
+  """Converts dex_parser.Annotations to the format of _ParseAnnotations()."""
+  ret = {}
+  for annotation in annotations:
+    if annotation.visibility != dex_parser.VISIBILITY_RUNTIME:
+      continue
+    name = annotation.type[1:-1].rpartition('/')[2]
+    ret[name] = {k: _FormatAnnotationValue(v)
+                 for k, v in annotation.elements.items()} or None
+  return ret
+
+
+def _FormatAnnotationValue(value):
+  if isinstance(value, list):
+    return [_FormatAnnotationValue(v) for v in value]
+  if isinstance(value, dex_parser.Annotation):
+    return value.type
+  if value is None:
+    return 'null'
+  if isinstance(value, bool):
+    return 'true' if value else 'false'
+  if isinstance(value, float):
+    return '%g' % value
+  return str(value)
+
+
 def _ParseAnnotationValues(values_str):
   if not values_str:
     return None
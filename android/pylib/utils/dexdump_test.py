@@ -3,9 +3,12 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import tempfile
 import unittest
+import zipfile
 from xml.etree import ElementTree
 
+from pylib.dex import dex_parser_test
 from pylib.utils import dexdump
 
 # pylint: disable=protected-access
@@ -203,5 +206,71 @@ class DexdumpXMLParseTest(unittest.TestCase):
     self.assertEqual(expected, actual)
 
 
+
+class DumpWithDexParserTest(unittest.TestCase):
+
+  def testDumpWithDexParser(self):
+    data = dex_parser_test.BuildTestDex()
+    with tempfile.NamedTemporaryFile(suffix='.apk') as f:
+      with zipfile.ZipFile(f, 'w') as z:
+        z.writestr('classes.dex', data, zipfile.ZIP_STORED)
+        z.writestr('classes2.dex', data, zipfile.ZIP_DEFLATED)
+      f.flush()
+      actual = dexdump.DumpWithDexParser(f.name)
+
+    expected = {
+        'org.chromium.foo': {
+            'classes': {
+                'FooTest': {
+                    'methods': ['testA', 'testB', 'helper'],
+                    'superclass': 'java.lang.Object',
+                    'is_abstract': False,
+                    'annotations':
+                    dexdump.Annotations(
+                        classAnnotations={'Batch': {
+                            'value': 'UnitTests'
+                        }},
+                        methodsAnnotations={
+                            'testA': {
+                                'Feature': {
+                                    'value': ['Cronet', 'Other']
+                                }
+                            },
+                            'testB': {
+                                'SmallTest': None,
+                                'Timeout': {
+                                    'value': '-5000',
+                                    'mode': 'FAST',
+                                    'enabled': 'true',
+                                    'scale': 'null',
+                                    'helper': [],
+                                },
+                            },
+                        }),
+                },
+                'AbstractTest': {
+                    'methods': ['testA'],
+                    'superclass': 'java.lang.Object',
+                    'is_abstract': True,
+                    'annotations': emptyAnnotations,
+                },
+                'Outer.InnerTest': {
+                    'methods': ['testC'],
+                    'superclass': 'java.lang.Object',
+                    'is_abstract': False,
+                    'annotations': emptyAnnotations,
+                },
+                'Outer.InnerSubTest': {
+                    'methods': ['testC'],
+                    'superclass': 'org.chromium.foo.Outer.InnerTest',
+                    'is_abstract': False,
+                    'annotations': emptyAnnotations,
+                },
+            }
+        }
+    }
+    self.assertEqual([expected, expected], actual)
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,94 @@
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Records timings and counts of a test_runner.py run.
+
+The values are kept in build/util/lib/proto/measures, so they end up in
+test_script_metrics.jsonpb and in the ResultDB invocation the same way as the
+metrics of other test scripts. Durations are aggregated into histograms, as
+some of them (e.g. per-test run times) are recorded many times per run.
+
+Example:
+  with run_metrics.Timer('install_apk'):
+    device.Install(apk)
+"""
+
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+
+from pylib.constants import host_paths
+
+_PROTO_DIR = os.path.join(host_paths.BUILD_UTIL_PATH, 'lib', 'proto')
+if _PROTO_DIR not in sys.path:
+  sys.path.append(_PROTO_DIR)
+
+# pylint: disable=import-error,wrong-import-position
+import measures
+# pylint: enable=import-error,wrong-import-position
+
+TEST_SCRIPT_METRICS_KEY = measures.TEST_SCRIPT_METRICS_KEY
+
+# All metrics are named |_PREFIX|/<name>.
+_PREFIX = 'android_test_runner'
+
+_lock = threading.Lock()
+# measures registers every measure it creates, so each name is created once.
+_histograms = {}
+_counts = {}
+
+
+def _GetMeasure(cache, create, name):
+  with _lock:
+    measure = cache.get(name)
+    if measure is None:
+      measure = cache[name] = create(_PREFIX, name)
+    return measure
+
+
+def RecordDuration(name, seconds):
+  """Adds |seconds| to the histogram of |name| durations."""
+  _GetMeasure(_histograms, measures.histogram,
+              name + ' (seconds)').record(max(seconds, 0))
+
+
+@contextlib.contextmanager
+def Timer(name):
+  """Records the duration of the block, including when it raises."""
+  start = time.time()
+  try:
+    yield
+  finally:
+    RecordDuration(name, time.time() - start)
+
+
+def Increment(name, amount=1):
+  """Adds |amount| to the count of |name|."""
+  count = _GetMeasure(_counts, measures.count, name)
+  # Count is not thread-safe on its own.
+  with _lock:
+    for _ in range(amount):
+      count.record()
+
+
+def ToDict():
+  """Returns all metrics of the process, to be uploaded to ResultDB."""
+  return measures.to_dict()
+
+
+def Dump(dir_path):
+  """Writes all metrics of the process to |dir_path|."""
+  measures.dump(dir_path)
+  logging.info('Wrote test script metrics to %s',
+               os.path.join(dir_path,
+                            measures.TEST_SCRIPT_METRICS_JSONPB_FILENAME))
+
+
+def LogSummary():
+  summary = measures.summary()
+  if summary:
+    logging.info('Test runner metrics:\n%s', summary)
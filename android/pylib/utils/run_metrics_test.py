@@ -0,0 +1,57 @@
+#!/usr/bin/env vpython3
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import os
+import tempfile
+import unittest
+
+from pylib.utils import run_metrics
+
+
+def _GetMetric(name):
+  metrics = run_metrics.ToDict()['metrics']
+  matches = [m for m in metrics if m['name'] == 'android_test_runner/' + name]
+  assert len(matches) == 1, matches
+  return matches[0]
+
+
+class RunMetricsTest(unittest.TestCase):
+
+  def testTimer(self):
+    with run_metrics.Timer('test_timer'):
+      pass
+    with self.assertRaises(ValueError):
+      with run_metrics.Timer('test_timer'):
+        raise ValueError()
+    histogram = _GetMetric('test_timer (seconds)')['histogram']
+    self.assertEqual('2', histogram['count'])
+
+  def testRecordDuration(self):
+    run_metrics.RecordDuration('test_duration', 2)
+    run_metrics.RecordDuration('test_duration', 4)
+    # Clocks can go backwards.
+    run_metrics.RecordDuration('test_duration', -1)
+    histogram = _GetMetric('test_duration (seconds)')['histogram']
+    self.assertEqual('3', histogram['count'])
+    self.assertEqual(6, histogram['sum'])
+    self.assertEqual(4, histogram['max'])
+
+  def testIncrement(self):
+    run_metrics.Increment('test_count')
+    run_metrics.Increment('test_count', 3)
+    self.assertEqual(4, _GetMetric('test_count')['value'])
+
+  def testDump(self):
+    run_metrics.Increment('test_dump')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      run_metrics.Dump(tmp_dir)
+      with open(os.path.join(tmp_dir, 'test_script_metrics.jsonpb')) as f:
+        names = [m['name'] for m in json.load(f)['metrics']]
+    self.assertIn('android_test_runner/test_dump', names)
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
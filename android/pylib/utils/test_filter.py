@@ -2,6 +2,8 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
+import fnmatch
 import os
 import re
 
@@ -9,6 +11,8 @@ import re
 _CMDLINE_NAME_SEGMENT_RE = re.compile(
     r' with(?:out)? \{[^\}]*\}')
 
+_WILDCARD_RE = re.compile(r'[*?[]')
+
 
 def ParseFilterFile(input_lines):
   """Converts test filter file contents to positive and negative pattern lists.
@@ -143,3 +147,103 @@ def InitializeFiltersFromArgs(args):
         test_filters.append(filter_string)
 
   return test_filters
+
+
+class _PatternList:
+  """An ordered list of fnmatch-style patterns, compiled for fast matching."""
+
+  def __init__(self, patterns):
+    self._exact = {}
+    by_prefix = collections.defaultdict(list)
+    for i, pattern in enumerate(patterns):
+      m = _WILDCARD_RE.search(pattern)
+      if not m:
+        self._exact.setdefault(pattern, i)
+        continue
+      # Bucket wildcard patterns by their literal prefix, so that a name is
+      # only matched against patterns that could match it.
+      by_prefix[pattern[:m.start()]].append((i, pattern))
+
+    # Maps prefix length -> prefix -> regex with one group per pattern. Groups
+    # are named after the pattern's index since fnmatch.translate() may add
+    # groups of its own.
+    self._buckets = collections.defaultdict(dict)
+    for prefix, indexed_patterns in by_prefix.items():
+      self._buckets[len(prefix)][prefix] = re.compile('|'.join(
+          '(?P<p%d>%s)' % (i, fnmatch.translate(p))
+          for i, p in indexed_patterns))
+    self._prefix_lengths = sorted(self._buckets)
+
+  def __bool__(self):
+    return bool(self._exact or self._buckets)
+
+  def FirstMatch(self, name):
+    """Returns the index of the first pattern that matches |name|, or None."""
+    first = self._exact.get(name)
+    for length in self._prefix_lengths:
+      if length > len(name):
+        break
+      regex = self._buckets[length].get(name[:length])
+      if regex is None:
+        continue
+      m = regex.match(name)
+      if m:
+        # Alternatives are tried in order, so this is the first in the bucket.
+        i = int(m.lastgroup[1:])
+        if first is None or i < first:
+          first = i
+    return first
+
+
+class CompiledFilter:
+  """A googletest-style filter string, compiled for matching many names.
+
+  Names without wildcards are looked up by hash. Wildcard patterns are grouped
+  by their literal prefix into combined regular expressions. Matches the
+  semantics of unittest_util.FilterTestNames().
+  """
+
+  def __init__(self, test_filter):
+    pattern_groups = test_filter.split('-')
+    positive_patterns = ['*']
+    if pattern_groups[0]:
+      positive_patterns = pattern_groups[0].split(':')
+    negative_patterns = []
+    if len(pattern_groups) > 1:
+      negative_patterns = pattern_groups[1].split(':')
+    self._positive = _PatternList(positive_patterns)
+    self._negative = _PatternList(negative_patterns)
+
+  def _Rank(self, name):
+    if self._negative and self._negative.FirstMatch(name) is not None:
+      return None
+    return self._positive.FirstMatch(name)
+
+  def Matches(self, name):
+    return self._Rank(name) is not None
+
+  def MatchesAnyName(self, names):
+    """Returns whether a test known by all of |names| passes the filter.
+
+    The test passes if any of its names matches a positive pattern and none
+    matches a negative pattern.
+    """
+    if self._negative and any(
+        self._negative.FirstMatch(n) is not None for n in names):
+      return False
+    return any(self._positive.FirstMatch(n) is not None for n in names)
+
+  def FilterTestNames(self, test_names):
+    """Returns the names that pass the filter.
+
+    Like unittest_util.FilterTestNames(), names are ordered by the first
+    positive pattern they match, and then by their order in |test_names|.
+    """
+    ranked = []
+    for name in test_names:
+      rank = self._Rank(name)
+      if rank is not None:
+        ranked.append((rank, name))
+    # sort() is stable, so ties keep their original order.
+    ranked.sort(key=lambda r: r[0])
+    return [name for _, name in ranked]
@@ -4,13 +4,17 @@
 # found in the LICENSE file.
 
 import argparse
+import fnmatch
 import os
 import sys
 import tempfile
+import time
 import unittest
 
 from pylib.utils import test_filter
 
+_RUN_BENCHMARKS = int(os.environ.get('RUN_BENCHMARKS', 0))
+
 class ParseFilterFileTest(unittest.TestCase):
 
   def testParseFilterFile_commentsAndBlankLines(self):
@@ -252,5 +256,72 @@ class HasPositivePatterns(unittest.TestCase):
     self.assertEqual(actual, expected)
 
 
+class CompiledFilterTest(unittest.TestCase):
+
+  def testFilterTestNames(self):
+    names = ['A.a', 'A.b', 'B.a', 'B.b', 'C.DISABLED_a']
+    self.assertEqual(
+        names,
+        test_filter.CompiledFilter('').FilterTestNames(names))
+    self.assertEqual(['A.b', 'B.b'],
+                     test_filter.CompiledFilter('*.b').FilterTestNames(names))
+    self.assertEqual(['A.a', 'B.b'],
+                     test_filter.CompiledFilter('A.a:B.*-B.a:A.b:C.*').
+                     FilterTestNames(names))
+    self.assertEqual(['A.a', 'B.a', 'B.b'],
+                     test_filter.CompiledFilter('-A.b:*.DISABLED_*').
+                     FilterTestNames(names))
+
+  def testOrderedByFirstMatchingPattern(self):
+    names = ['A.a', 'B.a', 'A.b']
+    self.assertEqual(['B.a', 'A.a', 'A.b'],
+                     test_filter.CompiledFilter('B.*:A.*').FilterTestNames(names))
+    self.assertEqual(['A.b', 'A.a', 'B.a'],
+                     test_filter.CompiledFilter('A.b:*').FilterTestNames(names))
+
+  def testCharacterClassesAndLongPrefixes(self):
+    prefix = 'org.chromium.chrome.browser.'
+    names = [prefix + 'FooTest.test1', prefix + 'FooTest.test2', 'Foo']
+    f = test_filter.CompiledFilter(prefix + 'FooTest.test[23]:F?o')
+    self.assertEqual([prefix + 'FooTest.test2', 'Foo'],
+                     f.FilterTestNames(names))
+
+  def testMatchesAnyName(self):
+    f = test_filter.CompiledFilter('FooTest.*-*.testBar')
+    self.assertTrue(f.MatchesAnyName(['org.FooTest.testBaz', 'FooTest.testBaz']))
+    self.assertFalse(f.MatchesAnyName(['org.FooTest.testBaz']))
+    # Any name matching a negative pattern excludes the test.
+    self.assertFalse(f.MatchesAnyName(['FooTest.testBar', 'Foo.testBar']))
+
+  @unittest.skipUnless(_RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=1 to run.')
+  def testBenchmark(self):
+    names = [
+        'org.chromium.Suite%d.test%d__param%d' % (i % 500, i, i % 3)
+        for i in range(40000)
+    ]
+    positive = ['org.chromium.Suite%d.*' % i for i in range(0, 500, 2)]
+    negative = ['org.chromium.Suite%d.test%d__param0' % (i % 500, i)
+                for i in range(0, 40000, 7)] + ['*__param2']
+    filter_str = '%s-%s' % (':'.join(positive), ':'.join(negative))
+
+    start = time.time()
+    compiled_result = test_filter.CompiledFilter(filter_str).FilterTestNames(
+        names)
+    compiled_time = time.time() - start
+
+    # The approach of unittest_util.FilterTestNames().
+    start = time.time()
+    neg_set = set(negative[:-1])
+    fnmatch_result = [
+        n for p in positive for n in fnmatch.filter(names, p)
+        if n not in neg_set and not fnmatch.fnmatch(n, negative[-1])
+    ]
+    fnmatch_time = time.time() - start
+
+    self.assertEqual(fnmatch_result, compiled_result)
+    print('\n40k names, %d patterns: compiled=%.3fs, fnmatch=%.3fs' %
+          (len(positive) + len(negative), compiled_time, fnmatch_time))
+
+
 if __name__ == '__main__':
   sys.exit(unittest.main())
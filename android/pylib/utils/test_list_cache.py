@@ -0,0 +1,246 @@
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Caches test lists by the content of the test binaries they came from.
+
+Entries are keyed on a hash of the inputs that determine a test list (e.g. the
+dex files of a test APK) rather than on file paths or timestamps, so they stay
+valid across rebuilds that do not change the tests, copies to other machines,
+and different output directories sharing the same cache directory.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+
+# Bump when the format of entries or of the test lists stored in them changes.
+_VERSION = 1
+
+# Least recently used entries are deleted beyond this many.
+_MAX_ENTRIES = 200
+
+_CHUNK_SIZE = 1 << 20
+
+# Matches the classpath of scripts created by create_java_binary_script.py.
+_JAVA_BINARY_CLASSPATH_RE = re.compile(r'^classpath = \[(.*)\]$', re.MULTILINE)
+
+
+class CacheKey:
+  """Accumulates the inputs of a test list into a hash."""
+
+  def __init__(self, kind, extras=None):
+    """Initializes the key.
+
+    Args:
+      kind: Name of the kind of test list, e.g. 'gtest'.
+      extras: JSON-serializable value for non-file inputs of the listing,
+        such as flags.
+    """
+    self._hash = hashlib.sha256()
+    self._AddString(json.dumps([_VERSION, kind, extras], sort_keys=True))
+
+  def _AddString(self, value):
+    data = value.encode('utf-8')
+    self._hash.update(b'%d:' % len(data))
+    self._hash.update(data)
+
+  def AddFile(self, path):
+    """Adds the contents of |path|."""
+    with open(path, 'rb') as f:
+      for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+        self._hash.update(chunk)
+    self._AddString('')
+
+  def AddDirectory(self, path):
+    """Adds the relative paths and contents of all files under |path|."""
+    for root, dirs, files in os.walk(path):
+      # Visit directories in a stable order.
+      dirs.sort()
+      for name in sorted(files):
+        file_path = os.path.join(root, name)
+        self._AddString(os.path.relpath(file_path, path))
+        self.AddFile(file_path)
+
+  def AddZipEntryContents(self, zip_path, names):
+    """Adds the uncompressed contents of |names| in |zip_path|."""
+    with zipfile.ZipFile(zip_path) as z:
+      for name in sorted(names):
+        self._AddString(name)
+        with z.open(name) as f:
+          for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            self._hash.update(chunk)
+        self._AddString('')
+
+  def AddZipEntries(self, zip_path):
+    """Adds the names and CRCs of all entries in |zip_path|.
+
+    Only the central directory is read, which makes this much cheaper than
+    AddZipEntryContents() for large archives while still depending only on
+    entry contents.
+    """
+    with zipfile.ZipFile(zip_path) as z:
+      infos = sorted(z.infolist(), key=lambda i: i.filename)
+    for info in infos:
+      self._AddString('%s:%08x:%d' % (info.filename, info.CRC, info.file_size))
+
+  def AddJavaBinaryClasspath(self, script_path):
+    """Adds the jars on the classpath of a java_binary wrapper script."""
+    with open(script_path) as f:
+      m = _JAVA_BINARY_CLASSPATH_RE.search(f.read())
+    if not m:
+      raise ValueError('No classpath found in %s' % script_path)
+    script_dir = os.path.dirname(script_path)
+    for rel_path in json.loads('[%s]' % m.group(1)):
+      self._AddString(rel_path)
+      self.AddZipEntries(os.path.join(script_dir, rel_path))
+
+  def HexDigest(self):
+    return self._hash.hexdigest()
+
+
+class TestListCache:
+  """A directory of test lists, keyed by CacheKey digests.
+
+  The directory can be shared between concurrent runs: entries are written
+  atomically, and an unreadable entry is treated as a miss.
+  """
+
+  def __init__(self, cache_dir):
+    self._cache_dir = cache_dir
+    self._lock = threading.Lock()
+    self._hits = 0
+    self._misses = 0
+    self._key_seconds = 0.0
+    self._list_seconds = 0.0
+    self._saved_seconds = 0.0
+
+  @property
+  def cache_dir(self):
+    return self._cache_dir
+
+  def _EntryPath(self, digest):
+    return os.path.join(self._cache_dir, digest + '.json.gz')
+
+  def _Load(self, digest):
+    path = self._EntryPath(digest)
+    try:
+      with gzip.open(path, 'rt') as f:
+        data = json.load(f)
+    except FileNotFoundError:
+      return None
+    except (IOError, EOFError, ValueError) as e:
+      logging.warning('Ignoring unreadable test list cache entry %s: %s', path,
+                      e)
+      return None
+    if data.get('version') != _VERSION:
+      return None
+    try:
+      # Mark as recently used.
+      os.utime(path)
+    except OSError:
+      pass
+    return data
+
+  def _Save(self, digest, tests, list_seconds):
+    try:
+      os.makedirs(self._cache_dir, exist_ok=True)
+      with tempfile.NamedTemporaryFile(dir=self._cache_dir,
+                                       suffix='.tmp',
+                                       delete=False) as f:
+        with gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as gz:
+          gz.write(
+              json.dumps({
+                  'version': _VERSION,
+                  'list_seconds': list_seconds,
+                  'tests': tests,
+              }).encode('utf-8'))
+      os.replace(f.name, self._EntryPath(digest))
+      self._Prune()
+    except OSError as e:
+      logging.warning('Failed to write test list cache entry: %s', e)
+
+  def _Prune(self):
+    entries = []
+    with os.scandir(self._cache_dir) as it:
+      for entry in it:
+        if entry.name.endswith('.json.gz'):
+          entries.append((entry.stat().st_mtime, entry.path))
+    if len(entries) <= _MAX_ENTRIES:
+      return
+    entries.sort()
+    for _, path in entries[:len(entries) - _MAX_ENTRIES]:
+      try:
+        os.unlink(path)
+      except OSError:
+        pass
+
+  def GetOrList(self, make_key, list_func):
+    """Returns a cached test list, or calls |list_func| and caches its result.
+
+    Args:
+      make_key: Function returning the CacheKey of the list. Called lazily so
+        that hashing counts towards the cache's timing stats.
+      list_func: Function returning the JSON-serializable test list. Results
+        that are empty or None are returned but not cached.
+
+    Returns:
+      The test list.
+    """
+    start = time.time()
+    try:
+      digest = make_key().HexDigest()
+    except (IOError, KeyError, ValueError, zipfile.BadZipFile) as e:
+      logging.warning('Not using test list cache: %s', e)
+      digest = None
+    key_seconds = time.time() - start
+
+    data = digest and self._Load(digest)
+    if data:
+      with self._lock:
+        self._hits += 1
+        self._key_seconds += key_seconds
+        self._saved_seconds += data.get('list_seconds', 0)
+      logging.info('Using cached test list (%d tests, %.2fs to hash inputs).',
+                   len(data['tests']), key_seconds)
+      return data['tests']
+
+    start = time.time()
+    tests = list_func()
+    list_seconds = time.time() - start
+    with self._lock:
+      self._misses += 1
+      self._key_seconds += key_seconds
+      self._list_seconds += list_seconds
+    logging.info('Listed tests in %.2fs (not cached).', list_seconds)
+    if digest and tests:
+      self._Save(digest, tests, list_seconds)
+    return tests
+
+  def GetStats(self):
+    """Returns counts of hits and misses, and time spent in each."""
+    with self._lock:
+      return {
+          'hits': self._hits,
+          'misses': self._misses,
+          'key_seconds': self._key_seconds,
+          'list_seconds': self._list_seconds,
+          'saved_seconds': self._saved_seconds,
+      }
+
+  def LogStats(self):
+    stats = self.GetStats()
+    if not stats['hits'] and not stats['misses']:
+      return
+    logging.info(
+        'Test list cache (%s): %d hits, %d misses. Spent %.2fs hashing, '
+        '%.2fs listing tests, saved ~%.2fs of listing.', self._cache_dir,
+        stats['hits'], stats['misses'], stats['key_seconds'],
+        stats['list_seconds'], stats['saved_seconds'])
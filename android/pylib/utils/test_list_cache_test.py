@@ -0,0 +1,189 @@
+#!/usr/bin/env vpython3
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import tempfile
+import time
+import unittest
+import zipfile
+
+from pylib.utils import test_list_cache
+
+
+def _WriteZip(path, entries, compression=zipfile.ZIP_STORED):
+  with zipfile.ZipFile(path, 'w', compression=compression) as z:
+    for name, data in entries.items():
+      z.writestr(name, data)
+
+
+def _ApkKey(path):
+  key = test_list_cache.CacheKey('test', ['extra'])
+  key.AddZipEntryContents(path, ['classes.dex', 'classes2.dex'])
+  return key
+
+
+class CacheKeyTest(unittest.TestCase):
+
+  def testDependsOnlyOnContents(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      a = os.path.join(tmp_dir, 'a.apk')
+      b = os.path.join(tmp_dir, 'sub', 'b.apk')
+      os.makedirs(os.path.dirname(b))
+      _WriteZip(a, {'classes.dex': b'1', 'classes2.dex': b'2', 'x': b'x'})
+      # Different path, compression and non-dex entries.
+      _WriteZip(b, {
+          'classes2.dex': b'2',
+          'classes.dex': b'1',
+          'y': b'y'
+      },
+                compression=zipfile.ZIP_DEFLATED)
+      self.assertEqual(_ApkKey(a).HexDigest(), _ApkKey(b).HexDigest())
+
+      _WriteZip(b, {'classes.dex': b'1', 'classes2.dex': b'3'})
+      self.assertNotEqual(_ApkKey(a).HexDigest(), _ApkKey(b).HexDigest())
+
+  def testDependsOnKindAndExtras(self):
+    digests = {
+        test_list_cache.CacheKey('gtest').HexDigest(),
+        test_list_cache.CacheKey('junit').HexDigest(),
+        test_list_cache.CacheKey('junit', [True]).HexDigest(),
+        test_list_cache.CacheKey('junit', [False]).HexDigest(),
+    }
+    self.assertEqual(4, len(digests))
+
+  def testZipEntries(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      a = os.path.join(tmp_dir, 'a.zip')
+      b = os.path.join(tmp_dir, 'b.zip')
+      _WriteZip(a, {'lib.so': b'abc'})
+      _WriteZip(b, {'lib.so': b'abc'}, compression=zipfile.ZIP_DEFLATED)
+      digests = []
+      for path in (a, b):
+        key = test_list_cache.CacheKey('gtest')
+        key.AddZipEntries(path)
+        digests.append(key.HexDigest())
+      self.assertEqual(digests[0], digests[1])
+
+  def testDirectory(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      dirs = [os.path.join(tmp_dir, 'a'), os.path.join(tmp_dir, 'b')]
+      for path in dirs:
+        os.makedirs(os.path.join(path, 'sub'))
+        for name in ('exe', os.path.join('sub', 'lib.so')):
+          with open(os.path.join(path, name), 'w') as f:
+            f.write(name)
+
+      def digest(path):
+        key = test_list_cache.CacheKey('gtest')
+        key.AddDirectory(path)
+        return key.HexDigest()
+
+      self.assertEqual(digest(dirs[0]), digest(dirs[1]))
+      os.rename(os.path.join(dirs[1], 'sub', 'lib.so'),
+                os.path.join(dirs[1], 'sub', 'lib2.so'))
+      self.assertNotEqual(digest(dirs[0]), digest(dirs[1]))
+
+  def testJavaBinaryClasspath(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.makedirs(os.path.join(tmp_dir, 'bin'))
+      script = os.path.join(tmp_dir, 'bin', 'suite')
+      with open(script, 'w') as f:
+        f.write('import os\nclasspath = ["../a.jar", "../b.jar"]\n')
+      _WriteZip(os.path.join(tmp_dir, 'a.jar'), {'A.class': b'a'})
+      _WriteZip(os.path.join(tmp_dir, 'b.jar'), {'B.class': b'b'})
+
+      def digest():
+        key = test_list_cache.CacheKey('junit')
+        key.AddJavaBinaryClasspath(script)
+        return key.HexDigest()
+
+      before = digest()
+      _WriteZip(os.path.join(tmp_dir, 'b.jar'), {'B.class': b'c'})
+      self.assertNotEqual(before, digest())
+
+
+class TestListCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    self._cache = test_list_cache.TestListCache(self._tmp_dir.name)
+    self._num_listings = 0
+
+  def tearDown(self):
+    self._tmp_dir.cleanup()
+
+  def _List(self, tests):
+
+    def list_func():
+      self._num_listings += 1
+      return tests
+
+    return list_func
+
+  def testGetOrList(self):
+    key = lambda: test_list_cache.CacheKey('test', [1])
+    tests = [{'class': 'FooTest', 'methods': [{'method': 'testBar'}]}]
+    self.assertEqual(tests, self._cache.GetOrList(key, self._List(tests)))
+    self.assertEqual(tests, self._cache.GetOrList(key, self._List(tests)))
+    self.assertEqual(1, self._num_listings)
+
+    # Entries are shared between instances using the same directory.
+    other = test_list_cache.TestListCache(self._tmp_dir.name)
+    self.assertEqual(tests, other.GetOrList(key, self._List(None)))
+    self.assertEqual(1, self._num_listings)
+
+    stats = self._cache.GetStats()
+    self.assertEqual(1, stats['hits'])
+    self.assertEqual(1, stats['misses'])
+
+  def testEmptyListsAreNotCached(self):
+    key = lambda: test_list_cache.CacheKey('test')
+    self.assertEqual([], self._cache.GetOrList(key, self._List([])))
+    self.assertEqual([], self._cache.GetOrList(key, self._List([])))
+    self.assertEqual(2, self._num_listings)
+
+  def testUnreadableEntry(self):
+    key = test_list_cache.CacheKey('test')
+    path = os.path.join(self._tmp_dir.name, key.HexDigest() + '.json.gz')
+    with open(path, 'wb') as f:
+      f.write(b'garbage')
+    self.assertEqual(['a'], self._cache.GetOrList(lambda: key,
+                                                  self._List(['a'])))
+    self.assertEqual(['a'], self._cache.GetOrList(lambda: key,
+                                                  self._List(['b'])))
+    self.assertEqual(1, self._num_listings)
+
+  def testKeyFailureDisablesCaching(self):
+
+    def key():
+      raise IOError('missing input')
+
+    self.assertEqual(['a'], self._cache.GetOrList(key, self._List(['a'])))
+    self.assertEqual(['a'], self._cache.GetOrList(key, self._List(['a'])))
+    self.assertEqual(2, self._num_listings)
+    self.assertEqual([], os.listdir(self._tmp_dir.name))
+
+  def testPrune(self):
+    old_max = test_list_cache._MAX_ENTRIES
+    test_list_cache._MAX_ENTRIES = 2
+    try:
+      for i in range(3):
+        self._cache.GetOrList(lambda i=i: test_list_cache.CacheKey('test', i),
+                              self._List([i]))
+        # Make sure modification times differ.
+        path = os.path.join(
+            self._tmp_dir.name,
+            test_list_cache.CacheKey('test', i).HexDigest() + '.json.gz')
+        os.utime(path, (time.time() - 10 + i, time.time() - 10 + i))
+    finally:
+      test_list_cache._MAX_ENTRIES = old_max
+    entries = os.listdir(self._tmp_dir.name)
+    self.assertEqual(2, len(entries))
+    self.assertNotIn(
+        test_list_cache.CacheKey('test', 0).HexDigest() + '.json.gz', entries)
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -0,0 +1,172 @@
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Historical test durations, and partitioning of tests into shards."""
+
+import json
+import logging
+import os
+import tempfile
+
+from pylib.base import base_test_result
+
+_VERSION = 1
+
+# Weight given to the most recent duration when updating a test's average.
+_NEW_DURATION_WEIGHT = 0.5
+
+# Only results of tests that ran to completion say how long a test takes.
+_TIMED_RESULT_TYPES = (
+    base_test_result.ResultType.PASS,
+    base_test_result.ResultType.FAIL,
+)
+
+
+class TestTimingDb:
+  """Moving averages of test durations, persisted as a JSON file."""
+
+  def __init__(self, path):
+    self._path = path
+    self._durations = {}
+    self._dirty = False
+    try:
+      with open(path) as f:
+        data = json.load(f)
+      if data.get('version') == _VERSION:
+        self._durations = data['durations']
+      else:
+        logging.info('Ignoring test timing db with old version: %s', path)
+    except FileNotFoundError:
+      pass
+    except (IOError, ValueError, KeyError):
+      logging.warning('Ignoring unreadable test timing db: %s', path)
+
+  def __len__(self):
+    return len(self._durations)
+
+  def GetDuration(self, name):
+    """Returns the expected duration of |name| in ms, or None if unknown."""
+    return self._durations.get(name)
+
+  def AddResults(self, results):
+    """Updates durations from a base_test_result.TestRunResults."""
+    for r in results.GetAll():
+      duration = r.GetDuration()
+      if not duration or r.GetType() not in _TIMED_RESULT_TYPES:
+        continue
+      name = r.GetName()
+      old = self._durations.get(name)
+      if old is not None:
+        duration = (_NEW_DURATION_WEIGHT * duration +
+                    (1 - _NEW_DURATION_WEIGHT) * old)
+      self._durations[name] = duration
+      self._dirty = True
+
+  def Save(self):
+    if not self._dirty:
+      return
+    dirname = os.path.dirname(os.path.abspath(self._path))
+    os.makedirs(dirname, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=dirname, delete=False) as f:
+      json.dump({'version': _VERSION, 'durations': self._durations}, f)
+    os.replace(f.name, self._path)
+    self._dirty = False
+    logging.info('Wrote %d test durations to %s', len(self._durations),
+                 self._path)
+
+
+def PartitionByCount(counts, num_desired_partitions, max_partition_size):
+  """Splits units into contiguous partitions with similar test counts.
+
+  Args:
+    counts: Number of tests in each unit, in the order the units should run.
+    num_desired_partitions: Number of partitions to aim for.
+    max_partition_size: Maximum number of tests per partition. More than
+      |num_desired_partitions| are created if needed to respect it.
+
+  Returns:
+    A list of partitions, each a list of indices into |counts|.
+  """
+  partitions = [[]]
+  num_not_yet_allocated = sum(counts)
+
+  # Fast linear partition approximation capped by max_partition_size. We
+  # cannot round-robin or otherwise re-order tests dynamically because we want
+  # test order to remain stable.
+  partition_size = min(num_not_yet_allocated // num_desired_partitions,
+                       max_partition_size)
+  last_partition_size = 0
+  for i, test_count in enumerate(counts):
+    # Make a new shard whenever we would overfill the previous one. However,
+    # if the size of the test group is larger than the max partition size on
+    # its own, just put the group in its own shard instead of splitting up the
+    # group.
+    if (last_partition_size + test_count > partition_size
+        and last_partition_size > 0):
+      num_desired_partitions -= 1
+      if num_desired_partitions <= 0:
+        # Too many tests for number of partitions, just fill all partitions
+        # beyond num_desired_partitions.
+        partition_size = max_partition_size
+      else:
+        # Re-balance remaining partitions.
+        partition_size = min(num_not_yet_allocated // num_desired_partitions,
+                             max_partition_size)
+      partitions.append([i])
+      last_partition_size = test_count
+    else:
+      partitions[-1].append(i)
+      last_partition_size += test_count
+
+    num_not_yet_allocated -= test_count
+
+  if not partitions[-1]:
+    partitions.pop()
+  return partitions
+
+
+def PartitionByDuration(durations, counts, num_desired_partitions,
+                        max_partition_size):
+  """Splits units into partitions so that the longest one is short.
+
+  Units are assigned longest first, each to the partition with the least total
+  duration that still has room for it (the LPT heuristic). Within a partition
+  units keep their original relative order.
+
+  Args:
+    durations: Expected duration of each unit.
+    counts: Number of tests in each unit.
+    num_desired_partitions: Number of partitions to aim for.
+    max_partition_size: Maximum number of tests per partition. More than
+      |num_desired_partitions| are created if needed to respect it.
+
+  Returns:
+    A list of partitions, each a list of indices into |durations|.
+  """
+  partitions = [[] for _ in range(num_desired_partitions)]
+  loads = [0] * num_desired_partitions
+  sizes = [0] * num_desired_partitions
+  order = sorted(range(len(durations)), key=lambda i: (-durations[i], i))
+  for i in order:
+    candidates = [
+        p for p in range(len(partitions))
+        if sizes[p] == 0 or sizes[p] + counts[i] <= max_partition_size
+    ]
+    if candidates:
+      p = min(candidates, key=lambda p: (loads[p], p))
+    else:
+      p = len(partitions)
+      partitions.append([])
+      loads.append(0)
+      sizes.append(0)
+    partitions[p].append(i)
+    loads[p] += durations[i]
+    sizes[p] += counts[i]
+
+  return [sorted(p) for p in partitions if p]
+
+
+def GetMakespan(partitions, durations):
+  """Returns the total duration of the longest partition."""
+  return max((sum(durations[i] for i in p) for p in partitions), default=0)
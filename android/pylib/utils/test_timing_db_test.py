@@ -0,0 +1,89 @@
+#!/usr/bin/env vpython3
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import random
+import tempfile
+import unittest
+
+from pylib.base import base_test_result
+from pylib.utils import test_timing_db
+
+
+def _Results(*name_type_durations):
+  results = base_test_result.TestRunResults()
+  results.AddResults(
+      base_test_result.BaseTestResult(n, t, duration=d)
+      for n, t, d in name_type_durations)
+  return results
+
+
+class TestTimingDbTest(unittest.TestCase):
+
+  def testAddResultsAndSave(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = os.path.join(tmp_dir, 'sub', 'durations.json')
+      db = test_timing_db.TestTimingDb(path)
+      self.assertEqual(0, len(db))
+      db.AddResults(
+          _Results(('a', base_test_result.ResultType.PASS, 100),
+                   ('b', base_test_result.ResultType.FAIL, 50),
+                   ('c', base_test_result.ResultType.SKIP, 10),
+                   ('d', base_test_result.ResultType.PASS, None)))
+      db.AddResults(_Results(('a', base_test_result.ResultType.PASS, 200)))
+      db.Save()
+
+      db = test_timing_db.TestTimingDb(path)
+      self.assertEqual(150, db.GetDuration('a'))
+      self.assertEqual(50, db.GetDuration('b'))
+      self.assertIsNone(db.GetDuration('c'))
+      self.assertIsNone(db.GetDuration('d'))
+
+  def testCorruptFile(self):
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+      f.write('{')
+      f.flush()
+      self.assertEqual(0, len(test_timing_db.TestTimingDb(f.name)))
+
+
+class PartitionTest(unittest.TestCase):
+
+  def testPartitionByCount(self):
+    self.assertEqual([[0, 1], [2, 3]],
+                     test_timing_db.PartitionByCount([1, 1, 1, 1], 2,
+                                                     float('inf')))
+    # A group larger than the max size gets its own partition.
+    self.assertEqual([[0], [1], [2]],
+                     test_timing_db.PartitionByCount([1, 5, 1], 2, 2))
+
+  def testPartitionByDuration(self):
+    partitions = test_timing_db.PartitionByDuration([1, 10, 2, 3, 4],
+                                                    [1] * 5, 2, float('inf'))
+    self.assertEqual([[0, 2, 3, 4], [1]], sorted(partitions))
+    self.assertEqual(10, test_timing_db.GetMakespan(partitions,
+                                                    [1, 10, 2, 3, 4]))
+
+  def testPartitionByDuration_maxPartitionSize(self):
+    partitions = test_timing_db.PartitionByDuration([1, 1, 1, 1, 1], [1] * 5,
+                                                    2, 2)
+    self.assertEqual(3, len(partitions))
+    self.assertTrue(all(len(p) <= 2 for p in partitions))
+    self.assertEqual(list(range(5)), sorted(i for p in partitions for i in p))
+
+  def testPartitionByDuration_beatsCountOnSkewedSuite(self):
+    rand = random.Random(0)
+    durations = [rand.randint(1, 10) for _ in range(200)]
+    durations[17] = 500
+    counts = [1] * len(durations)
+    by_count = test_timing_db.PartitionByCount(counts, 8, float('inf'))
+    by_duration = test_timing_db.PartitionByDuration(durations, counts, 8,
+                                                     float('inf'))
+    self.assertLess(test_timing_db.GetMakespan(by_duration, durations),
+                    test_timing_db.GetMakespan(by_count, durations))
+    self.assertEqual(500, test_timing_db.GetMakespan(by_duration, durations))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=2)
@@ -0,0 +1,110 @@
+#!/usr/bin/env vpython3
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Compares count-based and duration-based sharding of recorded test runs.
+
+Replays the tests from one or more --json-results-file outputs of
+test_runner.py and reports the expected duration of the longest shard when
+shards are balanced by test count (the default) and by historical duration
+(--test-timing-db).
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+
+from pylib.base import base_test_result
+from pylib.results import json_results
+from pylib.utils import test_timing_db
+
+
+class _InMemoryTimingDb(test_timing_db.TestTimingDb):
+
+  def __init__(self):  # pylint: disable=super-init-not-called
+    self._path = None
+    self._durations = {}
+    self._dirty = False
+
+
+def _LoadSuite(path):
+  with open(path) as f:
+    results = json_results.ParseResultsFromJson(json.load(f))
+  # Use the last recorded duration of each test that ran.
+  return {
+      r.GetName(): r.GetDuration()
+      for r in results if r.GetDuration() and r.GetType() in (
+          base_test_result.ResultType.PASS, base_test_result.ResultType.FAIL)
+  }
+
+
+def _SimulateSuite(actual, timing_db, shard_counts):
+  # Same order as LocalDeviceTestRun._SortTests().
+  names = sorted(actual,
+                 key=lambda n: hashlib.sha256(n.encode()).hexdigest())
+  actual_durations = [actual[n] for n in names]
+  counts = [1] * len(names)
+
+  known = [d for d in map(timing_db.GetDuration, names) if d is not None]
+  default = sorted(known)[len(known) // 2] if known else 1
+  expected_durations = [
+      timing_db.GetDuration(n) or default for n in names
+  ]
+
+  rows = []
+  for num_shards in shard_counts:
+    by_count = test_timing_db.PartitionByCount(counts, num_shards,
+                                               float('inf'))
+    by_duration = test_timing_db.PartitionByDuration(expected_durations,
+                                                     counts, num_shards,
+                                                     float('inf'))
+    rows.append((num_shards,
+                 test_timing_db.GetMakespan(by_count, actual_durations),
+                 test_timing_db.GetMakespan(by_duration, actual_durations)))
+  return len(known), rows
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('results_json',
+                      nargs='+',
+                      help='JSON results files of the runs to replay.')
+  parser.add_argument('--test-timing-db',
+                      help='Timing db to partition with. Defaults to one '
+                      'built from the replayed runs themselves.')
+  parser.add_argument('--shards',
+                      type=int,
+                      nargs='+',
+                      default=[2, 4, 8, 16],
+                      help='Shard counts to simulate.')
+  args = parser.parse_args()
+
+  suites = [(p, _LoadSuite(p)) for p in args.results_json]
+  if args.test_timing_db:
+    timing_db = test_timing_db.TestTimingDb(args.test_timing_db)
+  else:
+    timing_db = _InMemoryTimingDb()
+    for _, suite in suites:
+      results = base_test_result.TestRunResults()
+      results.AddResults(
+          base_test_result.BaseTestResult(
+              n, base_test_result.ResultType.PASS, duration=d)
+          for n, d in suite.items())
+      timing_db.AddResults(results)
+
+  for path, suite in suites:
+    num_known, rows = _SimulateSuite(suite, timing_db, args.shards)
+    print('{}: {} tests, {} in timing db'.format(path, len(suite), num_known))
+    print('  {:>6}  {:>12}  {:>12}  {:>8}'.format('shards', 'by count',
+                                                  'by duration', 'speedup'))
+    for num_shards, by_count, by_duration in rows:
+      print('  {:>6}  {:>11.1f}s  {:>11.1f}s  {:>7.2f}x'.format(
+          num_shards, by_count / 1000.0, by_duration / 1000.0,
+          by_count / by_duration if by_duration else 1.0))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
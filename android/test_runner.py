@@ -10,6 +10,7 @@ from __future__ import absolute_import
 import argparse
 import collections
 import contextlib
+import functools
 import io
 import itertools
 import logging
@@ -52,6 +53,7 @@ from pylib.results.presentation import test_results_presentation
 from pylib.utils import local_utils
 from pylib.utils import logdog_helper
 from pylib.utils import logging_utils
+from pylib.utils import run_metrics
 from pylib.utils import test_filter
 
 from py_utils import contextlib_ext
@@ -95,6 +97,20 @@ def AddTestLauncherOptions(parser):
       help='If set, will dump results in JSON form to the specified file. '
            'Note that this will also trigger saving per-test logcats to '
            'logdog.')
+  parser.add_argument(
+      '--json-results-log',
+      type=os.path.realpath,
+      help='If set, each test result is appended to this JSON lines file as '
+      'soon as it is known, so that results survive the runner being killed. '
+      'Use convert_results_log.py to turn it into a results file or a filter '
+      'file for resuming the run.')
+  parser.add_argument(
+      '--test-script-metrics-dir',
+      type=os.path.realpath,
+      help='If set, timings and counts of the steps of the run (e.g. device '
+      'set up, APK installs, test listing) are written to '
+      'test_script_metrics.jsonpb in this directory. '
+      'build/util/lib/proto/summary.py prints them.')
   parser.add_argument(
       '--test-launcher-shard-index',
       type=int, default=os.environ.get('GTEST_SHARD_INDEX', 0),
@@ -196,6 +212,13 @@ def AddCommonOptions(parser):
                       action='store_true',
                       help='List available tests and exit.')
 
+  parser.add_argument(
+      '--test-list-cache-dir',
+      type=os.path.realpath,
+      help='Directory of cached test lists, keyed by the contents of the '
+      'test binaries. May be shared between output directories and machines. '
+      'Defaults to a directory within the output directory.')
+
   parser.add_argument('--wrapper-script-args',
                       help='A string of args that were passed to the wrapper '
                       'script. This should probably not be edited by a '
@@ -334,6 +357,20 @@ def AddDeviceOptions(parser):
       action='store_true',
       help='Attempt to recover devices prior to the final retry. Warning: '
       'this will cause all devices to reboot.')
+  parser.add_argument(
+      '--test-timing-db',
+      type=os.path.realpath,
+      help='JSON file of historical test durations. When given, tests are '
+      'split across devices by expected duration rather than by count, and '
+      'the file is updated with the durations of this run. External shards '
+      '(--test-launcher-shard-index) are still split by count, as each shard '
+      'may read the file after others have updated it.')
+  parser.add_argument(
+      '--work-stealing',
+      action='store_true',
+      help='Split shards into smaller groups as devices become idle, so that '
+      'devices that finish early take work from slower ones. Only affects '
+      'test types whose shards run as a single invocation (gtests).')
 
   parser.add_argument(
       '--upload-logcats-file',
@@ -832,6 +869,19 @@ def AddJUnitTestOptions(parser):
       'use auto select.')
   parser.add_argument('--shard-filter',
                       help='Comma separated list of shard indices to run.')
+  parser.add_argument(
+      '--reuse-jvms',
+      action='store_true',
+      help='Run all shards assigned to a worker in a single JVM rather than '
+      'starting a JVM per shard. Saves JVM startup and Robolectric warm-up '
+      'for each shard beyond the first, but a crash or timeout loses the '
+      'remaining tests of that worker.')
+  parser.add_argument(
+      '--test-timing-db',
+      type=os.path.realpath,
+      help='JSON file of historical test durations. When given, test classes '
+      'are grouped into shards by expected duration rather than by count, '
+      'and the file is updated with the durations of this run.')
   parser.add_argument(
       '-s', '--test-suite', required=True,
       help='JUnit test suite to run.')
@@ -1021,6 +1071,22 @@ def _SinkTestResult(test_result, test_file_name, result_sink_client):
                           html_artifact=html_artifact)
 
 
+class _IterationResults(list):
+  """The TestRunResults of an iteration's tries.
+
+  Calls |on_try_added| with the index and TestRunResults of each try as it is
+  appended, which happens before the try's tests run.
+  """
+
+  def __init__(self, on_try_added):
+    super().__init__()
+    self._on_try_added = on_try_added
+
+  def append(self, test_run_results):
+    self._on_try_added(len(self), test_run_results)
+    super().append(test_run_results)
+
+
 _SUPPORTED_IN_PLATFORM_MODE = [
   # TODO(jbudorick): Add support for more test types.
   'gtest',
@@ -1081,6 +1147,10 @@ def RunTestsInPlatformMode(args, result_sink_client=None):
 
   global_results_tags = set()
 
+  results_log_writer = None
+  if args.json_results_log:
+    results_log_writer = json_results.ResultsLogWriter(args.json_results_log)
+
   json_file = tempfile.NamedTemporaryFile(delete=False)
   json_file.close()
 
@@ -1098,40 +1168,46 @@ def RunTestsInPlatformMode(args, result_sink_client=None):
 
   @contextlib.contextmanager
   def json_writer():
+    # Whether the test run raised, in which case upload errors are only logged
+    # so that they do not replace its exception.
+    test_run_raised = True
     try:
       yield
+      test_run_raised = False
     except Exception:
       global_results_tags.add('UNRELIABLE_RESULTS')
       raise
     finally:
-      if args.isolated_script_test_output:
-        interrupted = 'UNRELIABLE_RESULTS' in global_results_tags
-        json_results.GenerateJsonTestResultFormatFile(all_raw_results,
-                                                      interrupted,
-                                                      json_file.name,
-                                                      indent=2)
-      else:
-        json_results.GenerateJsonResultsFile(
-            all_raw_results,
-            json_file.name,
-            global_tags=list(global_results_tags),
-            indent=2)
-
-      test_class_to_file_name_dict = {}
-      # Test Location is only supported for instrumentation tests as it
-      # requires the size-info file.
-      if test_instance.TestType() == 'instrumentation':
-        test_class_to_file_name_dict = _CreateClassToFileNameDict(args.test_apk)
+      with run_metrics.Timer('write_results'):
+        if results_log_writer:
+          results_log_writer.Close(all_raw_results, list(global_results_tags))
+        if args.isolated_script_test_output:
+          interrupted = 'UNRELIABLE_RESULTS' in global_results_tags
+          json_results.GenerateJsonTestResultFormatFile(all_raw_results,
+                                                        interrupted,
+                                                        json_file.name,
+                                                        indent=2)
+        else:
+          json_results.GenerateJsonResultsFile(
+              all_raw_results,
+              json_file.name,
+              global_tags=list(global_results_tags),
+              indent=2)
 
       if result_sink_client:
-        for run in all_raw_results:
-          for results in run:
-            for r in results.GetAll():
-              # Matches chrome.page_info.PageInfoViewTest#testChromePage
-              match = re.search(r'^(.+\..+)#', r.GetName())
-              test_file_name = test_class_to_file_name_dict.get(
-                  match.group(1)) if match else None
-              _SinkTestResult(r, test_file_name, result_sink_client)
+        with run_metrics.Timer('upload_results'):
+          # Most results were uploaded as their tries finished. Those of a try
+          # interrupted by an exception still need to be.
+          for iteration, tries in enumerate(all_raw_results):
+            for try_index in range(len(tries)):
+              sink_try_results(iteration, try_index)
+          try:
+            result_sink_client.Flush()
+          except Exception:  # pylint: disable=broad-except
+            if not test_run_raised:
+              raise
+            logging.exception('Failed to upload results to ResultSink.')
+        result_sink_client.LogStats()
 
   @contextlib.contextmanager
   def upload_logcats_file():
@@ -1173,6 +1249,50 @@ def RunTestsInPlatformMode(args, result_sink_client=None):
         result_sink_client.UpdateInvocationExtendedProperties(prop)
         exception_recorder.clear()
 
+  @contextlib.contextmanager
+  def metrics_reporter():
+    try:
+      yield
+    finally:
+      run_metrics.LogSummary()
+      if args.test_script_metrics_dir:
+        run_metrics.Dump(args.test_script_metrics_dir)
+      if result_sink_client:
+        logging.info('Uploading test script metrics to RDB.')
+        result_sink_client.UpdateInvocationExtendedProperties(
+            {run_metrics.TEST_SCRIPT_METRICS_KEY: run_metrics.ToDict()})
+
+  test_class_to_file_name_dict = {}
+  # (iteration, try index) of tries whose results were uploaded.
+  sunk_tries = set()
+
+  def sink_result(r):
+    # Matches chrome.page_info.PageInfoViewTest#testChromePage
+    match = re.search(r'^(.+\..+)#', r.GetName())
+    test_file_name = test_class_to_file_name_dict.get(
+        match.group(1)) if match else None
+    _SinkTestResult(r, test_file_name, result_sink_client)
+
+  def sink_try_results(iteration, try_index):
+    # A test's result can be replaced several times during a try, so results
+    # are uploaded once the try is over, leaving only the last one per test.
+    if (iteration, try_index) in sunk_tries:
+      return
+    sunk_tries.add((iteration, try_index))
+    for r in all_raw_results[iteration][try_index].GetAll():
+      try:
+        sink_result(r)
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('Failed to upload the result of %s.', r.GetName())
+
+  def on_try_added(iteration, try_index, test_run_results):
+    if results_log_writer:
+      results_log_writer.TrackTestRunResults(iteration, try_index,
+                                             test_run_results)
+    if result_sink_client and try_index:
+      # The previous try is over. Upload its results while this one runs.
+      sink_try_results(iteration, try_index - 1)
+
   ### Set up test objects.
 
   out_manager = output_manager_factory.CreateOutputManager(args)
@@ -1197,8 +1317,18 @@ def RunTestsInPlatformMode(args, result_sink_client=None):
           args.command))
       return 1
 
+  if result_sink_client:
+    # Test Location is only supported for instrumentation tests as it
+    # requires the size-info file.
+    if test_instance.TestType() == 'instrumentation':
+      test_class_to_file_name_dict.update(
+          _CreateClassToFileNameDict(args.test_apk))
+    # Upload results in the background as tries finish rather than one at a
+    # time once the run is over.
+    result_sink_client.StartBatchUploads()
+
   ### Run.
-  with out_manager, json_finalizer():
+  with metrics_reporter(), out_manager, json_finalizer():
     # |raw_logs_fh| is only used by Robolectric tests.
     raw_logs_fh = io.StringIO() if save_detailed_results else None
 
@@ -1215,13 +1345,16 @@ def RunTestsInPlatformMode(args, result_sink_client=None):
         # test_run.RunTests(). It is immediately added to all_raw_results so
         # that in the event of an exception, all_raw_results will already have
         # the up-to-date results and those can be written to disk.
-        raw_results = []
+        raw_results = _IterationResults(
+            functools.partial(on_try_added, len(all_raw_results)))
         all_raw_results.append(raw_results)
 
         test_run.RunTests(raw_results, raw_logs_fh=raw_logs_fh)
         if not raw_results:
           all_raw_results.pop()
           continue
+        if result_sink_client:
+          sink_try_results(len(all_raw_results) - 1, len(raw_results) - 1)
 
         iteration_results = base_test_result.TestRunResults()
         for r in reversed(raw_results):
@@ -1472,7 +1605,14 @@ def main():
     args.num_retries = 0
 
   # Result-sink may not exist in the environment if rdb stream is not enabled.
-  result_sink_client = result_sink.TryInitClient()
+  # Large test logs are written to files for the sink to upload, preferably in
+  # the output directory. close() deletes them once uploads are done.
+  artifact_parent_dir = tempfile.gettempdir()
+  if getattr(args, 'output_directory', None):
+    artifact_parent_dir = os.path.join(args.output_directory,
+                                       'result_sink_artifacts')
+  result_sink_client = result_sink.TryInitClient(
+      artifact_parent_dir=artifact_parent_dir)
 
   try:
     return RunTestsCommand(args, result_sink_client)
@@ -1484,6 +1624,12 @@ def main():
   except Exception:  # pylint: disable=W0703
     logging.exception('Unrecognized error occurred.')
     return constants.ERROR_EXIT_CODE
+  finally:
+    if result_sink_client:
+      try:
+        result_sink_client.close()
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('Failed to upload results to ResultSink.')
 
 
 if __name__ == '__main__':
@@ -7,11 +7,14 @@
 
 import argparse
 import collections
+import concurrent.futures
+import io
 import json
 import math
 import os
 import re
 import shutil
+import struct
 import subprocess
 import sys
 import tempfile
@@ -37,6 +40,29 @@ PackageSizes = collections.namedtuple('PackageSizes',
 Blob = collections.namedtuple(
     'Blob', ['name', 'hash', 'compressed', 'uncompressed', 'is_counted'])
 
+# Structure representing the location of a file's contents in a Fuchsia
+# archive (FAR) file.
+FarEntry = collections.namedtuple('FarEntry', ['offset', 'length'])
+
+# Structure representing a blob of a package and where its contents are stored.
+BlobSource = collections.namedtuple('BlobSource',
+                                    ['name', 'hash', 'far_file_path', 'entry'])
+
+# The FAR format is documented at
+# https://fuchsia.dev/fuchsia-src/development/source_code/archive_format
+FAR_MAGIC = b'\xc8\xbf\x0b\x48\xad\xab\xc5\x11'
+_FAR_DIR_CHUNK_TYPE = b'DIR-----'
+_FAR_DIR_NAMES_CHUNK_TYPE = b'DIRNAMES'
+# Magic, index length.
+_FAR_HEADER = struct.Struct('<8sQ')
+# Chunk type, offset, length.
+_FAR_INDEX_ENTRY = struct.Struct('<8sQQ')
+# Name offset, name length, reserved, data offset, data length, reserved.
+_FAR_DIR_ENTRY = struct.Struct('<IHHQQQ')
+
+# Large blobs are copied out of archives this many bytes at a time.
+_COPY_CHUNK_SIZE = 1 << 20
+
 
 def CreateSizesExternalDiagnostic(sizes_guid):
   """Creates a histogram external sizes diagnostic."""
@@ -310,32 +336,65 @@ def GetCompressedSize(file_path):
   return int(math.ceil(blob_bytes / BLOBFS_BLOCK_SIZE)) * BLOBFS_BLOCK_SIZE
 
 
-def ExtractFarFile(file_path, extract_dir):
-  """Extracts contents of a Fuchsia archive file to the specified directory."""
+def _ReadExactly(far_file, offset, length):
+  far_file.seek(offset)
+  data = far_file.read(length)
+  if len(data) != length:
+    raise Exception('Unexpected end of FAR file at offset %d.' % offset)
+  return data
+
+
+def ReadFarIndex(far_file):
+  """Returns a dictionary mapping paths in a Fuchsia archive to FarEntry.
+
+  Only the index of the archive is read, so contents can then be read by
+  offset with ReadFarEntry() instead of extracting the whole archive.
+
+  Args:
+    far_file: The archive, as a binary file object supporting seek().
+  """
+
+  magic, index_length = _FAR_HEADER.unpack(
+      _ReadExactly(far_file, 0, _FAR_HEADER.size))
+  if magic != FAR_MAGIC:
+    raise Exception('Invalid FAR magic number.')
+  index = _ReadExactly(far_file, _FAR_HEADER.size, index_length)
+
+  chunks = {}
+  for index_offset in range(0, index_length, _FAR_INDEX_ENTRY.size):
+    chunk_type, offset, length = _FAR_INDEX_ENTRY.unpack_from(
+        index, index_offset)
+    chunks[chunk_type] = (offset, length)
+  if _FAR_DIR_CHUNK_TYPE not in chunks:
+    # An empty archive.
+    return {}
+  if _FAR_DIR_NAMES_CHUNK_TYPE not in chunks:
+    raise Exception('FAR file has no directory names chunk.')
+  directory = _ReadExactly(far_file, *chunks[_FAR_DIR_CHUNK_TYPE])
+  names = _ReadExactly(far_file, *chunks[_FAR_DIR_NAMES_CHUNK_TYPE])
+
+  entries = {}
+  for dir_offset in range(0, len(directory), _FAR_DIR_ENTRY.size):
+    (name_offset, name_length, _, data_offset, data_length,
+     _) = _FAR_DIR_ENTRY.unpack_from(directory, dir_offset)
+    name = names[name_offset:name_offset + name_length].decode('utf-8')
+    entries[name] = FarEntry(data_offset, data_length)
+  return entries
 
-  far_tool = get_host_tool_path('far')
 
-  if not os.path.isfile(far_tool):
-    raise Exception('Could not find FAR host tool "%s".' % far_tool)
-  if not os.path.isfile(file_path):
-    raise Exception('Could not find FAR file "%s".' % file_path)
+def ReadFarEntry(far_file, entry):
+  """Returns the contents of |entry|, as returned by ReadFarIndex()."""
 
-  subprocess.check_call([
-      far_tool, 'extract',
-      '--archive=%s' % file_path,
-      '--output=%s' % extract_dir
-  ])
+  return _ReadExactly(far_file, entry.offset, entry.length)
 
 
-def GetBlobNameHashes(meta_dir):
-  """Returns mapping from Fuchsia pkgfs paths to blob hashes.  The mapping is
-  read from the extracted meta.far archive contained in an extracted package
-  archive."""
+def ParseMetaContents(contents):
+  """Returns mapping from Fuchsia pkgfs paths to blob hashes, given the text of
+  the meta/contents file of a package's meta.far archive."""
 
   blob_name_hashes = {}
-  contents_path = os.path.join(meta_dir, 'meta', 'contents')
-  with open(contents_path) as lines:
-    for line in lines:
+  for line in contents.splitlines():
+    if line.strip():
       (pkgfs_path, blob_hash) = line.strip().split('=')
       blob_name_hashes[pkgfs_path] = blob_hash
   return blob_name_hashes
@@ -383,64 +442,117 @@ def GetPackageMerkleRoot(far_file_path):
   return output.splitlines()[0].split()[0]
 
 
-def GetBlobs(far_file, build_out_dir):
-  """Calculates compressed and uncompressed blob sizes for specified FAR file.
-  Marks ICU blobs and blobs from SDK libraries as not counted."""
-
-  base_name = FarBaseName(far_file)
-
-  extract_dir = tempfile.mkdtemp()
-
-  # Extract files and blobs from the specified Fuchsia archive.
-  far_file_path = os.path.join(build_out_dir, far_file)
-  far_extract_dir = os.path.join(extract_dir, base_name)
-  ExtractFarFile(far_file_path, far_extract_dir)
-
-  # Extract the meta.far archive contained in the specified Fuchsia archive.
-  meta_far_file_path = os.path.join(far_extract_dir, 'meta.far')
-  meta_far_extract_dir = os.path.join(extract_dir, '%s_meta' % base_name)
-  ExtractFarFile(meta_far_file_path, meta_far_extract_dir)
-
-  # Map Linux filesystem blob names to blob hashes.
-  blob_name_hashes = GetBlobNameHashes(meta_far_extract_dir)
-
-  # "System" files whose sizes are not charged against component size budgets.
-  # Fuchsia SDK modules and the ICU icudtl.dat file sizes are not counted.
-  system_files = GetSdkModules() | set(['icudtl.dat'])
-
-  # Add the meta.far file blob.
-  blobs = {}
-  meta_name = 'meta.far'
-  meta_hash = GetPackageMerkleRoot(meta_far_file_path)
-  compressed = GetCompressedSize(meta_far_file_path)
-  uncompressed = os.path.getsize(meta_far_file_path)
-  blobs[meta_name] = Blob(meta_name, meta_hash, compressed, uncompressed, True)
-
-  # Add package blobs.
+def GetBlobSources(far_file_path):
+  """Returns the BlobSources of the meta.far and content blobs of a package
+  archive, read from the archive's index without extracting it."""
+
+  with open(far_file_path, 'rb') as far_file:
+    entries = ReadFarIndex(far_file)
+    if 'meta.far' not in entries:
+      raise Exception('Could not find meta.far in "%s".' % far_file_path)
+    meta_far = ReadFarEntry(far_file, entries['meta.far'])
+
+  meta_far_file = io.BytesIO(meta_far)
+  meta_entries = ReadFarIndex(meta_far_file)
+  if 'meta/contents' not in meta_entries:
+    raise Exception('Could not find meta/contents in "%s".' % far_file_path)
+  blob_name_hashes = ParseMetaContents(
+      ReadFarEntry(meta_far_file, meta_entries['meta/contents']).decode('utf-8'))
+
+  # The merkleroot tool only reads files, and meta.far is small.
+  with tempfile.TemporaryDirectory() as temp_dir:
+    meta_far_file_path = os.path.join(temp_dir, 'meta.far')
+    with open(meta_far_file_path, 'wb') as f:
+      f.write(meta_far)
+    meta_hash = GetPackageMerkleRoot(meta_far_file_path)
+
+  blob_sources = [
+      BlobSource('meta.far', meta_hash, far_file_path, entries['meta.far'])
+  ]
   for blob_name, blob_hash in blob_name_hashes.items():
-    extracted_blob_path = os.path.join(far_extract_dir, blob_hash)
-    compressed = GetCompressedSize(extracted_blob_path)
-    uncompressed = os.path.getsize(extracted_blob_path)
-    is_counted = os.path.basename(blob_name) not in system_files
-    blobs[blob_name] = Blob(blob_name, blob_hash, compressed, uncompressed,
-                            is_counted)
-
-  shutil.rmtree(extract_dir)
+    # Content blobs are stored in the package archive under their hashes.
+    if blob_hash not in entries:
+      raise Exception('Could not find blob "%s" (%s) in "%s".' %
+                      (blob_name, blob_hash, far_file_path))
+    blob_sources.append(
+        BlobSource(blob_name, blob_hash, far_file_path, entries[blob_hash]))
+  return blob_sources
+
+
+def GetBlobCompressedSize(blob_source):
+  """Measures the size of a blob, read from its package archive, after blobfs
+  compression."""
+
+  # blobfs-compression only reads files, so the blob is copied to one.
+  with tempfile.TemporaryDirectory() as temp_dir:
+    blob_path = os.path.join(temp_dir, blob_source.hash)
+    with open(blob_source.far_file_path, 'rb') as far_file, \
+        open(blob_path, 'wb') as blob_file:
+      offset, remaining = blob_source.entry
+      while remaining:
+        length = min(remaining, _COPY_CHUNK_SIZE)
+        blob_file.write(_ReadExactly(far_file, offset, length))
+        offset += length
+        remaining -= length
+    return GetCompressedSize(blob_path)
+
+
+def GetUniqueBlobSources(package_blob_sources):
+  """Returns a list with one BlobSource per distinct blob hash."""
+
+  unique_sources = {}
+  for blob_sources in package_blob_sources.values():
+    for blob_source in blob_sources:
+      unique_sources.setdefault(blob_source.hash, blob_source)
+  return list(unique_sources.values())
+
+
+def GetBlobs(blob_sources, compressed_sizes, system_files):
+  """Returns the blobs of a package, given their sources and a mapping from
+  blob hashes to compressed sizes. Marks blobs named like |system_files| as not
+  counted."""
 
+  blobs = {}
+  for blob_source in blob_sources:
+    is_counted = os.path.basename(blob_source.name) not in system_files
+    blobs[blob_source.name] = Blob(blob_source.name, blob_source.hash,
+                                   compressed_sizes[blob_source.hash],
+                                   blob_source.entry.length, is_counted)
   return blobs
 
 
 def GetPackageBlobs(far_files, build_out_dir):
   """Returns dictionary mapping package names to blobs contained in the package.
 
+  Packages are read and blobs are compressed in parallel, and blobs shared by
+  several packages are only compressed once.
+
   Prints package blob size statistics."""
 
-  package_blobs = {}
+  far_file_paths = {}
   for far_file in far_files:
     package_name = FarBaseName(far_file)
-    if package_name in package_blobs:
+    if package_name in far_file_paths:
       raise Exception('Duplicate FAR file base name "%s".' % package_name)
-    package_blobs[package_name] = GetBlobs(far_file, build_out_dir)
+    far_file_paths[package_name] = os.path.join(build_out_dir, far_file)
+
+  with concurrent.futures.ProcessPoolExecutor() as executor:
+    package_blob_sources = dict(
+        zip(far_file_paths.keys(),
+            executor.map(GetBlobSources, far_file_paths.values())))
+    unique_sources = GetUniqueBlobSources(package_blob_sources)
+    compressed_sizes = dict(
+        zip((s.hash for s in unique_sources),
+            executor.map(GetBlobCompressedSize, unique_sources)))
+
+  # "System" files whose sizes are not charged against component size budgets.
+  # Fuchsia SDK modules and the ICU icudtl.dat file sizes are not counted.
+  system_files = GetSdkModules() | set(['icudtl.dat'])
+
+  package_blobs = {}
+  for package_name, blob_sources in package_blob_sources.items():
+    package_blobs[package_name] = GetBlobs(blob_sources, compressed_sizes,
+                                           system_files)
 
   # Print package blob sizes (does not count sharing).
   for package_name in sorted(package_blobs.keys()):
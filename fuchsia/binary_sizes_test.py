@@ -3,11 +3,15 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import concurrent.futures
+import hashlib
 import json
 import os
 import shutil
+import struct
 import tempfile
 import unittest
+from unittest import mock
 
 import binary_sizes
 
@@ -48,6 +52,149 @@ _EXAMPLE_BLOBS = """
 """
 
 
+def _MakeFar(files):
+  """Returns a Fuchsia archive containing |files|, a dict of path to bytes."""
+
+  def pad(data, alignment):
+    return data + b'\0' * (-len(data) % alignment)
+
+  paths = sorted(files)
+  names = b''
+  name_offsets = []
+  for path in paths:
+    name_offsets.append(len(names))
+    names += path.encode('utf-8')
+  names = pad(names, 8)
+
+  dir_offset = 8 + 8 + 2 * 24
+  names_offset = dir_offset + 32 * len(paths)
+  data_offset = names_offset + len(names)
+  directory = b''
+  data = b''
+  for path, name_offset in zip(paths, name_offsets):
+    # Contents are aligned to 4096 bytes in the archive.
+    start = data_offset + len(data)
+    start += -start % 4096
+    data += b'\0' * (start - data_offset - len(data))
+    directory += struct.pack('<IHHQQQ', name_offset, len(path), 0, start,
+                             len(files[path]), 0)
+    data += files[path]
+
+  header = binary_sizes.FAR_MAGIC + struct.pack('<Q', 2 * 24)
+  index = struct.pack('<8sQQ', b'DIR-----', dir_offset, len(directory))
+  index += struct.pack('<8sQQ', b'DIRNAMES', names_offset, len(names))
+  return header + index + directory + names + data
+
+
+def _MakePackageFar(blobs):
+  """Returns a package archive containing |blobs|, a dict of path to bytes.
+
+  Blob hashes are made up from their contents."""
+
+  contents = ''.join('%s=hash_%s\n' % (path, data.decode('utf-8'))
+                     for path, data in sorted(blobs.items()))
+  meta_far = _MakeFar({
+      'meta/contents': contents.encode('utf-8'),
+      'meta/package': b'{}',
+  })
+  files = {'meta.far': meta_far}
+  for data in blobs.values():
+    files['hash_%s' % data.decode('utf-8')] = data
+  return _MakeFar(files)
+
+
+class TestFarReader(unittest.TestCase):
+
+  def testReadFarIndex(self):
+    files = {'b': b'b' * 5000, 'a/c': b'c', 'd': b''}
+    with tempfile.TemporaryFile() as far_file:
+      far_file.write(_MakeFar(files))
+      entries = binary_sizes.ReadFarIndex(far_file)
+      self.assertEqual(sorted(entries), sorted(files))
+      for path, data in files.items():
+        self.assertEqual(entries[path].length, len(data))
+        self.assertEqual(entries[path].offset % 4096, 0)
+        self.assertEqual(binary_sizes.ReadFarEntry(far_file, entries[path]),
+                         data)
+
+  def testReadFarIndexInvalid(self):
+    with tempfile.TemporaryFile() as far_file:
+      far_file.write(b'not a far file')
+      with self.assertRaises(Exception):
+        binary_sizes.ReadFarIndex(far_file)
+
+  def testReadFarEntryTruncated(self):
+    with tempfile.TemporaryFile() as far_file:
+      far_file.write(_MakeFar({'a': b'a'}))
+      with self.assertRaises(Exception):
+        binary_sizes.ReadFarEntry(far_file, binary_sizes.FarEntry(4096, 2))
+
+
+@mock.patch('binary_sizes.GetSdkModules', return_value=set(['libc.so']))
+@mock.patch('binary_sizes.GetPackageMerkleRoot')
+@mock.patch('binary_sizes.GetCompressedSize')
+@mock.patch('concurrent.futures.ProcessPoolExecutor',
+            concurrent.futures.ThreadPoolExecutor)
+class TestGetPackageBlobs(unittest.TestCase):
+
+  def setUp(self):
+    self._out_dir = tempfile.mkdtemp()
+    self._compressed_paths = []
+
+  def tearDown(self):
+    shutil.rmtree(self._out_dir)
+
+  def _WritePackage(self, name, blobs):
+    with open(os.path.join(self._out_dir, name), 'wb') as far_file:
+      far_file.write(_MakePackageFar(blobs))
+
+  def _GetCompressedSize(self, path):
+    self._compressed_paths.append(path)
+    return os.path.getsize(path) // 2
+
+  def _GetMerkleRoot(self, path):
+    # pylint: disable=no-self-use
+    with open(path, 'rb') as f:
+      return hashlib.sha256(f.read()).hexdigest()
+
+  def testGetPackageBlobs(self, mock_compressed_size, mock_merkle_root, _):
+    mock_compressed_size.side_effect = self._GetCompressedSize
+    mock_merkle_root.side_effect = self._GetMerkleRoot
+    self._WritePackage('a.far', {
+        'lib/liba.so': b'a' * 100,
+        'lib/libc.so': b'c' * 10,
+        'shared': b's' * 50,
+    })
+    self._WritePackage('b.far', {'data/shared': b's' * 50})
+
+    package_blobs = binary_sizes.GetPackageBlobs(['a.far', 'b.far'],
+                                                 self._out_dir)
+
+    self.assertEqual(sorted(package_blobs), ['a', 'b'])
+    self.assertEqual(sorted(package_blobs['a']),
+                     ['lib/liba.so', 'lib/libc.so', 'meta.far', 'shared'])
+    self.assertEqual(package_blobs['a']['lib/liba.so'],
+                     binary_sizes.Blob('lib/liba.so', 'hash_' + 'a' * 100, 50,
+                                       100, True))
+    self.assertFalse(package_blobs['a']['lib/libc.so'].is_counted)
+    self.assertTrue(package_blobs['a']['meta.far'].is_counted)
+    self.assertEqual(package_blobs['b']['data/shared'].hash,
+                     package_blobs['a']['shared'].hash)
+    # The shared blob is only compressed once.
+    self.assertEqual(len(self._compressed_paths), 5)
+
+  def testMissingBlob(self, _, mock_merkle_root, __):
+    mock_merkle_root.return_value = 'meta'
+    far = _MakeFar({
+        'meta.far':
+        _MakeFar({'meta/contents': b'lib/liba.so=missing\n'}),
+    })
+    with open(os.path.join(self._out_dir, 'a.far'), 'wb') as far_file:
+      far_file.write(far)
+    with self.assertRaises(Exception):
+      binary_sizes.GetPackageBlobs(['a.far'], self._out_dir)
+
+
 class TestBinarySizes(unittest.TestCase):
   tmpdir = None
 
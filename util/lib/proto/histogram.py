@@ -0,0 +1,150 @@
+#!/usr/bin/env vpython3
+
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+""" A metric implementation to aggregate the inputs into a histogram.
+
+Unlike DataPoints, recording a value does not allocate a protobuf message or
+take a lock, so it is cheap enough for hot paths such as per-test or
+per-command latencies.
+
+Each power of two is split into |buckets_per_doubling| buckets whose bounds
+grow by the same ratio, so reported percentiles are within a relative error of
+2 ** (1 / |buckets_per_doubling|) - 1, e.g. 4.4% for the default of 16.
+"""
+
+import collections
+import math
+import threading
+
+from typing import Iterable, List, Tuple
+
+from measure import Measure
+from test_script_metrics_pb2 import TestScriptMetric
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+# Values are buffered per thread and added to the buckets this many at a time.
+_BUFFER_SIZE = 1024
+
+# Bucket indexes are offset so that they are non-negative for every positive
+# float, which makes int() round them down.
+_MIN_EXPONENT = -1100
+
+
+class Histogram(Measure):
+
+  def __init__(self,
+               name: str,
+               buckets_per_doubling: int = 16,
+               percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> None:
+    self._name = name
+    self._buckets_per_doubling = buckets_per_doubling
+    self._offset = -_MIN_EXPONENT * buckets_per_doubling
+    self._percentiles = tuple(percentiles)
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    # Buffers of all threads that recorded values.
+    self._buffers: List[List[float]] = []
+    # Bucket index to count. Zeros are counted separately.
+    self._counts = collections.Counter()
+    self._zeros = 0
+    self._count = 0
+    self._sum = 0.0
+    self._min = math.inf
+    self._max = -math.inf
+
+  def record(self, value: float) -> None:
+    if not 0 <= value < math.inf:
+      raise ValueError('Histogram values must be finite and non-negative: %r' %
+                       value)
+    try:
+      buffer = self._local.buffer
+    except AttributeError:
+      buffer = self._local.buffer = []
+      with self._lock:
+        self._buffers.append(buffer)
+    buffer.append(value)
+    if len(buffer) >= _BUFFER_SIZE:
+      with self._lock:
+        self._fold(buffer)
+
+  def _fold(self, buffer: List[float]) -> None:
+    """Moves values from |buffer| into the buckets. Requires |_lock|."""
+    values = buffer[:]
+    if not values:
+      return
+    # Only the copied values are removed, as the owning thread may be
+    # appending.
+    del buffer[:len(values)]
+    log2 = math.log2
+    scale = self._buckets_per_doubling
+    offset = self._offset
+    zeros = values.count(0)
+    if zeros:
+      self._zeros += zeros
+      self._counts.update(
+          [int(log2(v) * scale + offset) for v in values if v])
+    else:
+      self._counts.update([int(log2(v) * scale + offset) for v in values])
+    self._count += len(values)
+    self._sum += math.fsum(values)
+    self._min = min(self._min, min(values))
+    self._max = max(self._max, max(values))
+
+  def _bounds(self, index: int) -> Tuple[float, float]:
+    index -= self._offset
+    return (2**(index / self._buckets_per_doubling),
+            2**((index + 1) / self._buckets_per_doubling))
+
+  def _snapshot(self) -> Tuple[List[Tuple[float, float, int]], int, float,
+                               float, float]:
+    with self._lock:
+      for buffer in self._buffers:
+        self._fold(buffer)
+      buckets = [(0.0, 0.0, self._zeros)] if self._zeros else []
+      buckets.extend(
+          self._bounds(i) + (c, ) for i, c in sorted(self._counts.items()))
+      return buckets, self._count, self._sum, self._min, self._max
+
+  def percentile(self, percentile: float) -> float:
+    """Returns the approximate |percentile| (0-100) of the recorded values."""
+    buckets, count, _, minimum, maximum = self._snapshot()
+    return self._percentile(buckets, count, minimum, maximum, percentile)
+
+  @staticmethod
+  def _percentile(buckets: List[Tuple[float, float, int]], count: int,
+                  minimum: float, maximum: float, percentile: float) -> float:
+    if not count:
+      return 0.0
+    rank = max(1, math.ceil(percentile / 100 * count))
+    seen = 0
+    for lower, upper, bucket_count in buckets:
+      seen += bucket_count
+      if seen >= rank:
+        # The geometric mean of the bounds has the smallest relative error.
+        return min(max(math.sqrt(lower * upper), minimum), maximum)
+    return maximum
+
+  def dump(self) -> TestScriptMetric:
+    buckets, count, total, minimum, maximum = self._snapshot()
+    result = TestScriptMetric()
+    result.name = self._name
+    histogram = result.histogram
+    histogram.SetInParent()
+    histogram.count = count
+    histogram.sum = total
+    if count:
+      histogram.min = minimum
+      histogram.max = maximum
+    for lower, upper, bucket_count in buckets:
+      bucket = histogram.buckets.add()
+      bucket.lower = lower
+      bucket.upper = upper
+      bucket.count = bucket_count
+    for p in self._percentiles:
+      percentile = histogram.percentiles.add()
+      percentile.percentile = p
+      percentile.value = self._percentile(buckets, count, minimum, maximum, p)
+    return result
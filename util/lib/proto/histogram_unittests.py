@@ -0,0 +1,103 @@
+#!/usr/bin/env vpython3
+
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""File for testing histogram.py."""
+
+import math
+import os
+import random
+import threading
+import time
+import unittest
+
+from data_points import DataPoints
+from histogram import Histogram
+
+
+class HistogramTest(unittest.TestCase):
+  """Test histogram.py."""
+
+  def test_no_record(self) -> None:
+    hist = Histogram('a')
+    self.assertEqual(hist.dump().name, 'a')
+    self.assertTrue(hist.dump().HasField('histogram'))
+    self.assertEqual(hist.dump().histogram.count, 0)
+    self.assertEqual(len(hist.dump().histogram.buckets), 0)
+    self.assertEqual(hist.percentile(50), 0)
+
+  def test_one_record(self) -> None:
+    hist = Histogram('b')
+    hist.record(101)
+    result = hist.dump().histogram
+    self.assertEqual(result.count, 1)
+    self.assertEqual(result.sum, 101)
+    self.assertEqual(result.min, 101)
+    self.assertEqual(result.max, 101)
+    self.assertEqual(len(result.buckets), 1)
+    self.assertLessEqual(result.buckets[0].lower, 101)
+    self.assertGreater(result.buckets[0].upper, 101)
+    # Percentiles are clamped to the recorded range.
+    self.assertEqual([p.value for p in result.percentiles], [101, 101, 101])
+
+  def test_zero(self) -> None:
+    hist = Histogram('c')
+    hist.record(0)
+    hist.record(0)
+    hist.record(1)
+    self.assertEqual(hist.percentile(50), 0)
+    self.assertEqual(hist.dump().histogram.buckets[0].count, 2)
+
+  def test_negative(self) -> None:
+    self.assertRaises(ValueError, lambda: Histogram('d').record(-1))
+    self.assertRaises(ValueError, lambda: Histogram('d').record(math.nan))
+
+  def test_percentiles(self) -> None:
+    rand = random.Random(0)
+    values = sorted(rand.expovariate(1 / 0.05) for _ in range(10000))
+    hist = Histogram('e', buckets_per_doubling=16)
+    for v in values:
+      hist.record(v)
+    for p in (1, 50, 90, 99, 99.9):
+      expected = values[int(p / 100 * len(values)) - 1]
+      self.assertAlmostEqual(hist.percentile(p),
+                             expected,
+                             delta=expected * (2**(1 / 16) - 1))
+    result = hist.dump().histogram
+    self.assertEqual(sum(b.count for b in result.buckets), 10000)
+    self.assertEqual([p.percentile for p in result.percentiles], [50, 90, 99])
+    self.assertTrue(
+        all(a.upper <= b.lower
+            for a, b in zip(result.buckets, result.buckets[1:])))
+
+  def test_threads(self) -> None:
+    hist = Histogram('f')
+
+    def record() -> None:
+      for i in range(1000):
+        hist.record(i)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(hist.dump().histogram.count, 8000)
+
+  @unittest.skipUnless(int(os.environ.get('RUN_BENCHMARKS', 0)),
+                       'Set RUN_BENCHMARKS=1 to run.')
+  def test_benchmark(self) -> None:
+    n = 100000
+    values = [random.random() for _ in range(n)]
+    timings = {}
+    for measure in (DataPoints('points'), Histogram('histogram')):
+      start = time.perf_counter()
+      for v in values:
+        measure.record(v)
+      timings[type(measure).__name__] = (time.perf_counter() - start) / n * 1e9
+    print('ns/record: ' + ', '.join('%s %.0f' % kv for kv in timings.items()))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -9,15 +9,20 @@ import json
 import os
 
 from google.protobuf import any_pb2
-from google.protobuf.json_format import MessageToJson
+from google.protobuf.json_format import MessageToDict, MessageToJson
 
 from average import Average
 from count import Count
 from data_points import DataPoints
+from histogram import Histogram
 from measure import Measure
 from metric import Metric
+from summary import format_metrics
 from time_consumption import TimeConsumption
 
+# The key of the metrics in the invocation extended properties in ResultDB.
+TEST_SCRIPT_METRICS_KEY = 'test_script_metrics'
+
 # The file name is used as the key when being loaded into the ResultDB and
 # shouldn't be changed.
 TEST_SCRIPT_METRICS_JSONPB_FILENAME = 'test_script_metrics.jsonpb'
@@ -48,18 +53,40 @@ def data_points(*name_pieces: str) -> DataPoints:
   return _register(DataPoints(_create_name(*name_pieces)))
 
 
+def histogram(*name_pieces: str) -> Histogram:
+  return _register(Histogram(_create_name(*name_pieces)))
+
+
 def time_consumption(*name_pieces: str) -> TimeConsumption:
   return _register(TimeConsumption(_create_name(*name_pieces)))
 
 
+def _to_any() -> any_pb2.Any:
+  any_msg = any_pb2.Any()
+  any_msg.Pack(_metric.dump())
+  return any_msg
+
+
+def to_dict() -> dict:
+  """Converts the metric data into a dict, e.g. to be uploaded to ResultDB.
+
+  The data is wrapped in a protobuf Any message, the same as in dump().
+  """
+  return MessageToDict(_to_any(), preserving_proto_field_name=True)
+
+
+def summary() -> str:
+  """Returns a human readable summary of the metric data."""
+  return format_metrics(_metric.dump())
+
+
 # TODO(crbug.com/343242386): May need to implement a lock and reset logic to
 # clear in-memory data and lock the instance to block further operations and
 # avoid accidentally accumulating data which won't be published at all.
 def dump(dir_path: str) -> None:
   """Dumps the metric data into test_script_metrics.jsonpb in the |path|."""
   os.makedirs(dir_path, exist_ok=True)
-  any_msg = any_pb2.Any()
-  any_msg.Pack(_metric.dump())
+  any_msg = _to_any()
   with open(os.path.join(dir_path, TEST_SCRIPT_METRICS_JSONPB_FILENAME),
             'w',
             encoding='utf-8') as wf:
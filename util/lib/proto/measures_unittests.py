@@ -46,6 +46,9 @@ class MeasuresTest(unittest.TestCase):
   def test_create_data_points(self) -> None:
     self.assertIsInstance(measures.data_points('a'), Measure)
 
+  def test_create_histogram(self) -> None:
+    self.assertIsInstance(measures.histogram('a'), Measure)
+
   def test_register(self) -> None:
     before = len(measures._metric._metrics)
     for x in range(3):
@@ -72,6 +75,24 @@ class MeasuresTest(unittest.TestCase):
     exp.value = 101
     self.assertEqual(message.metrics[-1], exp)
 
+  def test_dump_histogram(self) -> None:
+    hist = measures.histogram('test', 'dump_histogram')
+    for i in range(100):
+      hist.record(i)
+    with tempfile.TemporaryDirectory() as tmpdir:
+      measures.dump(tmpdir)
+      with open(os.path.join(tmpdir,
+                             measures.TEST_SCRIPT_METRICS_JSONPB_FILENAME),
+                'r',
+                encoding='utf-8') as rf:
+        any_msg = json_format.Parse(rf.read(), any_pb2.Any())
+        message = TestScriptMetrics()
+        self.assertTrue(any_msg.Unpack(message))
+    dumped = [m for m in message.metrics if m.name == 'test/dump_histogram']
+    self.assertEqual(len(dumped), 1)
+    self.assertEqual(dumped[0].histogram.count, 100)
+    self.assertEqual(dumped[0].histogram.max, 99)
+
   def test_dump_with_type(self) -> None:
     with tempfile.TemporaryDirectory() as tmpdir:
       measures.dump(tmpdir)
@@ -83,6 +104,20 @@ class MeasuresTest(unittest.TestCase):
         self.assertTrue('"@type":' in txt)
         self.assertTrue(TestScriptMetrics().DESCRIPTOR.full_name in txt)
 
+  def test_to_dict(self) -> None:
+    count = measures.count('test', 'to_dict')
+    count.record()
+    result = measures.to_dict()
+    self.assertEqual(result['@type'],
+                     'type.googleapis.com/' +
+                     TestScriptMetrics().DESCRIPTOR.full_name)
+    self.assertIn({'name': 'test/to_dict', 'value': 1.0}, result['metrics'])
+
+  def test_summary(self) -> None:
+    count = measures.count('test', 'summary')
+    count.record()
+    self.assertIn('test/summary', measures.summary())
+
   def test_dump_create_dir(self) -> None:
     with tempfile.TemporaryDirectory() as tmpdir:
       dir_path = os.path.join(tmpdir, 'hello', 'this', 'dir', 'should', 'not',
@@ -0,0 +1,94 @@
+#!/usr/bin/env vpython3
+
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+""" Prints a human readable summary of the test script metrics.
+
+Example:
+  build/util/lib/proto/summary.py out/test_script_metrics.jsonpb
+"""
+
+import argparse
+import sys
+
+from typing import List
+
+from google.protobuf import any_pb2
+from google.protobuf.json_format import Parse
+
+from test_script_metrics_pb2 import TestScriptMetric, TestScriptMetrics
+
+
+def _format_number(value: float) -> str:
+  if value == int(value) and abs(value) < 1e15:
+    return str(int(value))
+  return '%.3f' % value
+
+
+def _format_histogram(histogram: TestScriptMetric.Histogram) -> str:
+  if not histogram.count:
+    return 'count=0'
+  pieces = [
+      'count=%d' % histogram.count,
+      'sum=%s' % _format_number(histogram.sum),
+      'mean=%s' % _format_number(histogram.sum / histogram.count),
+      'min=%s' % _format_number(histogram.min),
+  ]
+  pieces.extend('p%s=%s' % (_format_number(p.percentile),
+                            _format_number(p.value))
+                for p in histogram.percentiles)
+  pieces.append('max=%s' % _format_number(histogram.max))
+  return ' '.join(pieces)
+
+
+def _format_data_points(points: TestScriptMetric.DataPoints) -> str:
+  values = [p.value for p in points.points]
+  if not values:
+    return 'points=0'
+  return 'points=%d min=%s max=%s last=%s' % (
+      len(values), _format_number(min(values)), _format_number(
+          max(values)), _format_number(values[-1]))
+
+
+def _format_metric(metric: TestScriptMetric) -> str:
+  kind = metric.WhichOneof('OneOf')
+  if kind == 'histogram':
+    return _format_histogram(metric.histogram)
+  if kind == 'points':
+    return _format_data_points(metric.points)
+  return _format_number(metric.value)
+
+
+def format_metrics(metrics: TestScriptMetrics) -> str:
+  """Returns one line per metric, sorted by name."""
+  if not metrics.metrics:
+    return ''
+  rows = sorted((m.name, _format_metric(m)) for m in metrics.metrics)
+  width = max(len(name) for name, _ in rows)
+  return '\n'.join('%s  %s' % (name.ljust(width), value)
+                   for name, value in rows)
+
+
+def load(path: str) -> TestScriptMetrics:
+  """Loads the metrics written by measures.dump() into |path|."""
+  with open(path, encoding='utf-8') as rf:
+    any_msg = Parse(rf.read(), any_pb2.Any())
+  result = TestScriptMetrics()
+  if not any_msg.Unpack(result):
+    raise ValueError('%s does not contain TestScriptMetrics' % path)
+  return result
+
+
+def main(argv: List[str]) -> int:
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('path',
+                      help='A test_script_metrics.jsonpb written by '
+                      'measures.dump().')
+  args = parser.parse_args(argv)
+  print(format_metrics(load(args.path)))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
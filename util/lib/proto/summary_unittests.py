@@ -0,0 +1,80 @@
+#!/usr/bin/env vpython3
+
+# Copyright 2024 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""File for testing summary.py."""
+
+import io
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from google.protobuf import any_pb2
+from google.protobuf.json_format import MessageToJson
+
+import summary
+
+from histogram import Histogram
+from test_script_metrics_pb2 import TestScriptMetric, TestScriptMetrics
+
+
+def _metrics() -> TestScriptMetrics:
+  result = TestScriptMetrics()
+  value = result.metrics.add()
+  value.name = 'b/count'
+  value.value = 3
+  points = result.metrics.add()
+  points.name = 'c/points'
+  for v in (2, 1.5):
+    points.points.points.add().value = v
+  hist = Histogram('a/latency')
+  for v in range(1, 101):
+    hist.record(v)
+  result.metrics.append(hist.dump())
+  return result
+
+
+class SummaryTest(unittest.TestCase):
+  """Test summary.py."""
+
+  def test_format_metrics(self) -> None:
+    lines = summary.format_metrics(_metrics()).split('\n')
+    self.assertEqual(len(lines), 3)
+    self.assertTrue(lines[0].startswith('a/latency  count=100 sum=5050 '))
+    self.assertIn(' min=1 p50=', lines[0])
+    self.assertTrue(lines[0].endswith(' max=100'))
+    self.assertEqual(lines[1], 'b/count    3')
+    self.assertEqual(lines[2], 'c/points   points=2 min=1.500 max=2 last=1.500')
+
+  def test_format_empty(self) -> None:
+    self.assertEqual(summary.format_metrics(TestScriptMetrics()), '')
+    empty = TestScriptMetrics()
+    empty.metrics.append(Histogram('a').dump())
+    self.assertEqual(summary.format_metrics(empty), 'a  count=0')
+
+  def test_main(self) -> None:
+    any_msg = any_pb2.Any()
+    any_msg.Pack(_metrics())
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, 'test_script_metrics.jsonpb')
+      with open(path, 'w', encoding='utf-8') as wf:
+        wf.write(MessageToJson(any_msg))
+      with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+        self.assertEqual(summary.main([path]), 0)
+    self.assertEqual(stdout.getvalue(),
+                     summary.format_metrics(_metrics()) + '\n')
+
+  def test_load_wrong_type(self) -> None:
+    any_msg = any_pb2.Any()
+    any_msg.Pack(TestScriptMetric())
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, 'test_script_metrics.jsonpb')
+      with open(path, 'w', encoding='utf-8') as wf:
+        wf.write(MessageToJson(any_msg))
+      self.assertRaises(ValueError, lambda: summary.load(path))
+
+
+if __name__ == '__main__':
+  unittest.main()
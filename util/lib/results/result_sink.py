@@ -3,15 +3,42 @@
 # found in the LICENSE file.
 from __future__ import absolute_import
 import base64
+import concurrent.futures
 import json
 import logging
 import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
 
 import requests  # pylint: disable=import-error
 from lib.results import result_types
 
 HTML_SUMMARY_MAX = 4096
 
+# Limits of a single ReportTestResults request when uploading in batches.
+_MAX_BATCH_SIZE = 500
+_MAX_BATCH_BYTES = 4 * 1024 * 1024
+# How long a result can wait for its batch to fill up before it is sent.
+_MAX_BATCH_DELAY_SECONDS = 1.0
+_MAX_CONCURRENT_REQUESTS = 4
+
+# Requests that fail with these statuses, or without a response, are retried
+# with exponential backoff.
+_RETRIABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+_MAX_ATTEMPTS = 5
+_INITIAL_RETRY_DELAY_SECONDS = 0.5
+
+# When an artifact directory is given, text artifacts longer than this many
+# characters are written to files and uploaded by the sink from there, rather
+# than being sent base64-encoded.
+MAX_INLINE_ARTIFACT_LENGTH = 64 * 1024
+
+# Characters of text artifacts encoded at a time.
+_BASE64_CHUNK_SIZE = 16 * 1024
+
 _HTML_SUMMARY_ARTIFACT = '<text-artifact artifact-id="HTML Summary" />'
 _TEST_LOG_ARTIFACT = '<text-artifact artifact-id="Test Log" />'
 
@@ -28,18 +55,22 @@ RESULT_MAP = {
 }
 
 
-def TryInitClient():
+def TryInitClient(artifact_parent_dir=None):
   """Tries to initialize a result_sink_client object.
 
   Assumes that rdb stream is already running.
 
+  Args:
+    artifact_parent_dir: See ResultSinkClient. Callers that pass it must
+      close() the client.
+
   Returns:
     A ResultSinkClient for the result_sink server else returns None.
   """
   try:
     with open(os.environ['LUCI_CONTEXT']) as f:
       sink = json.load(f)['result_sink']
-      return ResultSinkClient(sink)
+      return ResultSinkClient(sink, artifact_parent_dir=artifact_parent_dir)
   except KeyError:
     return None
 
@@ -51,7 +82,25 @@ class ResultSinkClient(object):
   server is listening.
   """
 
-  def __init__(self, context):
+  def __init__(self,
+               context,
+               artifact_dir=None,
+               max_inline_artifact_length=MAX_INLINE_ARTIFACT_LENGTH,
+               artifact_parent_dir=None):
+    """Initializes the client.
+
+    Args:
+      context: The result_sink section of LUCI_CONTEXT.
+      artifact_dir: Directory to write large artifacts to. The sink uploads
+        them after Post() returns, so they must be kept until all results are
+        flushed. If None and |artifact_parent_dir| is None too, all
+        artifacts are sent in requests.
+      max_inline_artifact_length: Text artifacts longer than this are written
+        to |artifact_dir| instead of being sent in requests.
+      artifact_parent_dir: Used when |artifact_dir| is None. Large artifacts
+        are written to a temporary directory created in it on first use, which
+        close() deletes once all results are flushed.
+    """
     base_url = 'http://%s/prpc/luci.resultsink.v1.Sink' % context['address']
     self.test_results_url = base_url + '/ReportTestResults'
     self.report_artifacts_url = base_url + '/ReportInvocationLevelArtifacts'
@@ -64,6 +113,23 @@ class ResultSinkClient(object):
     }
     self.session = requests.Session()
     self.session.headers.update(headers)
+    self._batch_uploader = None
+    self._artifact_dir = artifact_dir
+    self._artifact_parent_dir = artifact_parent_dir
+    # Whether |_artifact_dir| was created by, and is deleted by, the client.
+    self._owns_artifact_dir = False
+    self._max_inline_artifact_length = max_inline_artifact_length
+    self._stats_lock = threading.Lock()
+    self._stats = {
+        'requests': 0,
+        'request_bytes': 0,
+        'max_request_bytes': 0,
+        'inline_artifacts': 0,
+        'inline_artifact_bytes': 0,
+        'file_artifacts': 0,
+        'file_artifact_bytes': 0,
+        'max_pending_bytes': 0,
+    }
 
   def __enter__(self):
     return self
@@ -72,8 +138,83 @@ class ResultSinkClient(object):
     self.close()
 
   def close(self):
-    """Closes the session backing the sink."""
-    self.session.close()
+    """Closes the session backing the sink.
+
+    Pending batched uploads are sent first. The artifact directory is deleted
+    afterwards if the client owns it.
+    """
+    try:
+      if self._batch_uploader:
+        self._batch_uploader.Close()
+        self._stats['max_pending_bytes'] = self.GetStats()['max_pending_bytes']
+        self._batch_uploader = None
+    finally:
+      self.session.close()
+      if self._owns_artifact_dir:
+        shutil.rmtree(self._artifact_dir, ignore_errors=True)
+        self._artifact_dir = None
+        self._owns_artifact_dir = False
+
+  def StartBatchUploads(self,
+                        max_batch_size=_MAX_BATCH_SIZE,
+                        max_batch_bytes=_MAX_BATCH_BYTES,
+                        max_batch_delay=_MAX_BATCH_DELAY_SECONDS,
+                        max_concurrent_requests=_MAX_CONCURRENT_REQUESTS):
+    """Makes Post() queue results to be uploaded in the background.
+
+    Results are sent in batches of up to |max_batch_size| results or
+    |max_batch_bytes| bytes, with up to |max_concurrent_requests| requests in
+    flight. A batch is sent at most |max_batch_delay| seconds after its first
+    result was queued, so uploads keep up with a running test suite.
+
+    Upload errors are raised by Flush() or close().
+    """
+    assert not self._batch_uploader, 'Batch uploads already started.'
+    self._batch_uploader = _BatchUploader(self._PostTestResults, max_batch_size,
+                                          max_batch_bytes, max_batch_delay,
+                                          max_concurrent_requests)
+
+  def Flush(self):
+    """Waits for results queued by Post() to be uploaded.
+
+    Raises:
+      The first error encountered while uploading, if any.
+    """
+    if self._batch_uploader:
+      self._batch_uploader.Flush()
+
+  def _PostTestResults(self, serialized_test_results):
+    """Sends a ReportTestResults request, retrying transient failures.
+
+    Args:
+      serialized_test_results: List of JSON-encoded TestResult messages.
+    """
+    data = '{"testResults": [%s]}' % ', '.join(serialized_test_results)
+    with self._stats_lock:
+      self._stats['requests'] += 1
+      self._stats['request_bytes'] += len(data)
+      self._stats['max_request_bytes'] = max(self._stats['max_request_bytes'],
+                                             len(data))
+    delay = _INITIAL_RETRY_DELAY_SECONDS
+    for attempt in range(1, _MAX_ATTEMPTS + 1):
+      try:
+        res = self.session.post(url=self.test_results_url, data=data)
+        if res.status_code not in _RETRIABLE_STATUS_CODES:
+          res.raise_for_status()
+          return
+        if attempt == _MAX_ATTEMPTS:
+          res.raise_for_status()
+        error = 'HTTP %d' % res.status_code
+      except (requests.exceptions.ConnectionError,
+              requests.exceptions.Timeout) as e:
+        if attempt == _MAX_ATTEMPTS:
+          raise
+        error = e
+      logging.warning('Uploading %d test results failed (attempt %d/%d): %s',
+                      len(serialized_test_results), attempt, _MAX_ATTEMPTS,
+                      error)
+      time.sleep(delay)
+      delay *= 2
 
   def Post(self,
            test_id,
@@ -109,6 +250,9 @@ class ResultSinkClient(object):
       tags: An optional list of tuple of key name and value to prepend to the
           test's tags.
 
+    If StartBatchUploads() was called, the result is queued rather than sent
+    right away.
+
     Returns:
       N/A
     """
@@ -156,14 +300,13 @@ class ResultSinkClient(object):
     if (test_log
         and len(tr['summaryHtml']) + len(_TEST_LOG_ARTIFACT) > HTML_SUMMARY_MAX
         or len(tr['summaryHtml']) > HTML_SUMMARY_MAX):
-      b64_summary = base64.b64encode(tr['summaryHtml'].encode()).decode()
-      artifacts.update({'HTML Summary': {'contents': b64_summary}})
+      artifacts.update(
+          {'HTML Summary': self._MakeTextArtifact(tr['summaryHtml'])})
       tr['summaryHtml'] = _HTML_SUMMARY_ARTIFACT
 
     if test_log:
       # Upload the original log without any modifications.
-      b64_log = base64.b64encode(test_log.encode()).decode()
-      artifacts.update({'Test Log': {'contents': b64_log}})
+      artifacts.update({'Test Log': self._MakeTextArtifact(test_log)})
       tr['summaryHtml'] += _TEST_LOG_ARTIFACT
 
     if artifacts:
@@ -185,9 +328,63 @@ class ResultSinkClient(object):
           'repo': 'https://chromium.googlesource.com/chromium/src',
       }
 
-    res = self.session.post(url=self.test_results_url,
-                            data=json.dumps({'testResults': [tr]}))
-    res.raise_for_status()
+    serialized = json.dumps(tr)
+    if self._batch_uploader:
+      self._batch_uploader.Add(serialized)
+    else:
+      self._PostTestResults([serialized])
+
+  def _MakeTextArtifact(self, text):
+    """Returns an Artifact message with the UTF-8 encoded |text|."""
+    if ((not self._artifact_dir and not self._artifact_parent_dir)
+        or len(text) <= self._max_inline_artifact_length):
+      contents = _Base64EncodeText(text)
+      with self._stats_lock:
+        self._stats['inline_artifacts'] += 1
+        self._stats['inline_artifact_bytes'] += len(contents)
+      return {'contents': contents}
+
+    with self._stats_lock:
+      if not self._artifact_dir:
+        os.makedirs(self._artifact_parent_dir, exist_ok=True)
+        self._artifact_dir = tempfile.mkdtemp(prefix='result_sink_artifacts_',
+                                              dir=self._artifact_parent_dir)
+        self._owns_artifact_dir = True
+      artifact_dir = self._artifact_dir
+    with tempfile.NamedTemporaryFile('w',
+                                     encoding='utf-8',
+                                     dir=artifact_dir,
+                                     suffix='.txt',
+                                     delete=False) as f:
+      f.write(text)
+      size = f.tell()
+    with self._stats_lock:
+      self._stats['file_artifacts'] += 1
+      self._stats['file_artifact_bytes'] += size
+    return {'filePath': os.path.abspath(f.name), 'contentType': 'text/plain'}
+
+  def GetStats(self):
+    """Returns counts of requests and artifacts, and their sizes in bytes.
+
+    max_pending_bytes is the most memory used by results queued for batch
+    uploads at any one time.
+    """
+    with self._stats_lock:
+      stats = dict(self._stats)
+    if self._batch_uploader:
+      stats['max_pending_bytes'] = max(stats['max_pending_bytes'],
+                                       self._batch_uploader.max_pending_bytes)
+    return stats
+
+  def LogStats(self):
+    stats = self.GetStats()
+    logging.info(
+        'ResultSink: sent %d requests (%d bytes, largest %d bytes, at most '
+        '%d bytes queued). Artifacts: %d inline (%d bytes), %d in files '
+        '(%d bytes).', stats['requests'], stats['request_bytes'],
+        stats['max_request_bytes'], stats['max_pending_bytes'],
+        stats['inline_artifacts'], stats['inline_artifact_bytes'],
+        stats['file_artifacts'], stats['file_artifact_bytes'])
 
   def ReportInvocationLevelArtifacts(self, artifacts):
     """Uploads invocation-level artifacts to the ResultSink server.
@@ -242,6 +439,116 @@ class ResultSinkClient(object):
     self.UpdateInvocation(invocation, update_mask)
 
 
+class _BatchUploader:
+  """Groups items into batches and posts them from a thread pool."""
+
+  # Queued by Close() to stop the batching thread.
+  _STOP = object()
+
+  def __init__(self, post_func, max_batch_size, max_batch_bytes,
+               max_batch_delay, max_concurrent_requests):
+    self._post_func = post_func
+    self._max_batch_size = max_batch_size
+    self._max_batch_bytes = max_batch_bytes
+    self._max_batch_delay = max_batch_delay
+    self._queue = queue.Queue()
+    self._executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_concurrent_requests)
+    # Limits the number of batches held in memory waiting for a request slot.
+    self._slots = threading.Semaphore(2 * max_concurrent_requests)
+    self._lock = threading.Lock()
+    self._futures = []
+    self._pending_bytes = 0
+    self.max_pending_bytes = 0
+    self._thread = threading.Thread(target=self._Run,
+                                    name='result_sink_uploader',
+                                    daemon=True)
+    self._thread.start()
+
+  def Add(self, item):
+    with self._lock:
+      self._pending_bytes += len(item)
+      self.max_pending_bytes = max(self.max_pending_bytes, self._pending_bytes)
+    self._queue.put(item)
+
+  def _OnSent(self, batch_bytes):
+    self._slots.release()
+    with self._lock:
+      self._pending_bytes -= batch_bytes
+
+  def _Send(self, batch, batch_bytes):
+    self._slots.acquire()
+    future = self._executor.submit(self._post_func, batch)
+    future.add_done_callback(lambda _: self._OnSent(batch_bytes))
+    with self._lock:
+      self._futures.append(future)
+
+  def _Run(self):
+    batch = []
+    batch_bytes = 0
+    deadline = None
+    while True:
+      timeout = None if deadline is None else max(0, deadline - time.time())
+      try:
+        item = self._queue.get(timeout=timeout)
+      except queue.Empty:
+        item = None
+      if isinstance(item, str):
+        if batch and (len(batch) >= self._max_batch_size
+                      or batch_bytes + len(item) > self._max_batch_bytes):
+          self._Send(batch, batch_bytes)
+          batch, batch_bytes = [], 0
+        if not batch:
+          deadline = time.time() + self._max_batch_delay
+        batch.append(item)
+        batch_bytes += len(item)
+        continue
+      # The batch waited long enough, or a flush was requested.
+      if batch:
+        self._Send(batch, batch_bytes)
+        batch, batch_bytes, deadline = [], 0, None
+      if isinstance(item, threading.Event):
+        item.set()
+      elif item is self._STOP:
+        return
+
+  def Flush(self):
+    flushed = threading.Event()
+    self._queue.put(flushed)
+    flushed.wait()
+    with self._lock:
+      futures, self._futures = self._futures, []
+    concurrent.futures.wait(futures)
+    for future in futures:
+      # Raises the first error.
+      future.result()
+
+  def Close(self):
+    try:
+      self.Flush()
+    finally:
+      self._queue.put(self._STOP)
+      self._thread.join()
+      self._executor.shutdown(wait=True)
+
+
+def _Base64EncodeText(text):
+  """Base64-encodes |text| as UTF-8 a chunk at a time.
+
+  Avoids holding the whole of the UTF-8 encoding in memory alongside the
+  result.
+  """
+  parts = []
+  leftover = b''
+  for start in range(0, len(text), _BASE64_CHUNK_SIZE):
+    data = leftover + text[start:start + _BASE64_CHUNK_SIZE].encode()
+    end = len(data) - len(data) % 3
+    parts.append(base64.b64encode(data[:end]).decode())
+    leftover = data[end:]
+  parts.append(base64.b64encode(leftover).decode())
+  return ''.join(parts)
+
+
 def _TruncateToUTF8Bytes(s, length):
   """ Truncates a string to a given number of bytes when encoded as UTF-8.
 
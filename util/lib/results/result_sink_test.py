@@ -3,9 +3,14 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import base64
+import http.server
 import json
 import os
 import sys
+import tempfile
+import threading
+import time
 import unittest
 
 from unittest import mock
@@ -23,6 +28,13 @@ _FAKE_CONTEXT = {
     'auth_token': 'some-auth-token',
 }
 
+_RUN_BENCHMARKS = int(os.environ.get('RUN_BENCHMARKS', 0))
+
+
+def _PostedTestIds(mock_post):
+  return [[tr['testId'] for tr in json.loads(c[1]['data'])['testResults']]
+          for c in mock_post.call_args_list]
+
 
 class InitClientTest(unittest.TestCase):
   @mock.patch.dict(os.environ, {}, clear=True)
@@ -45,6 +57,26 @@ class InitClientTest(unittest.TestCase):
     self.assertEqual(client.session.headers['Authorization'],
                      'ResultSink some-auth-token')
 
+  @mock.patch('requests.Session.post')
+  def testClientWritesLargeArtifactsToOwnDir(self, mock_post):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      context_path = os.path.join(tmp_dir, 'luci_context.json')
+      with open(context_path, 'w') as f:
+        json.dump({'result_sink': _FAKE_CONTEXT}, f)
+      out_dir = os.path.join(tmp_dir, 'out')
+      with mock.patch.dict(os.environ, {'LUCI_CONTEXT': context_path}):
+        client = result_sink.TryInitClient(artifact_parent_dir=out_dir)
+      log = 'a' * (result_sink.MAX_INLINE_ARTIFACT_LENGTH + 1)
+      client.Post('some-test', result_types.PASS, 0, log, None)
+      data = json.loads(mock_post.call_args[1]['data'])
+      path = data['testResults'][0]['artifacts']['Test Log']['filePath']
+      artifact_dir = os.path.dirname(path)
+      self.assertEqual(out_dir, os.path.dirname(artifact_dir))
+      with open(path) as f:
+        self.assertEqual(log, f.read())
+      client.close()
+      self.assertFalse(os.path.exists(artifact_dir))
+
   @mock.patch('requests.Session')
   def testReuseSession(self, mock_session):
     client = result_sink.ResultSinkClient(_FAKE_CONTEXT)
@@ -186,5 +218,183 @@ class ClientTest(unittest.TestCase):
     }, data['testResults'][0]['tags'])
 
 
+class ArtifactTest(unittest.TestCase):
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    self.client = result_sink.ResultSinkClient(_FAKE_CONTEXT,
+                                               artifact_dir=self._tmp_dir.name,
+                                               max_inline_artifact_length=10)
+
+  def tearDown(self):
+    self._tmp_dir.cleanup()
+
+  @mock.patch('requests.Session.post')
+  def testSmallLogIsInline(self, mock_post):
+    self.client.Post('some-test', result_types.PASS, 0, 'short', None)
+    data = json.loads(mock_post.call_args[1]['data'])
+    self.assertEqual({'contents': base64.b64encode(b'short').decode()},
+                     data['testResults'][0]['artifacts']['Test Log'])
+    self.assertEqual([], os.listdir(self._tmp_dir.name))
+
+  @mock.patch('requests.Session.post')
+  def testLargeLogIsWrittenToFile(self, mock_post):
+    log = 'a much longer log \u2603'
+    self.client.Post('some-test', result_types.PASS, 0, log, None)
+    data = json.loads(mock_post.call_args[1]['data'])
+    artifact = data['testResults'][0]['artifacts']['Test Log']
+    self.assertNotIn('contents', artifact)
+    self.assertEqual(self._tmp_dir.name,
+                     os.path.dirname(artifact['filePath']))
+    with open(artifact['filePath'], encoding='utf-8') as f:
+      self.assertEqual(log, f.read())
+
+    stats = self.client.GetStats()
+    self.assertEqual(1, stats['requests'])
+    self.assertEqual(1, stats['file_artifacts'])
+    self.assertEqual(len(log.encode()), stats['file_artifact_bytes'])
+    self.assertEqual(0, stats['inline_artifacts'])
+
+  @mock.patch('requests.Session.post')
+  def testLargeLogIsInlineWithoutArtifactDir(self, mock_post):
+    client = result_sink.ResultSinkClient(_FAKE_CONTEXT,
+                                          max_inline_artifact_length=10)
+    log = 'a much longer log'
+    client.Post('some-test', result_types.PASS, 0, log, None)
+    data = json.loads(mock_post.call_args[1]['data'])
+    self.assertEqual({'contents': base64.b64encode(log.encode()).decode()},
+                     data['testResults'][0]['artifacts']['Test Log'])
+    self.assertEqual(0, client.GetStats()['file_artifacts'])
+
+  def testBase64EncodeText(self):
+    old_chunk_size = result_sink._BASE64_CHUNK_SIZE
+    result_sink._BASE64_CHUNK_SIZE = 4
+    try:
+      # Chunks end within multi-byte characters' encodings.
+      for text in ('', 'a', 'abcd', '\u2603' * 7 + 'ab', 'x\U0001f600' * 5):
+        self.assertEqual(
+            base64.b64encode(text.encode()).decode(),
+            result_sink._Base64EncodeText(text))
+    finally:
+      result_sink._BASE64_CHUNK_SIZE = old_chunk_size
+
+
+class BatchUploadTest(unittest.TestCase):
+  def setUp(self):
+    self.client = result_sink.ResultSinkClient(_FAKE_CONTEXT)
+
+  @mock.patch('requests.Session.post')
+  def testBatchesByCount(self, mock_post):
+    mock_post.return_value.status_code = 200
+    self.client.StartBatchUploads(max_batch_size=2, max_batch_delay=60)
+    for i in range(5):
+      self.client.Post('test%d' % i, result_types.PASS, 0, None, None)
+    self.client.Flush()
+    self.assertEqual([['test0', 'test1'], ['test2', 'test3'], ['test4']],
+                     sorted(_PostedTestIds(mock_post)))
+    self.client.close()
+    self.assertEqual(3, mock_post.call_count)
+    stats = self.client.GetStats()
+    self.assertEqual(3, stats['requests'])
+    self.assertGreater(stats['max_pending_bytes'], 0)
+
+  @mock.patch('requests.Session.post')
+  def testBatchesByBytes(self, mock_post):
+    mock_post.return_value.status_code = 200
+    self.client.StartBatchUploads(max_batch_bytes=1, max_batch_delay=60)
+    for i in range(3):
+      self.client.Post('test%d' % i, result_types.PASS, 0, None, None)
+    self.client.close()
+    self.assertEqual([['test0'], ['test1'], ['test2']],
+                     sorted(_PostedTestIds(mock_post)))
+
+  @mock.patch('requests.Session.post')
+  def testSendsAfterDelay(self, mock_post):
+    mock_post.return_value.status_code = 200
+    self.client.StartBatchUploads(max_batch_delay=0.01)
+    self.client.Post('test', result_types.PASS, 0, None, None)
+    deadline = time.time() + 10
+    while not mock_post.called and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual([['test']], _PostedTestIds(mock_post))
+    self.client.close()
+
+  @mock.patch('time.sleep')
+  @mock.patch('requests.Session.post')
+  def testRetriesTransientErrors(self, mock_post, mock_sleep):
+    unavailable = mock.Mock(status_code=503)
+    ok = mock.Mock(status_code=200)
+    mock_post.side_effect = [
+        unavailable,
+        result_sink.requests.exceptions.ConnectionError('reset'), ok
+    ]
+    self.client.Post('test', result_types.PASS, 0, None, None)
+    self.assertEqual(3, mock_post.call_count)
+    self.assertEqual([mock.call(0.5), mock.call(1.0)],
+                     mock_sleep.call_args_list)
+
+  @mock.patch('time.sleep')
+  @mock.patch('requests.Session.post')
+  def testErrorRaisedOnFlush(self, mock_post, _):
+    response = mock.Mock(status_code=400)
+    response.raise_for_status.side_effect = (
+        result_sink.requests.exceptions.HTTPError('bad request'))
+    mock_post.return_value = response
+    self.client.StartBatchUploads()
+    self.client.Post('test', result_types.PASS, 0, None, None)
+    with self.assertRaises(result_sink.requests.exceptions.HTTPError):
+      self.client.Flush()
+    # Not retried.
+    self.assertEqual(1, mock_post.call_count)
+    self.client.close()
+
+  @unittest.skipUnless(_RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=1 to run.')
+  def testBenchmark(self):
+    num_results = 2000
+    latency = 0.002
+    received = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+      disable_nagle_algorithm = True
+
+      def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        received.append(len(json.loads(body)['testResults']))
+        # Stand-in for the sink forwarding results to ResultDB.
+        time.sleep(latency)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+      def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    context = {
+        'address': '127.0.0.1:%d' % server.server_address[1],
+        'auth_token': 'token',
+    }
+    try:
+      timings = []
+      for batched in (False, True):
+        with result_sink.ResultSinkClient(context) as client:
+          if batched:
+            client.StartBatchUploads()
+          start = time.time()
+          for i in range(num_results):
+            client.Post('Suite.test%d' % i, result_types.PASS, 10, 'log',
+                        None)
+          client.Flush()
+          timings.append(time.time() - start)
+      self.assertEqual(2 * num_results, sum(received))
+      print('Uploaded %d results in %.2fs one at a time, %.2fs batched.' %
+            (num_results, timings[0], timings[1]))
+    finally:
+      server.shutdown()
+      server.server_close()
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -3,14 +3,20 @@
 # found in the LICENSE file.
 """Helper functions for dealing with .zip files."""
 
+import collections
+import concurrent.futures
 import os
 import pathlib
 import posixpath
 import stat
+import struct
 import time
 import zipfile
+import zlib
 
 _FIXED_ZIP_HEADER_LEN = 30
+_LOCAL_FILE_HEADER_SIGNATURE = b'PK\x03\x04'
+_COPY_CHUNK_SIZE = 1024 * 1024
 
 
 def _set_alignment(zip_obj, zip_info, alignment):
@@ -39,6 +45,41 @@ def _hermetic_date_time(timestamp=None):
           utc_time.tm_min, utc_time.tm_sec)
 
 
+def _target_compress_type(zip_file, file_size, compress):
+  """Returns the compress_type add_to_zip_hermetic() would use."""
+  # zipfile will deflate even when it makes the file bigger. To avoid
+  # growing files, disable compression at an arbitrary cut off point.
+  if file_size < 16:
+    return zipfile.ZIP_STORED
+  # None converts to ZIP_STORED, when passed explicitly rather than the
+  # default passed to the ZipFile constructor.
+  if compress is None:
+    return zip_file.compression
+  return zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+
+
+def _add_executable_bits(zipinfo, src_path):
+  """Maintains the executable bits of |src_path| in |zipinfo|."""
+  st = os.stat(src_path)
+  for mode in (stat.S_IXUSR, stat.S_IXGRP, stat.S_IXOTH):
+    if st.st_mode & mode:
+      zipinfo.external_attr |= mode << 16
+
+
+def _check_zip_path(zip_file, zip_path):
+  # Filenames can contain backslashes, but it is more likely that we've
+  # forgotten to use forward slashes as a directory separator.
+  assert '\\' not in zip_path, 'zip_path should not contain \\: ' + zip_path
+  assert not posixpath.isabs(zip_path), 'Absolute zip path: ' + zip_path
+  assert not zip_path.startswith('..'), 'Should not start with ..: ' + zip_path
+  assert posixpath.normpath(zip_path) == zip_path, (
+      f'Non-canonical zip_path: {zip_path} vs: {posixpath.normpath(zip_path)}')
+  # NameToInfo is zipfile's own index of entries. namelist() builds a new list
+  # on each call, which makes adding N entries O(N^2).
+  assert zip_path not in zip_file.NameToInfo, (
+      'Tried to add a duplicate zip entry: ' + zip_path)
+
+
 def add_to_zip_hermetic(zip_file,
                         zip_path,
                         *,
@@ -73,54 +114,149 @@ def add_to_zip_hermetic(zip_file,
   if alignment:
     _set_alignment(zip_file, zipinfo, alignment)
 
-  # Filenames can contain backslashes, but it is more likely that we've
-  # forgotten to use forward slashes as a directory separator.
-  assert '\\' not in zip_path, 'zip_path should not contain \\: ' + zip_path
-  assert not posixpath.isabs(zip_path), 'Absolute zip path: ' + zip_path
-  assert not zip_path.startswith('..'), 'Should not start with ..: ' + zip_path
-  assert posixpath.normpath(zip_path) == zip_path, (
-      f'Non-canonical zip_path: {zip_path} vs: {posixpath.normpath(zip_path)}')
-  assert zip_path not in zip_file.namelist(), (
-      'Tried to add a duplicate zip entry: ' + zip_path)
+  _check_zip_path(zip_file, zip_path)
 
   if src_path and os.path.islink(src_path):
     zipinfo.external_attr |= stat.S_IFLNK << 16  # mark as a symlink
     zip_file.writestr(zipinfo, os.readlink(src_path))
     return
 
-  # Maintain the executable bit.
   if src_path:
-    st = os.stat(src_path)
-    for mode in (stat.S_IXUSR, stat.S_IXGRP, stat.S_IXOTH):
-      if st.st_mode & mode:
-        zipinfo.external_attr |= mode << 16
+    _add_executable_bits(zipinfo, src_path)
 
   if src_path:
     with open(src_path, 'rb') as f:
       data = f.read()
 
-  # zipfile will deflate even when it makes the file bigger. To avoid
-  # growing files, disable compression at an arbitrary cut off point.
-  if len(data) < 16:
-    compress = False
-
-  # None converts to ZIP_STORED, when passed explicitly rather than the
-  # default passed to the ZipFile constructor.
-  compress_type = zip_file.compression
-  if compress is not None:
-    compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+  compress_type = _target_compress_type(zip_file, len(data), compress)
   zip_file.writestr(zipinfo, data, compress_type)
 
 
+def _can_copy_raw(out_zip, info, compress):
+  """Returns whether |info| can be copied without recompressing it."""
+  # Bit 0 is encryption.
+  if info.flag_bits & 0x1:
+    return False
+  if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+    return False
+  # Writing directly to out_zip.fp requires seeking back to the central
+  # directory offset, as zipfile itself does.
+  if not out_zip._seekable:  # pylint: disable=protected-access
+    return False
+  return info.compress_type == _target_compress_type(out_zip, info.file_size,
+                                                     compress)
+
+
+def _copy_raw_entry(out_zip, in_zip, info, zip_path):
+  """Copies the compressed data of |info| into |out_zip| as |zip_path|.
+
+  The local file header is regenerated as add_to_zip_hermetic() would write it
+  (hermetic timestamp, 0644 permissions, no extra field), so the result is
+  byte-identical to decompressing and recompressing with the same settings.
+  """
+  _check_zip_path(out_zip, zip_path)
+  zipinfo = zipfile.ZipInfo(filename=zip_path)
+  zipinfo.external_attr = 0o644 << 16
+  zipinfo.date_time = _hermetic_date_time()
+  zipinfo.compress_type = info.compress_type
+  zipinfo.CRC = info.CRC
+  zipinfo.compress_size = info.compress_size
+  zipinfo.file_size = info.file_size
+
+  # The central directory's extra field may differ from the local one, so the
+  # data offset must be computed from the local header.
+  in_fp = in_zip.fp
+  in_fp.seek(info.header_offset)
+  header = in_fp.read(_FIXED_ZIP_HEADER_LEN)
+  if header[:4] != _LOCAL_FILE_HEADER_SIGNATURE:
+    raise zipfile.BadZipFile('Bad local file header for ' + info.filename)
+  name_len, extra_len = struct.unpack('<HH', header[26:30])
+  in_fp.seek(name_len + extra_len, os.SEEK_CUR)
+
+  def iter_chunks():
+    remaining = info.compress_size
+    while remaining:
+      chunk = in_fp.read(min(remaining, _COPY_CHUNK_SIZE))
+      if not chunk:
+        raise zipfile.BadZipFile('Truncated data for ' + info.filename)
+      remaining -= len(chunk)
+      yield chunk
+
+  _write_raw_entry(out_zip, zipinfo, iter_chunks())
+
+
+def _write_raw_entry(out_zip, zipinfo, chunks):
+  """Writes an entry whose CRC, sizes and compressed data are already known.
+
+  Args:
+    out_zip: The ZipFile to write to. Must be seekable.
+    zipinfo: ZipInfo with compress_type, CRC, compress_size and file_size set.
+    chunks: Iterable of already-compressed data.
+  """
+  # pylint: disable=protected-access
+  with out_zip._lock:
+    if out_zip._writing:
+      raise ValueError('Cannot write while an open writing handle exists.')
+    zip64 = (out_zip._allowZip64
+             and zipinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT)
+    out_fp = out_zip.fp
+    out_fp.seek(out_zip.start_dir)
+    zipinfo.header_offset = out_fp.tell()
+    out_zip._writecheck(zipinfo)
+    out_zip._didModify = True
+    out_fp.write(zipinfo.FileHeader(zip64))
+    for chunk in chunks:
+      out_fp.write(chunk)
+    out_zip.start_dir = out_fp.tell()
+    out_zip.filelist.append(zipinfo)
+    out_zip.NameToInfo[zipinfo.filename] = zipinfo
+  # pylint: enable=protected-access
+
+
+def _read_and_compress(zip_file, zip_path, src_path, compress, timestamp):
+  """Returns (ZipInfo, data) as add_to_zip_hermetic() would write them.
+
+  Runs on a worker thread. zlib releases the GIL while compressing. Returns
+  None for symlinks, which are left to add_to_zip_hermetic().
+  """
+  if os.path.islink(src_path):
+    return None
+  zipinfo = zipfile.ZipInfo(filename=zip_path)
+  zipinfo.external_attr = 0o644 << 16
+  zipinfo.date_time = _hermetic_date_time(timestamp)
+  _add_executable_bits(zipinfo, src_path)
+  with open(src_path, 'rb') as f:
+    data = f.read()
+  zipinfo.compress_type = _target_compress_type(zip_file, len(data), compress)
+  zipinfo.file_size = len(data)
+  zipinfo.CRC = zlib.crc32(data)
+  if zipinfo.compress_type == zipfile.ZIP_DEFLATED:
+    # Matches the compressor zipfile itself uses.
+    level = zip_file.compresslevel
+    if level is None:
+      level = zlib.Z_DEFAULT_COMPRESSION
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(data) + compressor.flush()
+  else:
+    assert zipinfo.compress_type == zipfile.ZIP_STORED
+  zipinfo.compress_size = len(data)
+  return zipinfo, data
+
+
 def add_files_to_zip(inputs,
                      output,
                      *,
                      base_dir=None,
                      compress=None,
                      zip_prefix_path=None,
-                     timestamp=None):
+                     timestamp=None,
+                     num_workers=None):
   """Creates a zip file from a list of files.
 
+  When |num_workers| is greater than 1, entries are read and compressed on a
+  pool of threads and then written in sorted order. The output is
+  byte-identical to compressing serially.
+
   Args:
     inputs: A list of paths to zip, or a list of (zip_path, fs_path) tuples.
     output: Path, fileobj, or ZipFile instance to add files to.
@@ -128,6 +264,7 @@ def add_files_to_zip(inputs,
     compress: Whether to compress
     zip_prefix_path: Path prepended to file path in zip file.
     timestamp: Unix timestamp to use for files in the archive.
+    num_workers: Number of threads to compress entries with.
   """
   if base_dir is None:
     base_dir = '.'
@@ -149,20 +286,59 @@ def add_files_to_zip(inputs,
   if not isinstance(output, zipfile.ZipFile):
     out_zip = zipfile.ZipFile(output, 'w')
 
+  if zip_prefix_path:
+    input_tuples = [(posixpath.join(zip_prefix_path, zip_path), fs_path)
+                    for zip_path, fs_path in input_tuples]
+
+  # Writing precompressed entries requires seeking, as with merge_zips().
+  seekable = out_zip._seekable  # pylint: disable=protected-access
   try:
-    for zip_path, fs_path in input_tuples:
-      if zip_prefix_path:
-        zip_path = posixpath.join(zip_prefix_path, zip_path)
-      add_to_zip_hermetic(out_zip,
-                          zip_path,
-                          src_path=fs_path,
-                          compress=compress,
-                          timestamp=timestamp)
+    if num_workers and num_workers > 1 and seekable:
+      _add_files_to_zip_parallel(out_zip, input_tuples, compress, timestamp,
+                                 num_workers)
+    else:
+      for zip_path, fs_path in input_tuples:
+        add_to_zip_hermetic(out_zip,
+                            zip_path,
+                            src_path=fs_path,
+                            compress=compress,
+                            timestamp=timestamp)
   finally:
     if output is not out_zip:
       out_zip.close()
 
 
+def _add_files_to_zip_parallel(out_zip, input_tuples, compress, timestamp,
+                               num_workers):
+  # Bound the number of in-flight entries so that memory use does not grow with
+  # the size of the archive.
+  max_pending = num_workers * 4
+  with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+    pending = collections.deque()
+    tuples_iter = iter(input_tuples)
+    while True:
+      for zip_path, fs_path in tuples_iter:
+        pending.append((zip_path, fs_path,
+                        executor.submit(_read_and_compress, out_zip, zip_path,
+                                        fs_path, compress, timestamp)))
+        if len(pending) >= max_pending:
+          break
+      if not pending:
+        break
+      zip_path, fs_path, future = pending.popleft()
+      _check_zip_path(out_zip, zip_path)
+      result = future.result()
+      if result is None:
+        add_to_zip_hermetic(out_zip,
+                            zip_path,
+                            src_path=fs_path,
+                            compress=compress,
+                            timestamp=timestamp)
+      else:
+        zipinfo, data = result
+        _write_raw_entry(out_zip, zipinfo, (data, ))
+
+
 def zip_directory(output, base_dir, **kwargs):
   """Zips all files in the given directory."""
   inputs = []
@@ -173,15 +349,24 @@ def zip_directory(output, base_dir, **kwargs):
   add_files_to_zip(inputs, output, base_dir=base_dir, **kwargs)
 
 
-def merge_zips(output, input_zips, path_transform=None, compress=None):
+def merge_zips(output,
+               input_zips,
+               path_transform=None,
+               compress=None,
+               recompress=False):
   """Combines all files from |input_zips| into |output|.
 
+  Entries whose compression method does not change are copied without being
+  decompressed and recompressed.
+
   Args:
     output: Path, fileobj, or ZipFile instance to add files to.
     input_zips: Iterable of paths to zip files to merge.
     path_transform: Called for each entry path. Returns a new path, or None to
         skip the file.
     compress: Overrides compression setting from origin zip entries.
+    recompress: Always decompress and recompress entries. Useful when inputs
+        were compressed at a different level than the output should be.
   """
   assert not isinstance(input_zips, str)  # Easy mistake to make.
   if isinstance(output, zipfile.ZipFile):
@@ -209,14 +394,11 @@ def merge_zips(output, input_zips, path_transform=None, compress=None):
           else:
             dst_name = info.filename
 
-          data = in_zip.read(info)
-
           # If there's a duplicate file, ensure contents is the same and skip
           # adding it multiple times.
           if dst_name in crc_by_name:
             orig_filename, orig_crc = crc_by_name[dst_name]
-            new_crc = zipfile.crc32(data)
-            if new_crc == orig_crc:
+            if info.CRC == orig_crc:
               continue
             msg = f"""File appeared in multiple inputs with differing contents.
 File: {dst_name}
@@ -228,10 +410,13 @@ Input2: {in_file}"""
             compress_entry = compress
           else:
             compress_entry = info.compress_type != zipfile.ZIP_STORED
-          add_to_zip_hermetic(out_zip,
-                              dst_name,
-                              data=data,
-                              compress=compress_entry)
+          if not recompress and _can_copy_raw(out_zip, info, compress_entry):
+            _copy_raw_entry(out_zip, in_zip, info, dst_name)
+          else:
+            add_to_zip_hermetic(out_zip,
+                                dst_name,
+                                data=in_zip.read(info),
+                                compress=compress_entry)
           crc_by_name[dst_name] = (in_file, out_zip.getinfo(dst_name).CRC)
   finally:
     if output is not out_zip:
@@ -8,11 +8,15 @@ import pathlib
 import shutil
 import sys
 import tempfile
+import time
 import unittest
 import zipfile
 
 import zip_helpers
 
+# Set to run benchmarks, which are skipped by default since they are slow.
+_RUN_BENCHMARKS = int(os.environ.get('RUN_BENCHMARKS', 0))
+
 
 def _make_test_zips(tmp_dir, create_conflct=False):
   zip1 = os.path.join(tmp_dir, 'A.zip')
@@ -53,6 +57,102 @@ class ZipHelpersTest(unittest.TestCase):
         with zipfile.ZipFile(zip1, 'a') as dst_zip:
           zip_helpers.merge_zips(dst_zip, [zip2])
 
+  def test_add_to_zip_hermetic__duplicate(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      zip1, _ = _make_test_zips(tmp_dir)
+      with zipfile.ZipFile(zip1, 'a') as z:
+        zip_helpers.add_to_zip_hermetic(z, 'file3', data='C')
+        with self.assertRaises(AssertionError):
+          zip_helpers.add_to_zip_hermetic(z, 'file1', data='A')
+        with self.assertRaises(AssertionError):
+          zip_helpers.add_to_zip_hermetic(z, 'file3', data='C')
+
+  def test_merge_zips__raw_copy_matches_recompress(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      src_zip = os.path.join(tmp_dir, 'src.zip')
+      with zipfile.ZipFile(src_zip, 'w') as z:
+        zip_helpers.add_to_zip_hermetic(z, 'small', data='A')
+        zip_helpers.add_to_zip_hermetic(z,
+                                        'deflated',
+                                        data=os.urandom(1000) * 50,
+                                        compress=True)
+        zip_helpers.add_to_zip_hermetic(z,
+                                        'stored',
+                                        data=os.urandom(1000),
+                                        compress=False)
+        zip_helpers.add_to_zip_hermetic(z, 'dir/\u00e9', data='B' * 100)
+      zip1, zip2 = _make_test_zips(tmp_dir)
+      inputs = [src_zip, zip1, zip2]
+
+      for compress in (None, True, False):
+        raw_zip = os.path.join(tmp_dir, 'raw.zip')
+        recompressed_zip = os.path.join(tmp_dir, 'recompressed.zip')
+        zip_helpers.merge_zips(raw_zip, inputs, compress=compress)
+        zip_helpers.merge_zips(recompressed_zip,
+                               inputs,
+                               compress=compress,
+                               recompress=True)
+        self.assertEqual(pathlib.Path(recompressed_zip).read_bytes(),
+                         pathlib.Path(raw_zip).read_bytes())
+        with zipfile.ZipFile(raw_zip) as z:
+          self.assertIsNone(z.testzip())
+
+  def test_add_files_to_zip__parallel_matches_serial(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      src_dir = os.path.join(tmp_dir, 'src')
+      os.makedirs(os.path.join(src_dir, 'sub'))
+      for i, size in enumerate([0, 5, 100, 10000, 200000] * 10):
+        path = os.path.join(src_dir, 'sub' if i % 2 else '', f'{i}.bin')
+        with open(path, 'wb') as f:
+          f.write(os.urandom(size // 2) + b'A' * (size - size // 2))
+        if i % 7 == 0:
+          os.chmod(path, 0o755)
+      os.symlink('0.bin', os.path.join(src_dir, 'link'))
+
+      for compress in (None, True, False):
+        serial_zip = os.path.join(tmp_dir, 'serial.zip')
+        parallel_zip = os.path.join(tmp_dir, 'parallel.zip')
+        zip_helpers.zip_directory(serial_zip, src_dir, compress=compress)
+        zip_helpers.zip_directory(parallel_zip,
+                                  src_dir,
+                                  compress=compress,
+                                  num_workers=4)
+        self.assertEqual(pathlib.Path(serial_zip).read_bytes(),
+                         pathlib.Path(parallel_zip).read_bytes())
+
+  @unittest.skipUnless(_RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=1 to run.')
+  def test_benchmark_add_files_to_zip__parallel(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      src_dir = os.path.join(tmp_dir, 'src')
+      os.makedirs(src_dir)
+      for i in range(200):
+        with open(os.path.join(src_dir, f'{i}.bin'), 'wb') as f:
+          f.write(os.urandom(256 * 1024) + b'A' * 256 * 1024)
+      total_mb = 200 * 512 / 1024
+      print()
+      for num_workers in sorted({1, 2, 4, os.cpu_count()}):
+        start = time.time()
+        zip_helpers.zip_directory(os.path.join(tmp_dir, 'out.zip'),
+                                  src_dir,
+                                  compress=True,
+                                  num_workers=num_workers)
+        elapsed = time.time() - start
+        print(f'add_files_to_zip: num_workers={num_workers}: '
+              f'{total_mb / elapsed:.1f}MB/s')
+
+  @unittest.skipUnless(_RUN_BENCHMARKS, 'Set RUN_BENCHMARKS=1 to run.')
+  def test_benchmark_add_to_zip_hermetic(self):
+    print()
+    for num_entries in (1000, 10000, 100000):
+      with tempfile.TemporaryFile() as f:
+        with zipfile.ZipFile(f, 'w') as z:
+          start = time.time()
+          for i in range(num_entries):
+            zip_helpers.add_to_zip_hermetic(z, f'dir/{i}.class', data=b'x')
+          elapsed = time.time() - start
+      print(f'add_to_zip_hermetic: {num_entries} entries in {elapsed:.3f}s '
+            f'({elapsed / num_entries * 1e6:.1f}us/entry)')
+
 
 if __name__ == '__main__':
   unittest.main()